@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Benchmark - Time each stage of the floor plan pipeline
+This script generates deterministic synthetic floor plans, times every stage of
+floor_plan_generator.py separately, records peak resident memory, and compares
+the results against a stored baseline.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+from PIL import Image
+
+from floor_plan_profiler import StageProfiler
+from floor_plan_generator import (DETECTION_MAX_PIXELS, FloorPlanAnalysis, FloorPlanGenerator, _PatchDraw,
+                                  auto_detection_factor, compare_room_detections, detect_rooms_in_gray,
+                                  detect_rooms_multiscale)
+
+# Pipeline stages in the order they run
+STAGES = ["decode", "detect", "walls", "fill", "labels", "dimensions", "enhance", "encode"]
+
+# Detection on a downscaled copy, timed alongside but not part of the pipeline total
+SCALED_DETECT_STAGE = "detect_scaled"
+
+# Modules that importing floor_plan_generator must not load eagerly
+HEAVY_MODULES = ["cv2", "matplotlib", "multiprocessing", "socketserver"]
+
+# Run in a fresh interpreter to time a cold import of floor_plan_generator
+IMPORT_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import floor_plan_generator
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "loaded": [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def generate_synthetic_plan(width, height, rooms, wall_thickness=4, seed=0):
+    """
+    Generate a deterministic synthetic floor plan
+
+    Rooms are laid out on a grid as separate wall-outlined rectangles with
+    jittered sizes, so each one is detected as its own room.
+
+    Args:
+        width, height: Image size in pixels
+        rooms: Number of rooms to draw
+        wall_thickness: Wall thickness in pixels
+        seed: Seed for the layout jitter
+
+    Returns:
+        The synthetic plan as an RGB PIL image
+    """
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(np.sqrt(rooms * width / height)))
+    rows = int(np.ceil(rooms / cols))
+    cell_w, cell_h = width / cols, height / rows
+
+    plan = np.full((height, width, 3), 255, dtype=np.uint8)
+    for index in range(rooms):
+        row, col = divmod(index, cols)
+        room_w = int(cell_w * rng.uniform(0.85, 0.95))
+        room_h = int(cell_h * rng.uniform(0.85, 0.95))
+        x1 = int(col * cell_w + (cell_w - room_w) / 2)
+        y1 = int(row * cell_h + (cell_h - room_h) / 2)
+        cv2.rectangle(plan, (x1, y1), (x1 + room_w, y1 + room_h), (0, 0, 0), wall_thickness)
+
+    return Image.fromarray(plan, "RGB")
+
+
+def _measure(func):
+    """
+    Run func, returning (result, wall seconds, peak RSS bytes)
+
+    Peak memory is the resident set high-water mark as measured by
+    StageProfiler, so it includes OpenCV and NumPy buffers; it is None where
+    RSS is unavailable.
+    """
+    stage_profiler = StageProfiler()
+    start = time.perf_counter()
+    with stage_profiler.stage("measure"):
+        result = func()
+    seconds = time.perf_counter() - start
+    return result, seconds, stage_profiler.stages["measure"]["peak_rss_bytes"]
+
+
+def benchmark_plan(path, generator):
+    """
+    Time every pipeline stage for one plan
+
+    Detection is also timed at the automatic detection scale and checked
+    against full-resolution detection.
+
+    Returns:
+        Tuple of (stage measurements, detected room count, detection check)
+    """
+    stages = {}
+
+    def record(name, func):
+        result, seconds, peak = _measure(func)
+        stages[name] = {"seconds": seconds, "peak_rss_bytes": peak}
+        return result
+
+    analysis = FloorPlanAnalysis(path)
+    record("decode", lambda: analysis.rgb)
+    gray = analysis.gray
+    rooms = record("detect", lambda: detect_rooms_in_gray(gray))
+    factor = auto_detection_factor(analysis.size, DETECTION_MAX_PIXELS["contours"])
+    scaled_rooms, _ = record(SCALED_DETECT_STAGE, lambda: detect_rooms_multiscale(gray, "contours", factor))
+    check = dict(compare_room_detections(rooms, scaled_rooms, tolerance=factor), factor=factor)
+    wall_mask = record("walls", lambda: analysis.wall_mask)
+    canvas = record("fill", lambda: generator._composite(wall_mask > 0, rooms))
+
+    # Labels, dimensions and enhancements work in place on the canvas, as in _decorate
+    size = analysis.size
+    draw = _PatchDraw(canvas)
+    record("labels", lambda: generator._draw_labels(draw, rooms, size, generator.color_scheme))
+    record("dimensions", lambda: generator._draw_dimensions(draw, size, generator.color_scheme))
+    record("enhance", lambda: generator._post_process(canvas, generator.post_processing()))
+    enhanced = Image.fromarray(canvas, "RGB")
+    record("encode", lambda: enhanced.save(io.BytesIO(), format="PNG", dpi=(generator.dpi, generator.dpi)))
+
+    return stages, len(rooms), check
+
+
+def benchmark_import(repeat=3):
+    """
+    Time a cold import of floor_plan_generator in fresh interpreters
+
+    Returns:
+        Benchmark case with an "import" stage and the heavy modules it loaded
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE],
+            cwd=script_dir, capture_output=True, text=True, check=True
+        ).stdout
+        measured = json.loads(output.strip().splitlines()[-1])
+        best = measured["seconds"] if best is None else min(best, measured["seconds"])
+        loaded = measured["loaded"]
+
+    print(f"import: {best * 1000:.1f} ms", file=sys.stderr)
+    return {
+        "name": "import",
+        "heavy_modules_loaded": loaded,
+        "stages": {"import": {"seconds": best, "peak_rss_bytes": None}}
+    }
+
+
+def run_benchmarks(sizes, room_counts, wall_thickness=4, repeat=3, plan_dir=None):
+    """
+    Benchmark every combination of size and room count
+
+    Each stage keeps the fastest of repeat runs and the largest peak memory.
+
+    Returns:
+        Dictionary with environment details and one entry per case
+    """
+    generator = FloorPlanGenerator()
+    cases = [benchmark_import(repeat)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for width, height in sizes:
+            for room_count in room_counts:
+                name = f"{width}x{height}_r{room_count}_t{wall_thickness}"
+                path = os.path.join(plan_dir or tmp_dir, f"{name}.png")
+                generate_synthetic_plan(width, height, room_count, wall_thickness).save(path)
+
+                best = {}
+                for _ in range(repeat):
+                    stages, detected, check = benchmark_plan(path, generator)
+                    for stage, measured in stages.items():
+                        current = best.setdefault(stage, dict(measured))
+                        current["seconds"] = min(current["seconds"], measured["seconds"])
+                        if measured["peak_rss_bytes"] is not None:
+                            current["peak_rss_bytes"] = max(current["peak_rss_bytes"] or 0, measured["peak_rss_bytes"])
+
+                total = sum(best[stage]["seconds"] for stage in STAGES)
+                print(f"{name}: {total * 1000:.1f} ms, {detected} rooms detected, detection at 1/{check['factor']} "
+                      f"{'within' if check['within_tolerance'] else 'outside'} tolerance", file=sys.stderr)
+                cases.append({
+                    "name": name,
+                    "width": width,
+                    "height": height,
+                    "rooms": room_count,
+                    "rooms_detected": detected,
+                    "wall_thickness": wall_thickness,
+                    "detection_check": check,
+                    "stages": best
+                })
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__
+        },
+        "repeat": repeat,
+        "cases": cases
+    }
+
+
+def compare_to_baseline(results, baseline, threshold=20.0, min_seconds=0.001):
+    """
+    Find stages that are slower than the baseline by more than threshold percent
+
+    Stages faster than min_seconds in the baseline are ignored as noise. Heavy
+    modules loaded by a plain import of floor_plan_generator, and scaled room
+    detection that does not match full-resolution detection or is slower than
+    it, are always reported.
+
+    Returns:
+        List of regression descriptions
+    """
+    baseline_cases = {case["name"]: case for case in baseline.get("cases", [])}
+    regressions = []
+
+    for case in results["cases"]:
+        for module in case.get("heavy_modules_loaded", []):
+            regressions.append(f"{case['name']}: {module} is loaded at import time")
+        check = case.get("detection_check")
+        if check and not check["within_tolerance"]:
+            regressions.append(
+                f"{case['name']} {SCALED_DETECT_STAGE}: {check['scaled_rooms']} of {check['rooms']} rooms, "
+                f"bbox error {check['max_bbox_error']} px at 1/{check['factor']} scale"
+            )
+        stages = case["stages"]
+        if check and check["factor"] > 1 and stages[SCALED_DETECT_STAGE]["seconds"] > stages["detect"]["seconds"]:
+            regressions.append(
+                f"{case['name']} {SCALED_DETECT_STAGE}: {stages[SCALED_DETECT_STAGE]['seconds'] * 1000:.2f} ms at "
+                f"1/{check['factor']} scale is slower than {stages['detect']['seconds'] * 1000:.2f} ms at full "
+                f"resolution"
+            )
+
+        reference = baseline_cases.get(case["name"])
+        if reference is None:
+            continue
+        for stage, measured in case["stages"].items():
+            before = reference["stages"].get(stage, {}).get("seconds")
+            if before is None or before < min_seconds:
+                continue
+            change = (measured["seconds"] - before) / before * 100
+            if change > threshold:
+                regressions.append(
+                    f"{case['name']} {stage}: {before * 1000:.2f} ms -> "
+                    f"{measured['seconds'] * 1000:.2f} ms (+{change:.0f}%)"
+                )
+
+    return regressions
+
+
+def _parse_sizes(value):
+    """Parse a comma-separated list of WIDTHxHEIGHT sizes"""
+    sizes = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def main():
+    """Main function to run the benchmarks from command line"""
+    parser = argparse.ArgumentParser(description='Floor Plan Benchmark')
+    parser.add_argument('--sizes', default='800x600,1600x1200,3200x2400',
+                        help='Comma-separated plan sizes as WIDTHxHEIGHT')
+    parser.add_argument('--rooms', default='2,8,20,50', help='Comma-separated room counts (2 to 50)')
+    parser.add_argument('--wall-thickness', type=int, default=4, help='Wall thickness in pixels')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is kept')
+    parser.add_argument('--output', '-o', help='Write results as JSON to this path')
+    parser.add_argument('--baseline', help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='Allowed slowdown per stage in percent before failing')
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help='Ignore stages faster than this in the baseline')
+    parser.add_argument('--save-plans', help='Keep the synthetic plans in this directory')
+
+    args = parser.parse_args()
+
+    room_counts = [int(n) for n in args.rooms.split(",")]
+    if any(n < 2 or n > 50 for n in room_counts):
+        print("Error: room counts must be between 2 and 50")
+        sys.exit(1)
+
+    if args.save_plans:
+        os.makedirs(args.save_plans, exist_ok=True)
+
+    results = run_benchmarks(
+        _parse_sizes(args.sizes), room_counts, args.wall_thickness, args.repeat, args.save_plans
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Benchmark results saved to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"\n❌ {len(regressions)} stage(s) regressed by more than {args.threshold:.0f}%:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print(f"\n✅ No stage regressed by more than {args.threshold:.0f}%")
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
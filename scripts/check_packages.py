@@ -1,54 +1,123 @@
 #!/usr/bin/env python3
 """
 Script to check if required Python packages are installed
+Packages are resolved from their metadata without importing them, and the
+result is recorded in a stamp file so later checks return immediately.
 """
 
+import os
 import sys
+import json
+import hashlib
 import importlib.util
 
-def check_package(package):
-    """Check if a package is installed and can be imported"""
+# Module name and candidate distribution names for each required package
+PACKAGES = {
+    'numpy': ('numpy', ['numpy']),
+    'Pillow': ('PIL', ['Pillow', 'pillow']),
+    'opencv-python': ('cv2', ['opencv-python', 'opencv-python-headless',
+                              'opencv-contrib-python', 'opencv-contrib-python-headless']),
+    'matplotlib': ('matplotlib', ['matplotlib'])
+}
+
+
+def get_stamp_path():
+    """Location of the stamp file, overridable with PYTHON_ENV_STAMP"""
+    if os.environ.get('PYTHON_ENV_STAMP'):
+        return os.environ['PYTHON_ENV_STAMP']
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'buildwise', 'python_env_stamp.json')
+
+
+def get_environment_key():
+    """
+    Key identifying the interpreter and its installed packages
+
+    Installing or removing a package changes the modification time of its
+    site-packages directory, so the key changes with the package versions.
+    """
+    digest = hashlib.sha256()
+    digest.update(sys.executable.encode('utf-8'))
+    digest.update(sys.version.encode('utf-8'))
+    for path in sys.path:
+        try:
+            mtime = os.stat(path or '.').st_mtime_ns
+        except OSError:
+            continue
+        digest.update(f"{path}:{mtime}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def find_package(package):
+    """Return the installed version of a package (or 'unknown'), or None if it is missing"""
+    import importlib.metadata
+
+    module, distributions = PACKAGES.get(package, (package, [package]))
     try:
-        # Handle special case for Pillow (imported as PIL)
-        if package == 'Pillow':
-            import PIL
-            version = PIL.__version__
-            print(f"✅ {package} is installed (version: {version})")
-            return True
-        elif package == 'opencv-python':
-            import cv2
-            version = cv2.__version__
-            print(f"✅ {package} is installed (version: {version})")
-            return True
-        elif package == 'numpy':
-            import numpy
-            version = numpy.__version__
-            print(f"✅ {package} is installed (version: {version})")
-            return True
-        elif package == 'matplotlib':
-            import matplotlib
-            version = matplotlib.__version__
-            print(f"✅ {package} is installed (version: {version})")
-            return True
-        else:
-            module = importlib.import_module(package)
-            version = getattr(module, '__version__', 'unknown')
-            print(f"✅ {package} is installed (version: {version})")
-            return True
-    except ImportError:
-        # If import fails, the package is not installed or not importable
+        if importlib.util.find_spec(module) is None:
+            return None
+    except (ImportError, ValueError):
+        return None
+
+    for distribution in distributions:
+        try:
+            return importlib.metadata.version(distribution)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+    return 'unknown'
+
+
+def load_stamp(key):
+    """Return the package versions recorded for key, or None"""
+    try:
+        with open(get_stamp_path()) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stamp.get('key') != key:
+        return None
+    return stamp.get('packages')
+
+
+def save_stamp(key, packages):
+    """Record the package versions for key, ignoring unwritable locations"""
+    path = get_stamp_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'executable': sys.executable, 'packages': packages}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def check_package(package, version):
+    """Report whether a package is installed"""
+    if version is None:
         print(f"❌ {package} is not installed or not importable")
         return False
+    print(f"✅ {package} is installed (version: {version})")
+    return True
+
 
 def main():
     """Main function"""
-    required_packages = ['numpy', 'Pillow', 'opencv-python', 'matplotlib']
+    required_packages = list(PACKAGES)
     missing_packages = []
 
     print("Checking required Python packages...\n")
 
+    key = get_environment_key()
+    versions = load_stamp(key)
+    if versions is None or any(versions.get(package) is None for package in required_packages):
+        versions = {package: find_package(package) for package in required_packages}
+        # Only a complete environment is stamped, so missing packages are re-checked
+        if all(version is not None for version in versions.values()):
+            save_stamp(key, versions)
+
     for package in required_packages:
-        if not check_package(package):
+        if not check_package(package, versions.get(package)):
             missing_packages.append(package)
 
     if missing_packages:
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Cache - Content-addressed on-disk cache for floor plan processing
+Stores detection results (rooms and wall mask) keyed by image content and
+detection parameters, and rendered outputs keyed by the render options.
+Detection results are also indexed by perceptual hash, so near-duplicate
+plans can reuse them.
+"""
+
+import os
+import io
+import hashlib
+import tempfile
+import threading
+import numpy as np
+from floor_plan_similarity import MAX_INDEX_DISTANCE, PerceptualIndex, perceptual_hash
+
+# Default cache size limit in bytes
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# A near-duplicate's signature may differ from the plan's by this many grey levels on average
+# (a cheap pre-check; callers validate the rooms themselves, see find_similar)
+SIMILAR_MAX_MEAN_ERROR = 6.0
+
+# A near-duplicate's aspect ratio may differ from the plan's by this fraction
+SIMILAR_MAX_ASPECT_ERROR = 0.02
+
+
+class FloorPlanCache:
+    """Two-tier cache with size-based LRU eviction and atomic writes"""
+
+    ANALYSIS_SUFFIX = ".npz"
+    RENDER_SUFFIX = ".bin"
+    SIMILAR_INDEX = "similar.idx"
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """Initialize the cache in directory, keeping it under max_bytes"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {
+            "analysis_hits": 0,
+            "analysis_misses": 0,
+            "render_hits": 0,
+            "render_misses": 0,
+            "similar_hits": 0,
+            "similar_misses": 0,
+            "similar_rejected": 0,
+            "evictions": 0
+        }
+        self.similar = PerceptualIndex(os.path.join(directory, self.SIMILAR_INDEX))
+        self._total_bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from the given parts"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(repr(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key, suffix):
+        """Return the file path for a key, sharded by its first two characters"""
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _read(self, path):
+        """Read a cache entry and mark it as recently used, or return None"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_atomic(self, path, data):
+        """Write data to path so concurrent readers never see a partial file"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data)
+        self._evict()
+
+    def _entries(self):
+        """List (mtime, size, path) for every cache entry"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith((self.ANALYSIS_SUFFIX, self.RENDER_SUFFIX)):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Remove least recently used entries once the cache exceeds its limit"""
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+                return
+
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                # Evict down to 90% of the limit to avoid evicting on every write
+                target = self.max_bytes * 0.9
+                for _, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    self.stats["evictions"] += 1
+            self._total_bytes = total
+
+    def get_analysis(self, key):
+        """
+        Load cached detection results
+
+        Returns:
+            Dictionary with size, wall_mask, rooms and label_map, or None on a miss
+        """
+        path = self._path(key, self.ANALYSIS_SUFFIX)
+        data = self._read(path)
+        if data is not None:
+            try:
+                result = _unpack_analysis(data)
+                self.stats["analysis_hits"] += 1
+                return result
+            except Exception:
+                # Drop unreadable entries and treat them as a miss
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        self.stats["analysis_misses"] += 1
+        return None
+
+    def put_analysis(self, key, size, wall_mask, rooms, label_map=None, signature=None, detection_key=None):
+        """
+        Store detection results for an image
+
+        With the image's signature (see floor_plan_similarity) and the key of
+        its detection parameters, the results are also indexed for
+        find_similar.
+        """
+        self._write_atomic(self._path(key, self.ANALYSIS_SUFFIX),
+                           _pack_analysis(size, wall_mask, rooms, label_map, signature))
+        if signature is not None and detection_key is not None:
+            self.similar.add(perceptual_hash(signature), size, _params_digest(detection_key), key)
+
+    def find_similar(self, signature, size, detection_key, max_distance=MAX_INDEX_DISTANCE, validate=None):
+        """
+        Load the detection results of the nearest near-duplicate of an image
+
+        Candidates within max_distance bits of the image's perceptual hash
+        are validated nearest first: the aspect ratio must be within
+        SIMILAR_MAX_ASPECT_ERROR, the signatures within SIMILAR_MAX_MEAN_ERROR
+        grey levels, and validate (if given) must accept the loaded results.
+        Candidates failing validation count as rejected.
+
+        Args:
+            signature: Signature of the image (see floor_plan_similarity)
+            size: Image size as (width, height)
+            detection_key: Key of the detection parameters results must match
+            max_distance: Largest Hamming distance of a candidate's hash
+            validate: Optional function of a loaded candidate returning whether to reuse it
+
+        Returns:
+            Dictionary as from get_analysis (in the near-duplicate's
+            coordinates) plus its Hamming distance, or None on a miss
+        """
+        width, height = size
+        for distance, (other_width, other_height), key in self.similar.query(
+                perceptual_hash(signature), _params_digest(detection_key), max_distance):
+            if abs(other_width * height / (other_height * width) - 1) > SIMILAR_MAX_ASPECT_ERROR:
+                self.stats["similar_rejected"] += 1
+                continue
+            data = self._read(self._path(key, self.ANALYSIS_SUFFIX))
+            if data is None:
+                # Evicted since it was indexed
+                continue
+            try:
+                cached = _unpack_analysis(data)
+            except Exception:
+                continue
+            other = cached.get("signature")
+            if other is None or np.abs(other.astype(np.int16) - signature).mean() > SIMILAR_MAX_MEAN_ERROR:
+                self.stats["similar_rejected"] += 1
+                continue
+            if validate is not None and not validate(cached):
+                self.stats["similar_rejected"] += 1
+                continue
+            self.stats["similar_hits"] += 1
+            cached["distance"] = distance
+            return cached
+        self.stats["similar_misses"] += 1
+        return None
+
+    def hit_rates(self):
+        """Hit rate of each lookup (analysis, render and similar) so far, or None before the first"""
+        rates = {}
+        for name in ("analysis", "render", "similar"):
+            lookups = self.stats[f"{name}_hits"] + self.stats[f"{name}_misses"]
+            rates[name] = round(self.stats[f"{name}_hits"] / lookups, 4) if lookups else None
+        return rates
+
+    def report(self):
+        """Counters and hit rates as a JSON-serialisable dictionary"""
+        return dict(self.stats, hit_rates=self.hit_rates())
+
+    def get_render(self, key):
+        """Load a cached rendered output as bytes, or None on a miss"""
+        data = self._read(self._path(key, self.RENDER_SUFFIX))
+        self.stats["render_hits" if data is not None else "render_misses"] += 1
+        return data
+
+    def put_render(self, key, data):
+        """Store a rendered output"""
+        self._write_atomic(self._path(key, self.RENDER_SUFFIX), data)
+
+
+def _params_digest(detection_key):
+    """64-bit digest of a detection parameter key, as stored in the similarity index"""
+    return int(detection_key[:16], 16)
+
+
+def _pack_analysis(size, wall_mask, rooms, label_map=None, signature=None):
+    """Serialize detection results into a compressed npz blob"""
+    contours = [np.asarray(room.get("contour", np.zeros((0, 1, 2))), dtype=np.int32).reshape(-1, 2)
+                for room in rooms]
+    extra = {} if label_map is None else {"label_map": label_map}
+    if signature is not None:
+        extra["signature"] = signature
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        labels=np.array([room.get("label", -1) for room in rooms], dtype=np.int64),
+        size=np.array(size, dtype=np.int64),
+        wall_bits=np.packbits(wall_mask > 0),
+        room_types=np.array([room["type"] for room in rooms], dtype=str),
+        bboxes=np.array([room["bbox"] for room in rooms], dtype=np.int64).reshape(-1, 4),
+        has_contour=np.array(["contour" in room for room in rooms], dtype=bool),
+        contour_lengths=np.array([len(c) for c in contours], dtype=np.int64),
+        contour_points=np.concatenate(contours) if contours else np.zeros((0, 2), dtype=np.int32),
+        **extra
+    )
+    return buffer.getvalue()
+
+
+def _unpack_analysis(data):
+    """Deserialize detection results written by _pack_analysis"""
+    with np.load(io.BytesIO(data)) as npz:
+        width, height = (int(v) for v in npz["size"])
+        wall_bits = np.unpackbits(npz["wall_bits"], count=width * height)
+        wall_mask = (wall_bits.reshape(height, width) * 255).astype(np.uint8)
+
+        points = npz["contour_points"]
+        offsets = np.concatenate(([0], np.cumsum(npz["contour_lengths"])))
+        rooms = []
+        for i, room_type in enumerate(npz["room_types"]):
+            room = {
+                "type": str(room_type),
+                "bbox": tuple(int(v) for v in npz["bboxes"][i])
+            }
+            if npz["has_contour"][i]:
+                room["contour"] = points[offsets[i]:offsets[i + 1]].reshape(-1, 1, 2)
+            if npz["labels"][i] >= 0:
+                room["label"] = int(npz["labels"][i])
+            rooms.append(room)
+
+        label_map = npz["label_map"] if "label_map" in npz.files else None
+        result = {"size": (width, height), "wall_mask": wall_mask, "rooms": rooms, "label_map": label_map}
+        if "signature" in npz.files:
+            result["signature"] = npz["signature"]
+
+    return result
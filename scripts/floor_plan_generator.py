@@ -5,28 +5,56 @@ This script takes a floor plan image and enhances it with better colors and clar
 """
 
 import os
+import io
 import sys
+import copy
+import struct
 import argparse
+import base64
+import contextlib
+import glob
+import hashlib
+import importlib
+import tempfile
+import threading
 import traceback
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter
-
-# Handle potential import errors gracefully
-try:
-    import cv2
-except ImportError:
-    print("Error: OpenCV (cv2) is not installed. Please install it with: pip install opencv-python")
-    sys.exit(1)
-
-try:
-    import matplotlib.pyplot as plt
-    from matplotlib.colors import LinearSegmentedColormap
-except ImportError:
-    print("Error: Matplotlib is not installed. Please install it with: pip install matplotlib")
-    sys.exit(1)
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+from functools import cached_property
+from PIL import Image, ImageDraw, ImageFont
+
+
+class _LazyModule:
+    """Module proxy that imports the module on first attribute access"""
+
+    def __init__(self, name, install_hint):
+        self._name = name
+        self._install_hint = install_hint
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            # Carry the install hint in the error, as stdout may be a serve or streaming protocol
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as e:
+                raise ImportError(f"{self._install_hint} ({e})", name=self._name) from e
+        return getattr(self._module, attr)
+
+
+# Heavy dependencies are only imported by the stages that use them
+cv2 = _LazyModule("cv2", "OpenCV (cv2) is not installed. Please install it with: pip install opencv-python")
 
 import json
 
+import floor_plan_profiler as profiler
+from floor_plan_cache import FloorPlanCache, DEFAULT_MAX_BYTES
+from floor_plan_similarity import SIGNATURE_SIZE
+from floor_plan_tiles import (DEFAULT_MEMORY_BUDGET, MappedArray, inner_slices, iter_tiles, needs_tiling,
+                              tile_size_for_budget, write_png)
+
 # Define color schemes for different room types
 COLOR_SCHEMES = {
     "modern": {
@@ -79,15 +107,1706 @@ COLOR_SCHEMES = {
     }
 }
 
+# Detection parameters shared by room detection, wall extraction and the cache key
+ROOM_THRESHOLD = 200
+CANNY_THRESHOLDS = (50, 150)
+MIN_ROOM_AREA_RATIO = 0.01
+
+# Overlap between tiles in tiled wall extraction: Canny's gradient and
+# non-maximum suppression read two pixels around each pixel and the 3x3
+# dilation one more; the rest keeps hysteresis chains crossing a tile edge
+WALL_TILE_HALO = 32
+
+# OpenCV's polygon fill is not exact along the edges of a clipped window, so
+# tiles fill room contours over a window grown by this many pixels
+CONTOUR_FILL_MARGIN = 2
+
+# Scale used to convert between pixels and metres
+PIXELS_PER_METER = 40
+
+# Available room detection engines
+DETECTION_ENGINES = ("contours", "components")
+
+# With an "auto" detection scale, each engine detects rooms on at most this many pixels.
+# Downscaling reads every full-resolution pixel once, which costs about as much as contour
+# detection itself: in benchmark_floor_plans.py at 3200x2400, contours take 3.2 ms at full
+# resolution and 3.7 ms at 1/2 (14.6 ms against 32 ms at 6400x4800), components 90 ms and 46 ms
+DETECTION_MAX_PIXELS = {"contours": 16_000_000, "components": 4_000_000}
+
+# Contrast and sharpness factors of the final enhancement (1.0 leaves the image unchanged)
+POST_PROCESSING = {"contrast": 1.2, "sharpness": 1.5}
+
+# Per-scheme overrides of POST_PROCESSING by built-in scheme name; every scheme uses the defaults,
+# and callers opt out with the contrast and sharpness settings
+SCHEME_POST_PROCESSING = {}
+
+# ImageFilter.SMOOTH, the blurred copy ImageEnhance.Sharpness blends away from
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+# Tolerance of simplified room polygons as a fraction of the room's perimeter
+SIMPLIFY_TOLERANCE = 0.01
+
+# Stroke width of walls in SVG output, in image pixels
+SVG_WALL_WIDTH = 3
+
+# Fonts for SVG text, in order of preference
+SVG_FONT_FAMILY = "DejaVu Sans, Helvetica, Arial, sans-serif"
+
+# Default zlib level of PNG outputs (PIL's default) and quality of JPEG outputs
+PNG_COMPRESS_LEVEL = 6
+JPEG_QUALITY = 85
+
+# Longest edge in pixels of each named rendition (None keeps the full size)
+RENDITION_SIZES = {"thumbnail": 320, "preview": 1280, "full": None}
+
+# PIL format and file extension of each rendition format
+RENDITION_FORMATS = {"png": ("PNG", ".png"), "webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+
+# Renditions written by --renditions without a spec
+DEFAULT_RENDITIONS = "thumbnail:webp,preview:webp,full:webp"
+
+# With worker threads, room fills are split into this many row bands per thread to balance the load
+FILL_BANDS_PER_THREAD = 4
+
+# Degradations a plan over its pixel budget may get, in the order they are applied (see admit_floor_plan)
+DEGRADATIONS = ("downscale", "skip_3d", "fast_encode")
+
+# PNG compression level of the fast_encode degradation
+FAST_COMPRESS_LEVEL = 1
+
+# Under a global pixel budget, a job's own budget is never squeezed below this many pixels
+MIN_ADMITTED_PIXELS = 4_000_000
+
+# Share of the plan beyond which an incremental update refills and relabels the whole plan at once
+INCREMENTAL_MAX_DIRTY = 0.5
+
+# A near-duplicate's rooms are checked against the plan's own walls downscaled to at most this many pixels
+SIMILAR_CHECK_PIXELS = 250_000
+
+# Share of the check image where a near-duplicate's rooms may disagree with the plan's enclosed regions
+SIMILAR_MAX_MISMATCH = 0.01
+
+
+class FloorPlanAnalysis:
+    """
+    Decoded floor plan shared across the enhance, 3D and export stages
+
+    The image is decoded once and every intermediate (grayscale, edge map,
+    wall mask, detected rooms) is computed lazily on first use.
+    """
+
+    def __init__(self, source, detection="contours", detection_scale=1, decode_size=None):
+        """
+        Create an analysis from an image path, encoded image bytes, a NumPy array or a PIL image
+
+        Args:
+            source: Path to the floor plan image, the encoded image as bytes,
+                a grayscale or RGB uint8 array, or a PIL image
+            detection: Room detection engine, one of DETECTION_ENGINES
+            detection_scale: Downscale factor for room detection (1, the
+                default, detects at full resolution), or "auto" to pick one
+                from the image size and engine (see DETECTION_MAX_PIXELS)
+            decode_size: Optional size (width, height) to downscale the plan to
+                as it is decoded; JPEG plans are decoded straight at a reduced
+                resolution (Image.draft)
+        """
+        if detection not in DETECTION_ENGINES:
+            raise ValueError(f"Unknown detection engine '{detection}'")
+        if detection_scale != "auto" and int(detection_scale) < 1:
+            raise ValueError(f"Invalid detection scale '{detection_scale}'")
+        self.detection = detection
+        self.detection_scale = detection_scale
+        self.decode_size = decode_size
+        self._data = None
+        if isinstance(source, Image.Image):
+            self.path = None
+            self._source = source
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            # Decoded lazily, like a file
+            self.path = None
+            self._data = bytes(source)
+            self._source = Image.open(io.BytesIO(self._data))
+        elif isinstance(source, np.ndarray):
+            self.path = None
+            self._source = Image.fromarray(source)
+        else:
+            self.path = source
+            self._source = None
+
+    @cached_property
+    def image(self):
+        """The floor plan as an RGB PIL image"""
+        with profiler.stage("decode"):
+            source = self._source if self._source is not None else Image.open(self.path)
+            if self.decode_size is None:
+                return source.convert("RGB")
+            source.draft("RGB", self.decode_size)
+            return source.convert("RGB").resize(self.decode_size, Image.LANCZOS, reducing_gap=2.0)
+
+    @cached_property
+    def size(self):
+        """Image size as (width, height), read from the file header if not yet decoded"""
+        if self.decode_size is not None:
+            return tuple(self.decode_size)
+        if "image" in self.__dict__:
+            return self.image.size
+        if self._source is not None:
+            return self._source.size
+        with Image.open(self.path) as image:
+            return image.size
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @cached_property
+    def content_hash(self):
+        """SHA-256 of the encoded file or bytes, or of the pixels for in-memory images"""
+        digest = hashlib.sha256()
+        if self._data is not None:
+            digest.update(self._data)
+        elif self.path is not None:
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(repr(self.rgb.shape).encode("utf-8"))
+            digest.update(self.rgb.tobytes())
+        if self.decode_size is not None:
+            digest.update(repr(tuple(self.decode_size)).encode("utf-8"))
+        return digest.hexdigest()
+
+    @property
+    def cache_key(self):
+        """Cache key for the detection results of this image"""
+        return FloorPlanCache.key(self.content_hash, ROOM_THRESHOLD, CANNY_THRESHOLDS, MIN_ROOM_AREA_RATIO,
+                                  self.detection, self.detection_factor)
+
+    @property
+    def detection_key(self):
+        """Key of the detection parameters, which near-duplicates must share to reuse results"""
+        return FloorPlanCache.key(ROOM_THRESHOLD, CANNY_THRESHOLDS, MIN_ROOM_AREA_RATIO, self.detection,
+                                  self.detection_factor)
+
+    @cached_property
+    def signature(self):
+        """Square grayscale thumbnail the plan's perceptual hash is computed from"""
+        return cv2.resize(self.gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+
+    def load_cached(self, cache):
+        """Populate size, wall mask, rooms and label map from the cache; returns True on a hit"""
+        with profiler.stage("cache"):
+            cached = cache.get_analysis(self.cache_key)
+        if cached is None:
+            return False
+        self.__dict__.update(cached)
+        return True
+
+    def load_similar(self, cache):
+        """
+        Reuse the rooms of a near-duplicate plan from the cache; returns True on a hit
+
+        Candidates are found and pre-checked by FloorPlanCache.find_similar;
+        their rooms and label map, rescaled to this plan's size, must then fit
+        this plan's own walls (see matches_plan_regions). Walls are always
+        extracted from this plan, so its edits show even when rooms are reused.
+        """
+        signature = self.signature
+
+        def rescaled(match):
+            return rescale_detection(match["rooms"], match["label_map"], match["size"], self.size)
+
+        with profiler.stage("cache"):
+            match = cache.find_similar(signature, self.size, self.detection_key,
+                                       validate=lambda match: matches_plan_regions(self.gray, *rescaled(match)))
+            if match is None:
+                return False
+            rooms, label_map = rescaled(match)
+        self.__dict__.update(_segmentation=(rooms, label_map), rooms=rooms, label_map=label_map)
+        profiler.annotate(similar={"distance": match["distance"], "size": list(match["size"])})
+        return True
+
+    def store_cached(self, cache):
+        """Store the size, wall mask and rooms of this analysis in the cache, indexed by perceptual hash"""
+        size, wall_mask, rooms, label_map = self.size, self.wall_mask, self.rooms, self.label_map
+        # Rooms given by the cache or the caller leave no decoded plan to fingerprint
+        signature = self.signature if "gray" in self.__dict__ else None
+        with profiler.stage("cache"):
+            cache.put_analysis(self.cache_key, size, wall_mask, rooms, label_map, signature, self.detection_key)
+
+    @cached_property
+    def rgb(self):
+        """The floor plan as an RGB uint8 array"""
+        image = self.image
+        with profiler.stage("decode"):
+            return np.array(image)
+
+    @cached_property
+    def gray(self):
+        """Grayscale version of the floor plan"""
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def edges(self):
+        """Canny edge map of the floor plan"""
+        with profiler.stage("walls"):
+            return cv2.Canny(self.gray, *CANNY_THRESHOLDS)
+
+    @cached_property
+    def wall_mask(self):
+        """Edges dilated with a 3x3 kernel to make walls thicker"""
+        with profiler.stage("walls"):
+            kernel = np.ones((3, 3), np.uint8)
+            return cv2.dilate(self.edges, kernel, iterations=1)
+
+    @cached_property
+    def detection_factor(self):
+        """Downscale factor room detection runs at"""
+        if self.detection_scale == "auto":
+            return auto_detection_factor(self.size, DETECTION_MAX_PIXELS[self.detection])
+        return int(self.detection_scale)
+
+    @cached_property
+    def _segmentation(self):
+        """Rooms and label map (None for contour detection) from the detection engine"""
+        with profiler.stage("detect"):
+            return detect_rooms_multiscale(self.gray, self.detection, self.detection_factor)
+
+    @cached_property
+    def rooms(self):
+        """Rooms detected in the floor plan"""
+        return self._segmentation[0]
+
+    @cached_property
+    def label_map(self):
+        """int32 map of region labels referenced by room["label"], if available"""
+        return self._segmentation[1]
+
+    def downscaled(self, size):
+        """A new analysis of the same plan, downscaled to size as it is decoded"""
+        source = self.path if self.path is not None else self._data if self._data is not None else self._source
+        return FloorPlanAnalysis(source, self.detection, self.detection_scale, decode_size=size)
+
+    def prefetch(self, executor):
+        """
+        Extract the wall mask on executor while rooms are detected in this thread
+
+        Both stages read the grayscale plan, which is converted first so the
+        image is decoded once. cv2 releases the GIL in Canny, dilate,
+        threshold and findContours, so the two overlap. Returns once both are
+        done; anything already computed is left as is.
+        """
+        if "wall_mask" in self.__dict__ or "rooms" in self.__dict__ or "_segmentation" in self.__dict__:
+            return
+        self.gray
+        walls = executor.submit(lambda: self.wall_mask)
+        try:
+            self._segmentation
+        finally:
+            walls.result()
+
+
+def classify_rooms(areas, widths, heights, image_area):
+    """
+    Classify rooms by size and aspect ratio
+
+    Args:
+        areas, widths, heights: Arrays with one entry per room
+        image_area: Total image area in pixels
+
+    Returns:
+        Array of room type names
+    """
+    aspect_ratio = np.asarray(widths, dtype=np.float64) / np.asarray(heights, dtype=np.float64)
+    size_ratio = np.asarray(areas, dtype=np.float64) / image_area
+
+    # Simple heuristic for room type classification, first match wins
+    return np.select(
+        [
+            size_ratio > 0.2,
+            aspect_ratio > 1.5,
+            aspect_ratio < 0.7,
+            size_ratio > 0.1,
+            size_ratio > 0.05
+        ],
+        ["living_room", "hallway", "bathroom", "bedroom", "kitchen"],
+        default="dining"
+    )
+
+
+def detect_rooms_by_components(gray):
+    """
+    Detect rooms in a grayscale floor plan with connected-component labelling
+
+    Dark regions are labelled in one pass after filling their enclosed holes,
+    matching the filled external contours used by detect_rooms_in_gray. Area,
+    bounding box and room type are computed for all regions at once. Areas are
+    pixel counts, slightly larger than the polygon areas of the contour engine.
+
+    Returns:
+        Tuple of (rooms, label_map) where each room carries the label of its
+        region in the int32 label map
+    """
+    _, thresh = cv2.threshold(gray, ROOM_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    count, label_map, stats, _ = cv2.connectedComponentsWithStats(
+        fill_enclosed(thresh).view(np.uint8), connectivity=8, ltype=cv2.CV_32S
+    )
+
+    # Skip the background label and keep regions above the minimum area
+    image_area = gray.shape[0] * gray.shape[1]
+    labels = np.arange(1, count)
+    stats = stats[1:]
+    keep = stats[:, cv2.CC_STAT_AREA] > image_area * MIN_ROOM_AREA_RATIO
+    labels, stats = labels[keep], stats[keep]
+
+    x = stats[:, cv2.CC_STAT_LEFT]
+    y = stats[:, cv2.CC_STAT_TOP]
+    w = stats[:, cv2.CC_STAT_WIDTH]
+    h = stats[:, cv2.CC_STAT_HEIGHT]
+    room_types = classify_rooms(stats[:, cv2.CC_STAT_AREA], w, h, image_area)
+
+    rooms = [
+        {
+            "type": str(room_types[i]),
+            "bbox": (int(x[i]), int(y[i]), int(x[i] + w[i]), int(y[i] + h[i])),
+            "label": int(labels[i])
+        }
+        for i in range(len(labels))
+    ]
+    return rooms, label_map
+
+
+def fill_enclosed(thresh):
+    """Boolean mask of the set pixels of a thresholded plan and the background holes they enclose"""
+    # Background regions not connected to the border are holes inside a room
+    count, background = cv2.connectedComponents(cv2.bitwise_not(thresh), connectivity=4)
+    border = np.concatenate((background[0], background[-1], background[:, 0], background[:, -1]))
+    outside = np.zeros(count, dtype=bool)
+    outside[border] = True
+    outside[0] = True
+    filled = thresh > 0
+    filled |= ~outside[background]
+    return filled
+
+
+def detect_rooms_in_gray(gray):
+    """
+    Detect rooms in a grayscale floor plan
+    Returns a list of room dictionaries with type, bounding box and contour
+    """
+    # Apply threshold to get binary image
+    _, thresh = cv2.threshold(gray, ROOM_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    return detect_rooms_in_mask(thresh)
+
+
+def detect_rooms_in_mask(thresh):
+    """
+    Detect rooms in a thresholded floor plan (dark pixels set to 255)
+    Returns a list of room dictionaries with type, bounding box and contour
+    """
+    # Find contours
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Filter contours by size to identify rooms
+    image_area = thresh.shape[0] * thresh.shape[1]
+    min_area = image_area * MIN_ROOM_AREA_RATIO  # Minimum 1% of image area
+
+    kept = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area > min_area:
+            kept.append((contour, area, cv2.boundingRect(contour)))
+
+    # Simple room type classification based on size and aspect ratio
+    room_types = classify_rooms(
+        [area for _, area, _ in kept],
+        [rect[2] for _, _, rect in kept],
+        [rect[3] for _, _, rect in kept],
+        image_area
+    )
+
+    rooms = []
+    for (contour, _, (x, y, w, h)), room_type in zip(kept, room_types):
+        rooms.append({
+            "type": str(room_type),
+            "bbox": (x, y, x+w, y+h),
+            "contour": contour
+        })
+
+    return rooms
+
+
+def auto_detection_factor(size, max_pixels):
+    """Smallest power of two that brings an image of size (width, height) down to max_pixels"""
+    width, height = size
+    factor = 1
+    while width * height > max_pixels * factor * factor:
+        factor *= 2
+    return factor
+
+
+def downscale_for_detection(gray, factor):
+    """
+    Shrink a grayscale plan by factor, keeping the darkest pixel of each block
+
+    Taking the minimum instead of averaging keeps walls thinner than a block
+    dark, so they still separate rooms after thresholding. Partial blocks at
+    the right and bottom edges are kept.
+    """
+    if factor <= 1:
+        return gray
+
+    # Reduce strided views of the rows, then of the columns, in place
+    rows = gray[::factor].copy()
+    for k in range(1, factor):
+        band = gray[k::factor]
+        np.minimum(rows[:len(band)], band, out=rows[:len(band)])
+
+    small = rows[:, ::factor].copy()
+    for k in range(1, factor):
+        band = rows[:, k::factor]
+        np.minimum(small[:, :band.shape[1]], band, out=small[:, :band.shape[1]])
+    return small
+
+
+def upscale_detection(rooms, label_map, factor, size):
+    """
+    Map rooms detected on a plan downscaled by factor back to full-resolution coordinates
+
+    Each downscaled pixel maps to the centre of its block, so contours and
+    bounding boxes are within factor / 2 pixels of full-resolution detection.
+
+    Args:
+        rooms: Rooms detected on the downscaled plan
+        label_map: Label map of the downscaled plan, or None
+        factor: Downscale factor used for detection
+        size: Full-resolution image size as (width, height)
+
+    Returns:
+        Tuple of (rooms, label_map) in full-resolution coordinates
+    """
+    width, height = size
+    offset = factor // 2
+
+    scaled = []
+    for room in rooms:
+        x1, y1, x2, y2 = room["bbox"]
+        room = dict(room, bbox=(
+            min(x1 * factor + offset, width - 1),
+            min(y1 * factor + offset, height - 1),
+            min((x2 - 1) * factor + offset + 1, width),
+            min((y2 - 1) * factor + offset + 1, height)
+        ))
+        if "contour" in room:
+            contour = room["contour"] * factor + offset
+            np.minimum(contour, (width - 1, height - 1), out=contour)
+            room["contour"] = contour
+        scaled.append(room)
+
+    if label_map is not None:
+        # Nearest-neighbour upscale by indexing with the block of each full-resolution pixel
+        rows = np.minimum(np.arange(height) // factor, label_map.shape[0] - 1)
+        cols = np.minimum(np.arange(width) // factor, label_map.shape[1] - 1)
+        label_map = label_map[rows[:, None], cols]
+
+    return scaled, label_map
+
+
+def rescale_detection(rooms, label_map, source_size, size):
+    """
+    Map rooms detected on a plan of source_size onto the same plan resized to size
+
+    Args:
+        rooms: Rooms detected on the source plan
+        label_map: Label map of the source plan, or None
+        source_size: Size of the source plan as (width, height)
+        size: Size of the resized plan as (width, height)
+
+    Returns:
+        Tuple of (rooms, label_map) in the resized plan's coordinates
+    """
+    width, height = size
+    source_width, source_height = source_size
+    if (width, height) == (source_width, source_height):
+        return rooms, label_map
+    scale_x, scale_y = width / source_width, height / source_height
+
+    scaled = []
+    for room in rooms:
+        x1, y1, x2, y2 = room["bbox"]
+        room = dict(room, bbox=(
+            min(int(round(x1 * scale_x)), width - 1),
+            min(int(round(y1 * scale_y)), height - 1),
+            min(int(round(x2 * scale_x)), width),
+            min(int(round(y2 * scale_y)), height)
+        ))
+        if "contour" in room:
+            contour = np.rint(np.asarray(room["contour"]) * (scale_x, scale_y)).astype(np.int32)
+            np.minimum(contour, (width - 1, height - 1), out=contour)
+            room["contour"] = contour
+        scaled.append(room)
+
+    if label_map is not None:
+        # Nearest-neighbour resize by indexing with the source pixel of each pixel
+        rows = np.minimum(np.arange(height) * source_height // height, source_height - 1)
+        cols = np.minimum(np.arange(width) * source_width // width, source_width - 1)
+        label_map = label_map[rows[:, None], cols]
+
+    return scaled, label_map
+
+
+def detect_rooms_multiscale(gray, detection="contours", factor=1):
+    """
+    Detect rooms on a copy of gray downscaled by factor, in full-resolution coordinates
+
+    Args:
+        gray: Full-resolution grayscale plan
+        detection: Room detection engine, one of DETECTION_ENGINES
+        factor: Downscale factor (1 detects at full resolution)
+
+    Returns:
+        Tuple of (rooms, label_map) where label_map is None for contour detection
+    """
+    small = downscale_for_detection(gray, factor)
+    if detection == "components":
+        rooms, label_map = detect_rooms_by_components(small)
+    else:
+        rooms, label_map = detect_rooms_in_gray(small), None
+
+    if factor > 1:
+        rooms, label_map = upscale_detection(rooms, label_map, factor, (gray.shape[1], gray.shape[0]))
+    return rooms, label_map
+
+
+def matches_plan_regions(gray, rooms, label_map=None):
+    """
+    Check that rooms detected on another plan fit this plan's own walls
+
+    The plan is downscaled to at most SIMILAR_CHECK_PIXELS (keeping walls
+    dark, see downscale_for_detection) and thresholded, and its enclosed
+    regions above the minimum room area are compared with the rooms drawn at
+    the same size. Disagreements more than a pixel wide, such as a room whose
+    wall was erased, must cover at most SIMILAR_MAX_MISMATCH of the image.
+
+    Args:
+        gray: Full-resolution grayscale plan
+        rooms: Rooms in this plan's coordinates, with a contour or a label
+        label_map: Label map the rooms' labels refer to, or None
+
+    Returns:
+        True if the rooms match the plan's regions
+    """
+    height, width = gray.shape
+    small = downscale_for_detection(gray, auto_detection_factor((width, height), SIMILAR_CHECK_PIXELS))
+    _, thresh = cv2.threshold(small, ROOM_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    count, regions, stats, _ = cv2.connectedComponentsWithStats(fill_enclosed(thresh).view(np.uint8),
+                                                                connectivity=8)
+    keep = stats[:, cv2.CC_STAT_AREA] > small.size * MIN_ROOM_AREA_RATIO
+    keep[0] = False
+
+    rooms, label_map = rescale_detection(rooms, label_map, (width, height), (small.shape[1], small.shape[0]))
+    drawn = np.zeros(small.shape, dtype=np.uint8)
+    if label_map is not None:
+        drawn[np.isin(label_map, [room["label"] for room in rooms if "label" in room])] = 1
+    contours = [np.asarray(room["contour"], dtype=np.int32).reshape(-1, 1, 2)
+                for room in rooms if "contour" in room and "label" not in room]
+    cv2.drawContours(drawn, contours, -1, 1, cv2.FILLED)
+
+    mismatch = (keep[regions] != drawn.view(bool)).view(np.uint8)
+    mismatch = cv2.erode(mismatch, np.ones((3, 3), np.uint8))
+    return cv2.countNonZero(mismatch) <= small.size * SIMILAR_MAX_MISMATCH
+
+
+def compare_room_detections(reference, candidate, tolerance):
+    """
+    Check that rooms from scaled detection match full-resolution detection
+
+    Each reference room is paired with the candidate room whose bounding box
+    is closest; the error is the largest coordinate difference of a pair.
+
+    Args:
+        reference: Rooms detected at full resolution
+        candidate: Rooms detected on a downscaled plan
+        tolerance: Largest allowed bounding box error in pixels
+
+    Returns:
+        Dictionary with both room counts, the largest bounding box error, the
+        number of rooms whose type differs, and whether the counts match and
+        every bounding box is within tolerance
+    """
+    max_error = 0
+    type_changes = 0
+    if reference and candidate:
+        boxes = np.array([room["bbox"] for room in candidate], dtype=np.int64)
+        for room in reference:
+            errors = np.abs(boxes - np.array(room["bbox"], dtype=np.int64)).max(axis=1)
+            match = int(errors.argmin())
+            max_error = max(max_error, int(errors[match]))
+            type_changes += candidate[match]["type"] != room["type"]
+
+    return {
+        "rooms": len(reference),
+        "scaled_rooms": len(candidate),
+        "max_bbox_error": max_error,
+        "type_changes": type_changes,
+        "within_tolerance": len(reference) == len(candidate) and max_error <= tolerance
+    }
+
+
+def complete_color_scheme(colors):
+    """Fill in missing colors of a custom scheme from the modern scheme, as tuples"""
+    scheme = dict(COLOR_SCHEMES["modern"])
+    scheme.update({key: tuple(value) for key, value in colors.items()})
+    return scheme
+
+
+def resolve_color_schemes(names=None, palettes=None):
+    """
+    Resolve scheme names and custom palettes into a dictionary of color schemes
+
+    Args:
+        names: Iterable of built-in scheme names, or "all" for every built-in scheme
+        palettes: Custom palettes as a dictionary, a JSON string or a JSON file path,
+            mapping a name to a dictionary of colors
+
+    Returns:
+        Dictionary of scheme name to complete color scheme
+    """
+    if names == "all":
+        names = COLOR_SCHEMES.keys()
+
+    schemes = {}
+    for name in names or ():
+        if name not in COLOR_SCHEMES:
+            raise ValueError(f"Unknown color scheme '{name}'")
+        schemes[name] = COLOR_SCHEMES[name]
+
+    if isinstance(palettes, str):
+        if os.path.isfile(palettes):
+            with open(palettes) as f:
+                palettes = json.load(f)
+        else:
+            palettes = json.loads(palettes)
+
+    for name, colors in (palettes or {}).items():
+        schemes[name] = complete_color_scheme(colors)
+
+    return schemes
+
+
+def build_class_map(wall_mask, rooms, label_map=None, origin=(0, 0), image_size=None):
+    """
+    Build a per-pixel class index for walls and room fills
+
+    Class 0 is the white background, class 1 the walls, and class 2 onwards
+    the room types in order of first appearance. Labelled regions are filled
+    with one gather through the label map; remaining rooms are filled in order
+    so later rooms paint over earlier ones.
+
+    Args:
+        wall_mask: Boolean array (height x width) marking wall pixels
+        rooms: List of room dictionaries as returned by detect_rooms
+        label_map: Optional int32 label map referenced by room["label"]
+        origin: Image coordinates (x, y) of wall_mask's top left pixel when it is one tile
+        image_size: Size (width, height) of the whole image (defaults to wall_mask's size)
+
+    Returns:
+        Tuple of (uint8 class map, list of room types for classes 2 onwards)
+    """
+    tile_height, tile_width = wall_mask.shape
+    width, height = image_size or (tile_width, tile_height)
+    origin_x, origin_y = origin
+    room_types = list(dict.fromkeys(room["type"] for room in rooms))
+    room_class = {room_type: i + 2 for i, room_type in enumerate(room_types)}
+    dtype = np.uint8 if len(room_types) < 254 else np.uint16
+
+    # Start from the background and draw the walls
+    class_map = wall_mask.astype(dtype)
+
+    # Labelled regions are disjoint, so they are filled with one gather
+    labelled = [room for room in rooms if "label" in room] if label_map is not None else []
+    if labelled:
+        classes = np.zeros(max(int(label_map.max()), max(room["label"] for room in labelled)) + 1, dtype=dtype)
+        for room in labelled:
+            classes[room["label"]] = room_class[room["type"]]
+        region = classes[label_map]
+        region[wall_mask] = 0
+        np.maximum(class_map, region, out=class_map)
+
+    # Contours are filled within their bounding box, through one scratch buffer sized to the largest room
+    windows = {
+        i: contour_fill_window(room["contour"], origin, wall_mask.shape, (width, height))
+        for i, room in enumerate(rooms)
+        if "contour" in room and not (label_map is not None and "label" in room)
+    }
+    largest = max(
+        [(right - left) * (bottom - top) for (left, top, right, bottom), _ in filter(None, windows.values())] + [0]
+    )
+    scratch = np.empty(largest, dtype=np.uint8)
+
+    # Fill the remaining rooms in order so later rooms paint over earlier ones
+    for i, room in enumerate(rooms):
+        if label_map is not None and "label" in room:
+            continue
+        room_index = room_class[room["type"]]
+        x1, y1, x2, y2 = room["bbox"]
+
+        if "contour" in room:
+            if windows[i] is None:
+                continue
+            (fill_left, fill_top, fill_right, fill_bottom), (left, top, right, bottom) = windows[i]
+            mask = scratch[:(fill_right - fill_left) * (fill_bottom - fill_top)]
+            mask = mask.reshape(fill_bottom - fill_top, fill_right - fill_left)
+            mask.fill(0)
+            contour = np.asarray(room["contour"], dtype=np.int32)
+            cv2.drawContours(mask, [contour], 0, 255, -1, offset=(-fill_left, -fill_top))
+            inside = mask[top - fill_top:bottom - fill_top, left - fill_left:right - fill_left] > 0
+            rows = slice(top - origin_y, bottom - origin_y)
+            cols = slice(left - origin_x, right - origin_x)
+            inside &= ~wall_mask[rows, cols]
+            class_map[rows, cols][inside] = room_index
+        else:
+            # Filled bounding box with a one pixel wall outline, clipped to the image and the tile
+            left = max(x1, 0, origin_x)
+            top = max(y1, 0, origin_y)
+            right = min(x2, width - 1, origin_x + tile_width - 1)
+            bottom = min(y2, height - 1, origin_y + tile_height - 1)
+            if left > right or top > bottom:
+                continue
+            rows = slice(top - origin_y, bottom - origin_y + 1)
+            cols = slice(left - origin_x, right - origin_x + 1)
+            class_map[rows, cols] = room_index
+            if 0 <= y1 and top <= y1 <= bottom:
+                class_map[y1 - origin_y, cols] = 1
+            if y2 < height and top <= y2 <= bottom:
+                class_map[y2 - origin_y, cols] = 1
+            if 0 <= x1 and left <= x1 <= right:
+                class_map[rows, x1 - origin_x] = 1
+            if x2 < width and left <= x2 <= right:
+                class_map[rows, x2 - origin_x] = 1
+
+    return class_map, room_types
+
+
+def contour_fill_window(contour, origin, tile_shape, image_size):
+    """
+    Windows for filling a room contour into one tile
+
+    The room is filled over its bounding rectangle, clipped to the tile. Where
+    the tile clips the contour, the fill window extends CONTOUR_FILL_MARGIN
+    pixels beyond the tile so the clipped fill matches filling the whole contour.
+    OpenCV rasterises a clipped edge from where it crosses the window, so only
+    horizontal, vertical and diagonal edges (all that contour tracing yields)
+    keep their pixels; a contour with any other edge is filled over its whole
+    bounding rectangle instead.
+
+    Args:
+        contour: Room contour in image coordinates
+        origin: Image coordinates (x, y) of the tile's top left pixel
+        tile_shape: Shape (height, width) of the tile
+        image_size: Size (width, height) of the whole image
+
+    Returns:
+        Tuple of (fill window, covered region) as (left, top, right, bottom)
+        in image coordinates with exclusive right and bottom, or None if the
+        room does not reach the tile
+    """
+    x, y, w, h = cv2.boundingRect(np.asarray(contour, dtype=np.int32))
+    origin_x, origin_y = origin
+    tile_height, tile_width = tile_shape
+    width, height = image_size
+
+    left, top = max(x, origin_x, 0), max(y, origin_y, 0)
+    right = min(x + w, origin_x + tile_width, width)
+    bottom = min(y + h, origin_y + tile_height, height)
+    if left >= right or top >= bottom:
+        return None
+
+    points = np.asarray(contour, dtype=np.int64).reshape(-1, 2)
+    dx, dy = np.abs(np.diff(points, axis=0, append=points[:1])).T
+    margin = CONTOUR_FILL_MARGIN if ((dx == 0) | (dy == 0) | (dx == dy)).all() else max(w, h)
+    fill = (
+        max(left - margin, x, 0),
+        max(top - margin, y, 0),
+        min(right + margin, x + w, width),
+        min(bottom + margin, y + h, height)
+    )
+    return fill, (left, top, right, bottom)
+
+
+def scheme_palette(color_scheme, room_types):
+    """Build the lookup table that maps build_class_map classes to RGB colors"""
+    colors = [(255, 255, 255), color_scheme["walls"]]
+    colors += [color_scheme.get(room_type, (220, 220, 220)) for room_type in room_types]
+    return np.array(colors, dtype=np.uint8)
+
+
+def mean_gray_level(sums, pixel_count):
+    """
+    Mean grey level (ITU-R 601-2 luma, as PIL's "L" mode) from per-channel pixel sums
+
+    Args:
+        sums: Sums of the red, green and blue channels, e.g. from cv2.sumElems
+        pixel_count: Number of pixels summed
+
+    Returns:
+        The mean rounded to an integer level, as ImageEnhance.Contrast uses it
+    """
+    red, green, blue = sums[:3]
+    return int((red * 0.299 + green * 0.587 + blue * 0.114) / max(pixel_count, 1) + 0.5)
+
+
+def contrast_lut(mean, factor):
+    """256-entry lookup table stretching contrast around mean, matching ImageEnhance.Contrast"""
+    levels = np.arange(256, dtype=np.float32)
+    return np.clip(mean + np.float32(factor) * (levels - mean), 0, 255).astype(np.uint8)
+
+
+def sharpen_kernel(factor):
+    """3x3 kernel equivalent to ImageEnhance.Sharpness: blending the image away from its smoothed copy"""
+    identity = np.zeros((3, 3), dtype=np.float32)
+    identity[1, 1] = 1
+    return SMOOTH_KERNEL + np.float32(factor) * (identity - SMOOTH_KERNEL)
+
+
+def post_process_array(rgb, contrast=1.0, sharpness=1.0, mean=None, image_edges=(True, True, True, True)):
+    """
+    Apply the final contrast and sharpness enhancements in place
+
+    Contrast is a 256-entry lookup table and sharpening a single 3x3
+    convolution, so the buffer is enhanced without intermediate images. Each
+    step is within one grey level of its ImageEnhance pass; over a whole
+    render the two rounding errors add up, so pixels around labels can differ
+    from the chained passes by up to two grey levels.
+
+    Args:
+        rgb: Contiguous RGB uint8 array, modified in place
+        contrast: Contrast factor (1.0 leaves contrast unchanged)
+        sharpness: Sharpness factor (1.0 skips sharpening)
+        mean: Mean grey level to stretch contrast around; computed from rgb
+            unless given (tiles pass the mean of the whole plan)
+        image_edges: Whether the top, bottom, left and right sides of rgb are
+            sides of the image, whose outermost pixels are not sharpened (as
+            with PIL's filters)
+
+    Returns:
+        rgb
+    """
+    if contrast != 1.0:
+        if mean is None:
+            mean = mean_gray_level(cv2.sumElems(rgb), rgb.shape[0] * rgb.shape[1])
+        cv2.LUT(rgb, contrast_lut(mean, contrast), dst=rgb)
+
+    if sharpness != 1.0 and min(rgb.shape[:2]) > 2:
+        top, bottom, left, right = image_edges
+        kept = [(index, rgb[index].copy()) for index, keep in
+                ((np.s_[0], top), (np.s_[-1], bottom), (np.s_[:, 0], left), (np.s_[:, -1], right)) if keep]
+        cv2.filter2D(rgb, -1, sharpen_kernel(sharpness), dst=rgb, borderType=cv2.BORDER_REPLICATE)
+        for index, pixels in kept:
+            rgb[index] = pixels
+
+    return rgb
+
+
+def room_outline(room, label_map=None, simplify=SIMPLIFY_TOLERANCE):
+    """
+    Return the simplified outline of a room as an (N, 2) array of pixel coordinates
+
+    The outline follows room_contour, so labelled regions keep their shape,
+    simplified to a tolerance of simplify times its perimeter.
+    """
+    contour = room_contour(room, label_map).reshape(-1, 1, 2)
+    epsilon = simplify * cv2.arcLength(contour, True)
+    outline = cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+    if len(outline) >= 3:
+        return outline.astype(np.float64)
+
+    x1, y1, x2, y2 = room["bbox"]
+    return np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y2)], dtype=np.float64)
+
+
+def room_contour(room, label_map=None):
+    """
+    Return the outer contour of a room as an (N, 2) int32 array of pixel coordinates
+
+    Rooms from the contour engine carry their contour; labelled regions are
+    traced within their bounding box; other rooms fall back to the box itself.
+    """
+    if "contour" in room and len(room["contour"]):
+        return np.asarray(room["contour"], dtype=np.int32).reshape(-1, 2)
+
+    x1, y1, x2, y2 = room["bbox"]
+    if label_map is not None and "label" in room:
+        region = (label_map[y1:y2, x1:x2] == room["label"]).view(np.uint8)
+        contours, _ = cv2.findContours(region, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+        if contours:
+            return max(contours, key=cv2.contourArea).reshape(-1, 2)
+
+    return np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y2)], dtype=np.int32)
+
+
+def room_geometry(rooms, label_map=None, simplify=SIMPLIFY_TOLERANCE):
+    """
+    Measure every room's outline in one vectorized pass
+
+    All contours are concatenated, and area (shoelace formula), perimeter
+    and centroid are summed per room with np.add.reduceat.
+
+    Args:
+        rooms: List of room dictionaries as returned by detect_rooms
+        label_map: Optional int32 label map referenced by room["label"]
+        simplify: Tolerance of the simplified polygons as a fraction of the perimeter
+
+    Returns:
+        Dictionary of per-room arrays in pixels: areas, perimeters, centroids
+        (N, 2) and polygons (a list of simplified (K, 2) int32 vertex arrays)
+    """
+    contours = [room_contour(room, label_map) for room in rooms]
+    if not contours:
+        return {"areas": np.zeros(0), "perimeters": np.zeros(0), "centroids": np.zeros((0, 2)), "polygons": []}
+
+    lengths = np.array([len(contour) for contour in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).astype(np.float64)
+
+    # Index of the next vertex, wrapping around at the end of each contour
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    next_x, next_y = x[following], y[following]
+
+    cross = x * next_y - next_x * y
+    signed_areas = np.add.reduceat(cross, starts) / 2
+    perimeters = np.add.reduceat(np.hypot(next_x - x, next_y - y), starts)
+
+    # Degenerate polygons use the mean of their vertices as centroid
+    centroids = np.column_stack((np.add.reduceat(x, starts), np.add.reduceat(y, starts))) / lengths[:, None]
+    valid = signed_areas != 0
+    weights = 6 * signed_areas[valid, None]
+    centroids[valid] = np.column_stack((
+        np.add.reduceat((x + next_x) * cross, starts)[valid],
+        np.add.reduceat((y + next_y) * cross, starts)[valid]
+    )) / weights
+
+    polygons = [
+        cv2.approxPolyDP(contour.reshape(-1, 1, 2), simplify * perimeter, True).reshape(-1, 2)
+        for contour, perimeter in zip(contours, perimeters)
+    ]
+
+    return {
+        "areas": np.abs(signed_areas),
+        "perimeters": perimeters,
+        "centroids": centroids,
+        "polygons": polygons
+    }
+
+
+def build_room_mesh(rooms, color_scheme, wall_height, pixels_per_meter=PIXELS_PER_METER, label_map=None,
+                    simplify=SIMPLIFY_TOLERANCE):
+    """
+    Extrude room outlines into prisms
+
+    Args:
+        rooms: List of room dictionaries as returned by detect_rooms
+        color_scheme: Colors by room type, used for the floor and walls of each room
+        wall_height: Height of the walls in meters
+        pixels_per_meter: Scale of the plan, converting the wall height to pixels
+        label_map: Optional int32 label map referenced by room["label"]
+        simplify: Tolerance of the outlines as a fraction of the perimeter
+
+    Returns:
+        List of faces as (vertices, color, kind) where vertices is a (K, 3)
+        array of pixel coordinates with z up and kind is "floor" or "wall"
+    """
+    wall_height = wall_height * pixels_per_meter
+    faces = []
+    for room in rooms:
+        outline = room_outline(room, label_map, simplify)
+        color = color_scheme.get(room["type"], (220, 220, 220))
+        floor = np.column_stack((outline, np.zeros(len(outline))))
+        faces.append((floor, color, "floor"))
+
+        for start, end in zip(outline, np.roll(outline, -1, axis=0)):
+            wall = np.array([
+                (start[0], start[1], 0),
+                (end[0], end[1], 0),
+                (end[0], end[1], wall_height),
+                (start[0], start[1], wall_height)
+            ], dtype=np.float64)
+            faces.append((wall, color, "wall"))
+
+    return faces
+
+
+# Light direction for flat shading of the isometric view
+_LIGHT = np.array([-0.4, -0.6, 0.7]) / np.linalg.norm([-0.4, -0.6, 0.7])
+
+
+def render_isometric(faces, rooms, output_width, color_scheme, font_path=None, wall_height=0):
+    """
+    Rasterise mesh faces in an isometric view with flat shading
+
+    Faces are drawn back to front (painter's algorithm): floors first, then
+    walls ordered by their distance from the viewer.
+
+    Args:
+        faces: Faces as returned by build_room_mesh
+        rooms: Rooms to label at the centre of their floor
+        output_width: Width of the rendered image in pixels
+        color_scheme: Colors for the wall outlines and labels
+        font_path: Optional TrueType font for the labels
+        wall_height: Height of the walls in pixels, used to place the labels
+
+    Returns:
+        The rendered view as a PIL Image
+    """
+    cos30, sin30 = np.cos(np.pi / 6), 0.5
+
+    def project(points):
+        return np.column_stack((
+            (points[:, 0] - points[:, 1]) * cos30,
+            (points[:, 0] + points[:, 1]) * sin30 - points[:, 2]
+        ))
+
+    margin = 20
+    if faces:
+        projected = project(np.concatenate([vertices for vertices, _, _ in faces]))
+        low, high = projected.min(axis=0), projected.max(axis=0)
+    else:
+        low, high = np.zeros(2), np.ones(2)
+    scale = (output_width - 2 * margin) / max(high[0] - low[0], 1)
+    output_height = int(np.ceil((high[1] - low[1]) * scale)) + 2 * margin
+
+    def to_screen(points):
+        return (project(points) - low) * scale + margin
+
+    image = Image.new("RGB", (output_width, max(output_height, 1)), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+
+    # Floors lie below every wall, so draw them first, then walls far to near
+    depth = [(kind == "wall", vertices[:, 0].mean() + vertices[:, 1].mean()) for vertices, _, kind in faces]
+    outline_color = color_scheme["walls"]
+    for index in sorted(range(len(faces)), key=lambda i: depth[i]):
+        vertices, color, kind = faces[index]
+
+        # Flat shading from the face normal, lit from both sides
+        normal = np.cross(vertices[1] - vertices[0], vertices[2] - vertices[0])
+        length = np.linalg.norm(normal)
+        if kind == "floor" or length == 0:
+            shade = 1.0
+        else:
+            shade = 0.45 + 0.4 * abs(np.dot(normal / length, _LIGHT))
+        fill = tuple(min(255, int(c * shade)) for c in color)
+
+        polygon = [tuple(point) for point in to_screen(vertices)]
+        draw.polygon(polygon, fill=fill, outline=outline_color if kind == "wall" else None)
+
+    # Label each room at the centre of its floor
+    try:
+        font_size = max(int(output_width / 60), 8)
+        font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
+        for room in rooms:
+            x1, y1, x2, y2 = room["bbox"]
+            centre = np.array([[(x1 + x2) / 2, (y1 + y2) / 2, wall_height / 2]])
+            text_x, text_y = to_screen(centre)[0]
+            label = room["type"].replace("_", " ").title()
+            text_width = draw.textlength(label, font=font)
+            draw.text((text_x - text_width / 2, text_y), label, fill=color_scheme["text"], font=font)
+    except Exception as e:
+        print(f"Error adding 3D labels: {e}")
+
+    return image
+
+
+def _mesh_vertices(faces, pixels_per_meter=PIXELS_PER_METER):
+    """Convert mesh faces to metres with y up, as used by OBJ and glTF viewers"""
+    for vertices, color, kind in faces:
+        metres = vertices / pixels_per_meter
+        yield np.column_stack((metres[:, 0], metres[:, 2], metres[:, 1])), color, kind
+
+
+def write_obj(faces, output_path, pixels_per_meter=PIXELS_PER_METER):
+    """Write mesh faces as a Wavefront OBJ file with per-vertex colors, in metres at pixels_per_meter"""
+    lines = ["# Floor plan mesh generated by floor_plan_generator.py"]
+    faces_out = []
+    index = 1
+    for vertices, color, _ in _mesh_vertices(faces, pixels_per_meter):
+        r, g, b = (c / 255 for c in color)
+        for x, y, z in vertices:
+            lines.append(f"v {x:.4f} {y:.4f} {z:.4f} {r:.4f} {g:.4f} {b:.4f}")
+        faces_out.append("f " + " ".join(str(i) for i in range(index, index + len(vertices))))
+        index += len(vertices)
+
+    with open(output_path, "w") as f:
+        f.write("\n".join(lines + faces_out) + "\n")
+
+
+def triangulate_polygon(points):
+    """
+    Triangulate a simple polygon by ear clipping
+
+    Args:
+        points: (N, 2) array of polygon vertices
+
+    Returns:
+        List of index triples into points
+    """
+    indices = list(range(len(points)))
+    # Work with counter-clockwise winding
+    area = 0.5 * np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1])
+    if area < 0:
+        indices.reverse()
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    triangles = []
+    while len(indices) > 3:
+        for i in range(len(indices)):
+            prev, cur, nxt = indices[i - 1], indices[i], indices[(i + 1) % len(indices)]
+            a, b, c = points[prev], points[cur], points[nxt]
+            if cross(a, b, c) <= 0:
+                continue
+            # An ear contains no other vertex
+            if any(
+                cross(a, b, points[j]) >= 0 and cross(b, c, points[j]) >= 0 and cross(c, a, points[j]) >= 0
+                for j in indices if j not in (prev, cur, nxt)
+            ):
+                continue
+            triangles.append((prev, cur, nxt))
+            del indices[i]
+            break
+        else:
+            # Degenerate polygon, fall back to a fan
+            break
+
+    triangles.extend((indices[0], indices[i], indices[i + 1]) for i in range(1, len(indices) - 1))
+    return triangles
+
+
+def write_gltf(faces, output_path, pixels_per_meter=PIXELS_PER_METER):
+    """Write mesh faces as a glTF 2.0 file with an embedded buffer and vertex colors, in metres at pixels_per_meter"""
+    positions, colors, indices = [], [], []
+    for vertices, color, kind in _mesh_vertices(faces, pixels_per_meter):
+        base = sum(len(p) for p in positions)
+        # Floors are triangulated in plan coordinates, walls are quads
+        plan = vertices[:, [0, 2]]
+        triangles = triangulate_polygon(plan) if kind == "floor" else [(0, 1, 2), (0, 2, 3)]
+        positions.append(vertices.astype(np.float32))
+        colors.append(np.tile(np.array(color, dtype=np.float32) / 255, (len(vertices), 1)))
+        indices.extend(base + i for triangle in triangles for i in triangle)
+
+    positions = np.concatenate(positions) if positions else np.zeros((0, 3), dtype=np.float32)
+    colors = np.concatenate(colors) if colors else np.zeros((0, 3), dtype=np.float32)
+    indices = np.array(indices, dtype=np.uint32)
+
+    chunks = [positions.tobytes(), colors.tobytes(), indices.tobytes()]
+    offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+    data = b"".join(chunks)
+    low = positions.min(axis=0).tolist() if len(positions) else [0, 0, 0]
+    high = positions.max(axis=0).tolist() if len(positions) else [0, 0, 0]
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "floor_plan_generator.py"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "name": "floor_plan"}],
+        "meshes": [{"primitives": [{
+            "attributes": {"POSITION": 0, "COLOR_0": 1},
+            "indices": 2,
+            "material": 0
+        }]}],
+        "materials": [{
+            "pbrMetallicRoughness": {"metallicFactor": 0, "roughnessFactor": 1},
+            "doubleSided": True
+        }],
+        "buffers": [{
+            "byteLength": len(data),
+            "uri": "data:application/octet-stream;base64," + base64.b64encode(data).decode("ascii")
+        }],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": int(offsets[0]), "byteLength": len(chunks[0]), "target": 34962},
+            {"buffer": 0, "byteOffset": int(offsets[1]), "byteLength": len(chunks[1]), "target": 34962},
+            {"buffer": 0, "byteOffset": int(offsets[2]), "byteLength": len(chunks[2]), "target": 34963}
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": len(positions), "type": "VEC3",
+             "min": low, "max": high},
+            {"bufferView": 1, "componentType": 5126, "count": len(colors), "type": "VEC3"},
+            {"bufferView": 2, "componentType": 5125, "count": len(indices), "type": "SCALAR"}
+        ]
+    }
+
+    with open(output_path, "w") as f:
+        json.dump(gltf, f)
+
+
+def floor_plan_data_format(path):
+    """Export format chosen by the extension of a data path: "npz", "jsonl" or "json" (the default)"""
+    extension = os.path.splitext(path)[1].lower()
+    return {".npz": "npz", ".jsonl": "jsonl"}.get(extension, "json")
+
+
+def encode_floor_plan_data(data, data_format="json"):
+    """
+    Encode floor plan data as returned by export_floor_plan_data
+
+    Args:
+        data: Floor plan data dictionary
+        data_format: "json" (indented), "jsonl" (one compact line) or "npz"
+            (compressed columns: one array per room field, with polygons as
+            polygon_lengths plus concatenated polygon_points)
+
+    Returns:
+        The encoded data as bytes
+    """
+    if data_format == "jsonl":
+        return (json.dumps(data, separators=(",", ":")) + "\n").encode("utf-8")
+    if data_format != "npz":
+        return json.dumps(data, indent=2).encode("utf-8")
+
+    rooms = data["rooms"]
+    polygons = [np.asarray(room["polygon"], dtype=np.int32).reshape(-1, 2) for room in rooms]
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        size=np.array([data["image"]["width"], data["image"]["height"]], dtype=np.int64),
+        pixels_per_meter=np.array(data["dimensions"]["pixels_per_meter"], dtype=np.float64),
+        room_types=np.array([room["type"] for room in rooms], dtype=str),
+        bboxes=np.array([[room["position"][key] for key in ("x1", "y1", "x2", "y2")] for room in rooms],
+                        dtype=np.int64).reshape(-1, 4),
+        widths=np.array([room["dimensions"]["width"] for room in rooms], dtype=np.float64),
+        lengths=np.array([room["dimensions"]["length"] for room in rooms], dtype=np.float64),
+        areas=np.array([room["dimensions"]["area"] for room in rooms], dtype=np.float64),
+        perimeters=np.array([room["dimensions"]["perimeter"] for room in rooms], dtype=np.float64),
+        centroids=np.array([(room["centroid"]["x"], room["centroid"]["y"]) for room in rooms],
+                           dtype=np.float64).reshape(-1, 2),
+        polygon_lengths=np.array([len(polygon) for polygon in polygons], dtype=np.int64),
+        polygon_points=np.concatenate(polygons) if polygons else np.zeros((0, 2), dtype=np.int32)
+    )
+    return buffer.getvalue()
+
+
+def svg_color(color):
+    """Format an RGB tuple as an SVG hex color"""
+    return "#%02x%02x%02x" % tuple(int(c) for c in color[:3])
+
+
+def svg_path_data(polygon):
+    """SVG path data for a closed polygon of integer (x, y) vertices"""
+    return "M" + " ".join(f"{int(x)} {int(y)}" for x, y in polygon) + "Z"
+
+
+def save_floor_plan_data(data, output_path):
+    """Write floor plan data in the format of output_path's extension; JSONL lines are appended"""
+    data_format = floor_plan_data_format(output_path)
+    with open(output_path, "ab" if data_format == "jsonl" else "wb") as f:
+        f.write(encode_floor_plan_data(data, data_format))
+
+
+def same_room(a, b):
+    """Whether two room dictionaries render identically (type, bounding box, label and contour)"""
+    if a["type"] != b["type"] or tuple(a["bbox"]) != tuple(b["bbox"]) or a.get("label") != b.get("label"):
+        return False
+    if ("contour" in a) != ("contour" in b):
+        return False
+    return "contour" not in a or np.array_equal(np.asarray(a["contour"]), np.asarray(b["contour"]))
+
+
+def room_extent(room, size):
+    """
+    Box a room's fill and outline can cover, clipped to the image
+
+    Args:
+        room: Room dictionary with bbox and optionally contour
+        size: Image size as (width, height)
+
+    Returns:
+        (left, top, right, bottom) with exclusive right and bottom, or None if empty
+    """
+    x1, y1, x2, y2 = (int(v) for v in room["bbox"])
+    # Rooms without a contour are outlined on their inclusive bounding box
+    box = (x1, y1, x2 + 1, y2 + 1)
+    if room.get("contour") is not None and len(room["contour"]):
+        x, y, w, h = cv2.boundingRect(np.asarray(room["contour"], dtype=np.int32).reshape(-1, 1, 2))
+        box = union_boxes(box, (x, y, x + w, y + h))
+    return intersect_boxes(box, (0, 0) + tuple(size))
+
+
+def union_boxes(a, b):
+    """Smallest (left, top, right, bottom) box containing both boxes"""
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def intersect_boxes(a, b):
+    """Intersection of two (left, top, right, bottom) boxes, or None if they do not overlap"""
+    box = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+def merge_boxes(boxes):
+    """
+    Merge overlapping (left, top, right, bottom) boxes until none overlap
+
+    Returns:
+        List of disjoint boxes covering the same pixels (and possibly a few more)
+    """
+    merged = []
+    for box in boxes:
+        if box is None:
+            continue
+        # Absorb every merged box the new one overlaps, then repeat with the grown box
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for i, other in enumerate(merged):
+                if intersect_boxes(box, other):
+                    box = union_boxes(box, other)
+                    del merged[i]
+                    overlapping = True
+                    break
+        merged.append(box)
+    return merged
+
+
+class _PatchDraw:
+    """
+    Minimal ImageDraw stand-in that draws text onto a large RGB array
+
+    Each text is drawn into a small patch around its bounding box, so a
+    memory-mapped canvas is never loaded as a whole. Patches keep the
+    fractional part of the text position, so glyphs match drawing on the
+    full image.
+
+    With a clip box (left, top, right, bottom), only canvas pixels inside it
+    are written; an empty clip draws nothing. The box of every text drawn,
+    clipped or not, is recorded in boxes.
+    """
+
+    def __init__(self, canvas, clip=None):
+        self.canvas = canvas
+        self.clip = clip
+        self.boxes = []
+        self._draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+    def textlength(self, text, font=None):
+        return self._draw.textlength(text, font=font)
+
+    def text(self, xy, text, fill=None, font=None):
+        height, width = self.canvas.shape[:2]
+        x, y = xy
+        left, top, right, bottom = self._draw.textbbox(xy, text, font=font)
+        left = max(int(np.floor(min(left, x))) - 2, 0)
+        top = max(int(np.floor(min(top, y))) - 2, 0)
+        right = min(int(np.ceil(right)) + 2, width)
+        bottom = min(int(np.ceil(bottom)) + 2, height)
+        if left >= right or top >= bottom:
+            return
+        self.boxes.append((left, top, right, bottom))
+
+        # Glyphs are drawn over the whole text box, so the clipped part matches an unclipped draw
+        inner = (left, top, right, bottom)
+        if self.clip is not None:
+            inner = intersect_boxes(inner, self.clip)
+            if inner is None:
+                return
+
+        patch = Image.fromarray(np.ascontiguousarray(self.canvas[top:bottom, left:right]), "RGB")
+        ImageDraw.Draw(patch).text((x - left, y - top), text, fill=fill, font=font)
+        inner_left, inner_top, inner_right, inner_bottom = inner
+        self.canvas[inner_top:inner_bottom, inner_left:inner_right] = np.asarray(patch)[
+            inner_top - top:inner_bottom - top, inner_left - left:inner_right - left
+        ]
+
+
+def encode_options(image_format, dpi, quality=None, compress_level=PNG_COMPRESS_LEVEL):
+    """
+    PIL save options for an image format
+
+    Args:
+        image_format: PIL format name such as "PNG", "WEBP" or "JPEG"
+        dpi: Resolution recorded in the file
+        quality: WebP or JPEG quality (WebP is lossless unless given)
+        compress_level: PNG zlib level from 0 (fastest) to 9 (smallest)
+    """
+    options = {"dpi": (dpi, dpi)}
+    if image_format == "PNG":
+        options["compress_level"] = compress_level
+    elif image_format == "WEBP":
+        options.update({"lossless": True} if quality is None else {"quality": quality})
+    elif image_format == "JPEG":
+        options["quality"] = JPEG_QUALITY if quality is None else quality
+    return options
+
+
+def save_image(image, output, dpi, quality=None, compress_level=PNG_COMPRESS_LEVEL):
+    """Save an image to a path (format from its extension) or as PNG into a binary file object"""
+    if isinstance(output, (str, os.PathLike)):
+        image_format = Image.registered_extensions().get(os.path.splitext(output)[1].lower())
+        image.save(output, format=image_format, **encode_options(image_format, dpi, quality, compress_level))
+    else:
+        image.save(output, format="PNG", **encode_options("PNG", dpi, quality, compress_level))
+
+
+def parse_renditions(spec):
+    """
+    Parse a rendition spec into (name, longest edge, format) tuples
+
+    Args:
+        spec: Comma-separated NAME[:FORMAT] items, or a list of them. NAME is
+            a key of RENDITION_SIZES or a longest edge in pixels, FORMAT a key
+            of RENDITION_FORMATS (default png)
+
+    Returns:
+        List of (name, longest edge or None for full size, format) tuples
+    """
+    renditions = []
+    for item in spec.split(",") if isinstance(spec, str) else spec:
+        name, _, rendition_format = item.strip().partition(":")
+        rendition_format = (rendition_format or "png").lower()
+        if rendition_format not in RENDITION_FORMATS:
+            raise ValueError(f"Unknown rendition format '{rendition_format}'")
+        if name in RENDITION_SIZES:
+            size = RENDITION_SIZES[name]
+        elif name.isdigit() and int(name) > 0:
+            size = int(name)
+        else:
+            raise ValueError(f"Unknown rendition '{name}'")
+        renditions.append((name, size, rendition_format))
+    return renditions
+
+
+def parse_degradations(spec):
+    """
+    Parse a degradation policy into a tuple of DEGRADATIONS
+
+    Args:
+        spec: Comma-separated degradations, or a list of them; "none" or an
+            empty policy rejects plans over their pixel budget
+
+    Returns:
+        The degradations in the order they are applied
+    """
+    names = {name.strip() for name in (spec.split(",") if isinstance(spec, str) else spec)} - {"", "none"}
+    for name in names:
+        if name not in DEGRADATIONS:
+            raise ValueError(f"Unknown degradation '{name}'")
+    return tuple(name for name in DEGRADATIONS if name in names)
+
+
+def admit_floor_plan(generator, analysis, max_pixels, degrade=DEGRADATIONS, three_d=False, vector=False):
+    """
+    Apply the degradation policy to a plan with more pixels than its budget
+
+    The pixel count comes from the image header, and a downscaled plan is
+    only decoded (at its reduced size) if no cached render is found.
+    Degradations, in order:
+
+    - downscale: the plan is analysed and rendered downscaled to the budget;
+      dpi and pixels per meter scale along, so printed and measured sizes
+      are unchanged
+    - skip_3d: the 3D visualization is skipped (it can be requested again
+      once load allows)
+    - fast_encode: raster output is encoded with FAST_COMPRESS_LEVEL
+
+    Args:
+        generator: FloorPlanGenerator instance to use
+        analysis: FloorPlanAnalysis of the plan
+        max_pixels: Pixel budget of the plan (None for no limit)
+        degrade: Degradations allowed, see parse_degradations
+        three_d: Whether the 3D visualization was requested
+        vector: Whether the output is SVG
+
+    Returns:
+        Tuple of (generator, analysis, three_d, degradation report) to
+        continue with; the report is None if the plan fits its budget and
+        otherwise lists the applied degradations, the plan's pixel count, the
+        budget and the scale of a downscaled plan
+
+    Raises:
+        ValueError: If the plan is over budget and no degradation is allowed
+    """
+    width, height = analysis.size
+    pixels = width * height
+    if not max_pixels or pixels <= max_pixels:
+        return generator, analysis, three_d, None
+    if not degrade:
+        raise ValueError(f"Image of {width}x{height} pixels exceeds the pixel budget of {int(max_pixels)} pixels")
+
+    report = {"applied": [], "pixels": pixels, "max_pixels": int(max_pixels)}
+    generator = copy.copy(generator)
+
+    if "downscale" in degrade:
+        ratio = (max_pixels / pixels) ** 0.5
+        analysis = analysis.downscaled((max(int(width * ratio), 1), max(int(height * ratio), 1)))
+        scale = analysis.width / width
+        generator.dpi = max(int(round(generator.dpi * scale)), 1)
+        generator.pixels_per_meter *= scale
+        report["applied"].append("downscale")
+        report["scale"] = round(scale, 4)
+
+    if "skip_3d" in degrade and three_d:
+        three_d = False
+        report["applied"].append("skip_3d")
+
+    if "fast_encode" in degrade and not vector and generator.compress_level > FAST_COMPRESS_LEVEL:
+        generator.compress_level = FAST_COMPRESS_LEVEL
+        report["applied"].append("fast_encode")
+
+    print(f"Image of {width}x{height} pixels exceeds the pixel budget of {int(max_pixels)} pixels, applied: "
+          f"{', '.join(report['applied']) or 'nothing'}")
+    return generator, analysis, three_d, report
+
+
+def write_renditions(image, output_path, renditions, dpi, quality=None, compress_level=PNG_COMPRESS_LEVEL,
+                     workers=None):
+    """
+    Write downscaled copies of a render in several formats from the in-memory image
+
+    Each distinct size is resized once, then every rendition is encoded on
+    its own thread; PIL releases the GIL while resizing and encoding.
+
+    Args:
+        image: The full-size render as a PIL image
+        output_path: Path of the main output; renditions are saved next to it
+            as <root>_<name><extension>
+        renditions: Rendition spec, see parse_renditions
+        dpi: Resolution recorded in the files
+        quality: WebP or JPEG quality (WebP is lossless unless given)
+        compress_level: PNG zlib level
+        workers: Number of threads (defaults to one per rendition, up to the CPU count)
+
+    Returns:
+        Dictionary of "<name>.<format>" to saved path
+    """
+    renditions = parse_renditions(renditions)
+    root = os.path.splitext(output_path)[0]
+    width, height = image.size
+    image.load()
+
+    def resize(size):
+        scale = size / max(width, height) if size else 1
+        if scale >= 1:
+            return image
+        new_size = (max(round(width * scale), 1), max(round(height * scale), 1))
+        return image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    def encode(job):
+        (name, _, rendition_format), source = job
+        image_format, extension = RENDITION_FORMATS[rendition_format]
+        path = f"{root}_{name}{extension}"
+        source.save(path, format=image_format, **encode_options(image_format, dpi, quality, compress_level))
+        return f"{name}.{rendition_format}", path
+
+    sizes = list(dict.fromkeys(size for _, size, _ in renditions))
+    with ThreadPoolExecutor(max_workers=workers or min(len(renditions), os.cpu_count() or 1) or 1) as executor:
+        with profiler.stage("resize"):
+            resized = dict(zip(sizes, executor.map(resize, sizes)))
+
+        # PIL keeps encoder settings on the image, so concurrent encodes of one size use copies
+        jobs, used = [], set()
+        for rendition in renditions:
+            size = rendition[1]
+            jobs.append((rendition, resized[size].copy() if size in used else resized[size]))
+            used.add(size)
+        with profiler.stage("encode"):
+            saved = dict(executor.map(encode, jobs))
+
+    for key, path in saved.items():
+        print(f"Rendition {key} saved to {path}")
+    return saved
+
+
+class FloorPlanRenderState:
+    """
+    A rendered floor plan kept so room edits can be applied incrementally
+
+    Holds what the plan was rendered from (wall mask, label map and rooms),
+    the canvas with fills and labels before the final enhancements, the
+    mean grey level contrast is stretched around and the enhanced output.
+    Created by FloorPlanGenerator.render_state and updated in place by
+    update_render.
+    """
+
+    def __init__(self, wall_mask, label_map, rooms, canvas, output, mean):
+        self.wall_mask = wall_mask
+        self.label_map = label_map
+        self.rooms = rooms
+        self.canvas = canvas
+        self.output = output
+        self.mean = mean
+        self._label_boxes = {}
+
+    @property
+    def size(self):
+        """Plan size as (width, height)"""
+        return self.output.shape[1], self.output.shape[0]
+
+    @property
+    def image(self):
+        """The enhanced floor plan as a PIL Image"""
+        return Image.fromarray(self.output, "RGB")
+
+    def room_extent(self, room):
+        """Box a room's fill can cover in this render (see room_extent), including its label's pixels"""
+        box = room_extent(room, self.size)
+        if self.label_map is None or "label" not in room:
+            return box
+
+        # A labelled room is filled from its label, wherever its bounding box was moved to
+        label = room["label"]
+        if label not in self._label_boxes:
+            x, y, w, h = cv2.boundingRect((self.label_map == label).view(np.uint8))
+            self._label_boxes[label] = (x, y, x + w, y + h) if w else None
+        label_box = self._label_boxes[label]
+        if box is None or label_box is None:
+            return box or label_box
+        return union_boxes(box, label_box)
+
+    def patch(self, box):
+        """The enhanced pixels inside box (left, top, right, bottom) as a PIL Image"""
+        left, top, right, bottom = box
+        return Image.fromarray(np.ascontiguousarray(self.output[top:bottom, left:right]), "RGB")
+
+
 class FloorPlanGenerator:
     """Class to handle floor plan generation and enhancement"""
 
-    def __init__(self, color_scheme="modern", dpi=300, show_dimensions=True, show_labels=True):
-        """Initialize the floor plan generator with settings"""
-        self.color_scheme = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES["modern"])
+    def __init__(self, color_scheme="modern", dpi=300, show_dimensions=True, show_labels=True,
+                 contrast=None, sharpness=None, pixels_per_meter=PIXELS_PER_METER, simplify=SIMPLIFY_TOLERANCE,
+                 quality=None, compress_level=PNG_COMPRESS_LEVEL, threads=1):
+        """
+        Initialize the floor plan generator with settings
+
+        contrast and sharpness override the final enhancement factors, which
+        otherwise depend on the color scheme (1.0 disables either one).
+        pixels_per_meter sets the scale of dimensions and exported measurements.
+        simplify is the tolerance of room polygons in SVG output and data
+        exports, as a fraction of each room's perimeter. quality (WebP and
+        JPEG) and compress_level (PNG) tune the encoding of raster outputs.
+        threads > 1 runs independent stages of one plan concurrently (see
+        get_thread_pool); the output is identical to serial processing.
+        """
+        if isinstance(color_scheme, dict):
+            self.color_scheme = complete_color_scheme(color_scheme)
+            self.scheme_name = None
+        else:
+            self.scheme_name = color_scheme if color_scheme in COLOR_SCHEMES else "modern"
+            self.color_scheme = COLOR_SCHEMES[self.scheme_name]
         self.dpi = dpi
         self.show_dimensions = show_dimensions
         self.show_labels = show_labels
+        self.contrast = contrast
+        self.sharpness = sharpness
+        self.pixels_per_meter = pixels_per_meter
+        self.simplify = simplify
+        self.quality = quality
+        self.compress_level = compress_level
+        self.threads = threads
         self.font_path = self._get_default_font()
 
     def _get_default_font(self):
@@ -110,86 +1829,215 @@ class FloorPlanGenerator:
     def detect_rooms(self, image):
         """
         Detect rooms in the floor plan using computer vision
-        Returns a dictionary of room types and their bounding boxes
+        Accepts an image path, a PIL image or a FloorPlanAnalysis
+        Returns a list of room dictionaries with type, bounding box and contour
         """
+        if isinstance(image, FloorPlanAnalysis):
+            return image.rooms
+
         # Convert to grayscale for processing
         if isinstance(image, str):
             img = cv2.imread(image)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         else:
-            img = np.array(image)
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Apply threshold to get binary image
-        _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
-
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Filter contours by size to identify rooms
-        rooms = []
-        min_area = img.shape[0] * img.shape[1] * 0.01  # Minimum 1% of image area
-
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area > min_area:
-                x, y, w, h = cv2.boundingRect(contour)
-                # Simple room type classification based on size and aspect ratio
-                aspect_ratio = w / h
-                size_ratio = area / (img.shape[0] * img.shape[1])
-
-                # Simple heuristic for room type classification
-                if size_ratio > 0.2:
-                    room_type = "living_room"
-                elif aspect_ratio > 1.5:
-                    room_type = "hallway"
-                elif aspect_ratio < 0.7:
-                    room_type = "bathroom"
-                elif size_ratio > 0.1:
-                    room_type = "bedroom"
-                elif size_ratio > 0.05:
-                    room_type = "kitchen"
-                else:
-                    room_type = "dining"
+            gray = cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
 
-                rooms.append({
-                    "type": room_type,
-                    "bbox": (x, y, x+w, y+h),
-                    "contour": contour
-                })
+        return detect_rooms_in_gray(gray)
 
-        return rooms
+    def post_processing(self, scheme_name=None):
+        """
+        Contrast and sharpness factors for a color scheme
 
-    def enhance_floor_plan(self, input_path, output_path=None, room_data=None):
+        Args:
+            scheme_name: Built-in scheme name (defaults to the generator's scheme)
+
+        Returns:
+            Tuple of (contrast, sharpness)
         """
-        Enhance a floor plan image with better colors and clarity
+        settings = SCHEME_POST_PROCESSING.get(scheme_name or self.scheme_name, POST_PROCESSING)
+        return (
+            settings["contrast"] if self.contrast is None else self.contrast,
+            settings["sharpness"] if self.sharpness is None else self.sharpness
+        )
+
+    def render_cache_key(self, analysis, output_path):
+        """Cache key for the enhanced output of an analysis with these render options"""
+        return FloorPlanCache.key(
+            analysis.cache_key,
+            sorted(self.color_scheme.items()),
+            self.post_processing(),
+            self.pixels_per_meter,
+            self.simplify,
+            self.quality,
+            self.compress_level,
+            self.dpi,
+            self.show_dimensions,
+            self.show_labels,
+            self.font_path,
+            os.path.splitext(output_path)[1].lower()
+        )
+
+    @staticmethod
+    def _analysis(source):
+        """Return source as a FloorPlanAnalysis, wrapping paths and PIL images"""
+        if isinstance(source, FloorPlanAnalysis):
+            return source
+        return FloorPlanAnalysis(source)
+
+    def _composite(self, wall_mask, rooms, label_map=None, color_scheme=None):
+        """
+        Paint walls and room fills into an RGB buffer using array indexing
 
         Args:
-            input_path: Path to the input floor plan image
-            output_path: Path to save the enhanced floor plan (if None, will show the image)
-            room_data: Optional dictionary with room information to override detection
+            wall_mask: Boolean array (height x width) marking wall pixels
+            rooms: List of room dictionaries as returned by detect_rooms
+            label_map: Optional int32 label map referenced by room["label"]
+            color_scheme: Colors to use (defaults to the generator's scheme)
+
+        With worker threads, the buffer is filled in row bands on the thread
+        pool; each band is filled exactly as the whole plan would be.
 
         Returns:
-            The enhanced floor plan as a PIL Image
+            A uint8 array of shape (height, width, 3)
+        """
+        color_scheme = color_scheme or self.color_scheme
+        pool = get_thread_pool(self.threads)
+        with profiler.stage("fill"):
+            if pool is None:
+                class_map, room_types = build_class_map(wall_mask, rooms, label_map)
+                return scheme_palette(color_scheme, room_types)[class_map]
+
+            height, width = wall_mask.shape
+            canvas = np.empty((height, width, 3), dtype=np.uint8)
+
+            def fill(rows):
+                class_map, room_types = build_class_map(
+                    wall_mask[rows], rooms, None if label_map is None else label_map[rows],
+                    (0, rows.start), (width, height)
+                )
+                canvas[rows] = scheme_palette(color_scheme, room_types)[class_map]
+
+            band = max(-(-height // (self.threads * FILL_BANDS_PER_THREAD)), 1)
+            for _ in pool.map(fill, [slice(top, min(top + band, height)) for top in range(0, height, band)]):
+                pass
+            return canvas
+
+    def _decorate(self, canvas, rooms, color_scheme=None, scheme_name=None):
+        """
+        Draw labels and dimensions onto a composited canvas and apply the final enhancements
+
+        The canvas is decorated and enhanced in place; only the returned
+        image is a copy.
+
+        Args:
+            canvas: RGB uint8 array as returned by _composite
+            rooms: List of room dictionaries to label
+            color_scheme: Colors to use (defaults to the generator's scheme)
+            scheme_name: Built-in scheme name selecting the enhancement factors
+
+        Returns:
+            The decorated floor plan as a PIL Image
+        """
+        color_scheme = color_scheme or self.color_scheme
+        height, width = canvas.shape[:2]
+        self._annotate(_PatchDraw(canvas), rooms, (width, height), color_scheme)
+        self._post_process(canvas, self.post_processing(scheme_name))
+        return Image.fromarray(canvas, "RGB")
+
+    def _annotate(self, draw, rooms, size, color_scheme):
+        """Draw the room labels and the plan dimensions, as enabled"""
+        if self.show_labels:
+            self._draw_labels(draw, rooms, size, color_scheme)
+        if self.show_dimensions:
+            self._draw_dimensions(draw, size, color_scheme)
+
+    @profiler.profiled("labels")
+    def _draw_labels(self, draw, rooms, size, color_scheme):
+        """Draw room labels centred on each room's bounding box"""
+        width, height = size
+        try:
+            font_size = int(min(width, height) / 30)
+            font = ImageFont.truetype(self.font_path, font_size) if self.font_path else ImageFont.load_default()
+
+            for room in rooms:
+                room_type = room["type"].replace("_", " ").title()
+                x1, y1, x2, y2 = room["bbox"]
+                text_x = (x1 + x2) // 2
+                text_y = (y1 + y2) // 2
+
+                # Get text size and center it
+                text_width = draw.textlength(room_type, font=font)
+                text_x -= text_width // 2
+
+                # Draw text with a slight shadow for better readability
+                draw.text((text_x+1, text_y+1), room_type, fill=(0, 0, 0, 128), font=font)
+                draw.text((text_x, text_y), room_type, fill=color_scheme["text"], font=font)
+        except Exception as e:
+            print(f"Error adding labels: {e}")
+
+    @profiler.profiled("dimensions")
+    def _draw_dimensions(self, draw, size, color_scheme):
+        """Draw the overall plan dimensions in the bottom right corner"""
+        width, height = size
+        try:
+            # Add overall dimensions
+            dimension_text = self._dimension_text(size)
+            font_size = int(min(width, height) / 40)
+            font = ImageFont.truetype(self.font_path, font_size) if self.font_path else ImageFont.load_default()
+
+            # Draw dimension text at the bottom
+            text_width = draw.textlength(dimension_text, font=font)
+            draw.text(
+                (width - text_width - 10, height - font_size - 10),
+                dimension_text,
+                fill=color_scheme["dimensions"],
+                font=font
+            )
+        except Exception as e:
+            print(f"Error adding dimensions: {e}")
+
+    def _dimension_text(self, size):
+        """Overall plan dimensions in metres as shown in the bottom right corner"""
+        width, height = size
+        return f"{width / self.pixels_per_meter:.1f}m × {height / self.pixels_per_meter:.1f}m"
+
+    @profiler.profiled("enhance")
+    def _post_process(self, canvas, settings, mean=None, image_edges=(True, True, True, True)):
+        """
+        Apply the final contrast and sharpness enhancements in place, see post_process_array
+
+        Args:
+            canvas: Contiguous RGB uint8 array to enhance
+            settings: Tuple of (contrast, sharpness) as returned by post_processing
+            mean: Mean grey level to stretch contrast around (defaults to the canvas mean)
+            image_edges: Which sides of canvas are sides of the image
+        """
+        contrast, sharpness = settings
+        return post_process_array(canvas, contrast, sharpness, mean, image_edges)
+
+    def _load_rooms(self, analysis, room_data=None, prefetch_walls=False):
+        """
+        Return the image size and rooms of an analysis, wrapping failures in ValueError
+
+        With prefetch_walls and worker threads, the wall mask is extracted
+        while the rooms are detected (see FloorPlanAnalysis.prefetch).
         """
         # Load the image
         try:
-            img = Image.open(input_path).convert("RGB")
+            size = analysis.size
         except Exception as e:
             error_msg = f"Error loading image: {e}"
             print(error_msg)
             traceback.print_exc()
             raise ValueError(error_msg)
 
-        # Create a new blank image with white background
-        enhanced = Image.new("RGB", img.size, (255, 255, 255))
-        draw = ImageDraw.Draw(enhanced)
-
         # Detect rooms if not provided
         try:
             if not room_data:
-                rooms = self.detect_rooms(img)
+                pool = get_thread_pool(self.threads) if prefetch_walls else None
+                if pool is not None:
+                    analysis.prefetch(pool)
+                rooms = analysis.rooms
             else:
                 rooms = room_data
         except Exception as e:
@@ -198,236 +2046,667 @@ class FloorPlanGenerator:
             traceback.print_exc()
             raise ValueError(error_msg)
 
-        # Draw walls (use edge detection to find walls)
-        img_cv = np.array(img)
-        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
+        return size, rooms
 
-        # Dilate edges to make walls thicker
-        kernel = np.ones((3, 3), np.uint8)
-        dilated_edges = cv2.dilate(edges, kernel, iterations=1)
+    def enhance_floor_plan(self, input_path, output_path=None, room_data=None):
+        """
+        Enhance a floor plan image with better colors and clarity
 
-        # Convert back to PIL and draw walls
-        wall_mask = Image.fromarray(dilated_edges)
-        wall_color = self.color_scheme["walls"]
+        Args:
+            input_path: Path to the input floor plan image, or a FloorPlanAnalysis
+            output_path: Path or binary file object to save the enhanced floor plan to (if None, nothing is saved)
+            room_data: Optional dictionary with room information to override detection
 
-        # Draw walls on the enhanced image
-        for x in range(img.width):
-            for y in range(img.height):
-                if wall_mask.getpixel((x, y)) > 0:
-                    draw.point((x, y), fill=wall_color)
+        Returns:
+            The enhanced floor plan as a PIL Image
+        """
+        analysis = self._analysis(input_path)
+        _, rooms = self._load_rooms(analysis, room_data, prefetch_walls=True)
 
-        # Fill rooms with colors
-        for room in rooms:
-            room_type = room["type"]
-            color = self.color_scheme.get(room_type, (220, 220, 220))
+        # Draw walls (use edge detection to find walls, dilated to make them thicker)
+        dilated_edges = analysis.wall_mask
 
-            # Fill the room contour
-            if "contour" in room:
-                contour = room["contour"]
-                mask = np.zeros(img_cv.shape[:2], dtype=np.uint8)
-                cv2.drawContours(mask, [contour], 0, 255, -1)
-                room_mask = Image.fromarray(mask)
-
-                # Fill the room area
-                for x in range(img.width):
-                    for y in range(img.height):
-                        if room_mask.getpixel((x, y)) > 0 and wall_mask.getpixel((x, y)) == 0:
-                            draw.point((x, y), fill=color)
-            else:
-                # Use bounding box if contour not available
-                x1, y1, x2, y2 = room["bbox"]
-                draw.rectangle([x1, y1, x2, y2], fill=color, outline=wall_color)
+        # Composite walls and room fills into a single RGB buffer
+        label_map = None if room_data else analysis.label_map
+        canvas = self._composite(dilated_edges > 0, rooms, label_map)
+        enhanced = self._decorate(canvas, rooms)
 
-        # Add room labels if enabled
-        if self.show_labels:
-            try:
-                font_size = int(min(img.width, img.height) / 30)
-                font = ImageFont.truetype(self.font_path, font_size) if self.font_path else ImageFont.load_default()
-
-                for room in rooms:
-                    room_type = room["type"].replace("_", " ").title()
-                    x1, y1, x2, y2 = room["bbox"]
-                    text_x = (x1 + x2) // 2
-                    text_y = (y1 + y2) // 2
-
-                    # Get text size and center it
-                    text_width = draw.textlength(room_type, font=font)
-                    text_x -= text_width // 2
-
-                    # Draw text with a slight shadow for better readability
-                    draw.text((text_x+1, text_y+1), room_type, fill=(0, 0, 0, 128), font=font)
-                    draw.text((text_x, text_y), room_type, fill=self.color_scheme["text"], font=font)
-            except Exception as e:
-                print(f"Error adding labels: {e}")
+        # Save or show the result
+        if output_path:
+            with profiler.stage("encode"):
+                save_image(enhanced, output_path, self.dpi, self.quality, self.compress_level)
+            if isinstance(output_path, str):
+                print(f"Enhanced floor plan saved to {output_path}")
 
-        # Add dimensions if enabled
-        if self.show_dimensions:
-            try:
-                # Add overall dimensions
-                width_meters = img.width / 40  # Assuming 40 pixels per meter
-                height_meters = img.height / 40
-
-                dimension_text = f"{width_meters:.1f}m × {height_meters:.1f}m"
-                font_size = int(min(img.width, img.height) / 40)
-                font = ImageFont.truetype(self.font_path, font_size) if self.font_path else ImageFont.load_default()
-
-                # Draw dimension text at the bottom
-                text_width = draw.textlength(dimension_text, font=font)
-                draw.text(
-                    (img.width - text_width - 10, img.height - font_size - 10),
-                    dimension_text,
-                    fill=self.color_scheme["dimensions"],
-                    font=font
-                )
-            except Exception as e:
-                print(f"Error adding dimensions: {e}")
+        return enhanced
 
-        # Apply some final enhancements
-        enhanced = ImageEnhance.Contrast(enhanced).enhance(1.2)
-        enhanced = ImageEnhance.Sharpness(enhanced).enhance(1.5)
+    def render_state(self, input_path, room_data=None):
+        """
+        Render a floor plan and keep what update_render needs to apply room edits incrementally
+
+        Args:
+            input_path: Path to the input floor plan image, or a FloorPlanAnalysis
+            room_data: Optional list of room dictionaries to override detection
+
+        Returns:
+            FloorPlanRenderState whose image matches enhance_floor_plan; its
+            mean grey level stays the contrast pivot for every later edit
+        """
+        analysis = self._analysis(input_path)
+        size, rooms = self._load_rooms(analysis, room_data, prefetch_walls=True)
+        wall_mask = analysis.wall_mask > 0
+        label_map = None if room_data else analysis.label_map
+
+        canvas = self._composite(wall_mask, rooms, label_map)
+        self._annotate(_PatchDraw(canvas), rooms, size, self.color_scheme)
+
+        settings = self.post_processing()
+        mean = mean_gray_level(cv2.sumElems(canvas), size[0] * size[1]) if settings[0] != 1.0 else None
+        output = self._post_process(canvas.copy(), settings, mean)
+        return FloorPlanRenderState(wall_mask, label_map, list(rooms), canvas, output, mean)
+
+    def update_render(self, state, room_data, output_path=None):
+        """
+        Apply edited rooms to a render state, redrawing only the regions they affect
+
+        Rooms are compared with the state's from both ends of the list, so a
+        changed, inserted or removed room dirties only the boxes its old and
+        new fills and labels cover. Only those are refilled, relabelled
+        (including the parts of other labels reaching into them) and
+        re-enhanced, with one pixel around them for sharpening, unless they
+        cover most of the plan. Fills and labels match a full render of
+        room_data with the state's label map. Contrast stays stretched around
+        the state's mean grey level, which a full render would recompute from
+        the edited plan, so the result depends only on the state's first
+        render and room_data, never on the edits in between.
+
+        Args:
+            state: FloorPlanRenderState from render_state of this generator
+            room_data: The edited list of room dictionaries
+            output_path: Path or binary file object to save the whole plan to (if None, nothing is saved)
+
+        Returns:
+            List of updated boxes as (left, top, right, bottom) with exclusive right and bottom;
+            state.patch(box) gives their pixels
+        """
+        rooms = list(room_data)
+
+        # Old and new fills and labels of the rooms between the unchanged ends of the list
+        with profiler.stage("diff"):
+            common = min(len(rooms), len(state.rooms))
+            start = 0
+            while start < common and same_room(state.rooms[start], rooms[start]):
+                start += 1
+            end = 0
+            while end < common - start and same_room(state.rooms[-1 - end], rooms[-1 - end]):
+                end += 1
+            old_rooms, new_rooms = state.rooms[start:len(state.rooms) - end], rooms[start:len(rooms) - end]
+            if len(old_rooms) == len(new_rooms):
+                # Edits in place: only the rooms that differ at the same position
+                pairs = [(old, new) for old, new in zip(old_rooms, new_rooms) if not same_room(old, new)]
+                old_rooms, new_rooms = [old for old, _ in pairs], [new for _, new in pairs]
+            changed = old_rooms + new_rooms
+            boxes = [state.room_extent(room) for room in changed]
+            if changed and self.show_labels:
+                recorder = _PatchDraw(state.canvas, clip=(0, 0, 0, 0))
+                self._draw_labels(recorder, changed, state.size, self.color_scheme)
+                boxes += recorder.boxes
+            dirty = merge_boxes(boxes)
+
+        state.rooms = rooms
+        if dirty:
+            dirty = self._redraw(state, dirty)
 
-        # Save or show the result
         if output_path:
-            enhanced.save(output_path, dpi=(self.dpi, self.dpi))
-            print(f"Enhanced floor plan saved to {output_path}")
+            with profiler.stage("encode"):
+                save_image(state.image, output_path, self.dpi, self.quality, self.compress_level)
+            if isinstance(output_path, str):
+                print(f"Enhanced floor plan saved to {output_path}")
 
-        return enhanced
+        return dirty
 
-    def generate_3d_visualization(self, floor_plan_path, output_path=None, height=2.5):
+    def _redraw(self, state, dirty):
         """
-        Generate a simple 3D visualization of the floor plan
+        Refill, relabel and re-enhance the dirty boxes of a render state; see update_render
 
         Args:
-            floor_plan_path: Path to the floor plan image
-            output_path: Path to save the 3D visualization
-            height: Height of the walls in meters
+            state: FloorPlanRenderState whose rooms are already the edited ones
+            dirty: Disjoint boxes as (left, top, right, bottom) whose fills or labels changed
 
         Returns:
-            Path to the saved 3D visualization
+            List of boxes whose enhanced pixels were updated
         """
-        try:
-            # Load the floor plan
-            img = Image.open(floor_plan_path).convert("RGB")
-            img_cv = np.array(img)
-            img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGB2BGR)
+        width, height = state.size
+        rooms = state.rooms
+        settings = self.post_processing()
+        dirty_area = sum((right - left) * (bottom - top) for left, top, right, bottom in dirty)
+        if dirty_area > INCREMENTAL_MAX_DIRTY * width * height:
+            # Large edits: one pass over the whole plan beats many boxes
+            state.canvas = self._composite(state.wall_mask, rooms, state.label_map)
+            self._annotate(_PatchDraw(state.canvas), rooms, state.size, self.color_scheme)
+            state.output[...] = self._post_process(state.canvas.copy(), settings, state.mean)
+            return [(0, 0, width, height)]
+
+        for left, top, right, bottom in dirty:
+            region = state.canvas[top:bottom, left:right]
+            with profiler.stage("fill"):
+                class_map, room_types = build_class_map(
+                    state.wall_mask[top:bottom, left:right], rooms,
+                    None if state.label_map is None else state.label_map[top:bottom, left:right],
+                    (left, top), (width, height)
+                )
+                region[...] = scheme_palette(self.color_scheme, room_types)[class_map]
+            self._annotate(_PatchDraw(state.canvas, clip=(left, top, right, bottom)), rooms, state.size,
+                           self.color_scheme)
+
+        # Sharpening reads one pixel around each pixel, so it reaches one pixel past each box
+        dirty = merge_boxes(
+            (max(left - 1, 0), max(top - 1, 0), min(right + 1, width), min(bottom + 1, height))
+            for left, top, right, bottom in dirty
+        )
+        for left, top, right, bottom in dirty:
+            rows, cols = slice(top, bottom), slice(left, right)
+            halo_rows = slice(max(top - 1, 0), min(bottom + 1, height))
+            halo_cols = slice(max(left - 1, 0), min(right + 1, width))
+            enhanced = self._post_process(
+                np.array(state.canvas[halo_rows, halo_cols]), settings, state.mean,
+                (halo_rows.start == 0, halo_rows.stop == height, halo_cols.start == 0, halo_cols.stop == width)
+            )
+            state.output[rows, cols] = enhanced[inner_slices(rows, cols, halo_rows, halo_cols)]
+        return dirty
+
+    def enhance_floor_plan_tiled(self, input_path, output_path, room_data=None,
+                                 memory_budget=DEFAULT_MEMORY_BUDGET, scratch_dir=None):
+        """
+        Enhance a floor plan in overlapping tiles with bounded working buffers
+
+        Grayscale conversion, thresholding, Canny, dilation, color fill and the
+        final enhancements run tile by tile, writing into memory-mapped scratch
+        buffers whose pages are dropped once a band of tiles is done. PNG
+        output is streamed from the mapped buffer. The pixels match
+        enhance_floor_plan. Contour tracing runs over the mapped threshold
+        mask; with a detection scale, on a downscaled copy built tile by tile
+        instead.
+
+        Peak memory is not bounded by the budget: PIL still decodes the whole
+        source image, which stays resident (3 bytes per pixel for RGB) next to
+        the tiles. The budget only bounds the intermediate buffers that the
+        untiled pipeline would hold for the whole plan; room_data contours with
+        slanted edges also need a fill buffer the size of the room (see
+        contour_fill_window).
 
-            # Detect rooms
-            rooms = self.detect_rooms(img)
+        Args:
+            input_path: Path to the input floor plan image, or a FloorPlanAnalysis
+            output_path: Path to save the enhanced floor plan
+            room_data: Optional dictionary with room information to override detection
+            memory_budget: Budget in bytes for the per-tile working buffers, which sets
+                the tile size (the decoded source image is not counted)
+            scratch_dir: Directory for the scratch buffers (defaults to the system temp directory)
 
-            # Create a figure for 3D plot
-            fig = plt.figure(figsize=(12, 10))
-            ax = fig.add_subplot(111, projection='3d')
+        Returns:
+            The saved floor plan as a lazily loaded PIL Image
+        """
+        if not output_path:
+            raise ValueError("Tiled processing requires an output path")
+        analysis = self._analysis(input_path)
+        # Other engines fill rooms from a whole-plan label map, even when their rooms come from the cache
+        if not room_data and analysis.detection != "contours":
+            raise ValueError("Tiled processing only supports contour detection")
+        rooms = room_data or analysis.__dict__.get("rooms")
+
+        with contextlib.ExitStack() as stack:
+            scratch = stack.enter_context(tempfile.TemporaryDirectory(prefix="floor_plan_tiles_", dir=scratch_dir))
+
+            def buffer(name, shape):
+                mapped = MappedArray(os.path.join(scratch, name), shape)
+                stack.callback(mapped.close)
+                return mapped
+
+            # Decode once and keep only the grayscale plan (and threshold mask) in mapped buffers
+            try:
+                with profiler.stage("decode"):
+                    if analysis.decode_size is not None:
+                        source = analysis.image
+                    else:
+                        source = analysis.__dict__.get("image") or analysis._source or Image.open(analysis.path)
+                    width, height = source.size
+                    analysis.__dict__["size"] = (width, height)
+                    factor = analysis.detection_factor if rooms is None else 1
+
+                    # Tiles are aligned to detection blocks so each tile downscales on its own
+                    tile = max(tile_size_for_budget(memory_budget, WALL_TILE_HALO) // factor, 1) * factor
+                    gray = buffer("gray", (height, width))
+                    thresh = buffer("thresh", (height, width)) if rooms is None and factor == 1 else None
+                    small = None
+                    if rooms is None and factor > 1:
+                        small = np.empty((-(-height // factor), -(-width // factor)), dtype=np.uint8)
+
+                    for rows, cols, _, _ in iter_tiles(height, width, tile):
+                        rgb = np.array(source.crop((cols.start, rows.start, cols.stop, rows.stop)).convert("RGB"))
+                        gray_tile = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+                        gray.array[rows, cols] = gray_tile
+                        if small is not None:
+                            block_rows = slice(rows.start // factor, -(-rows.stop // factor))
+                            block_cols = slice(cols.start // factor, -(-cols.stop // factor))
+                            small[block_rows, block_cols] = downscale_for_detection(gray_tile, factor)
+                        if thresh is not None:
+                            thresh.array[rows, cols] = cv2.threshold(
+                                gray_tile, ROOM_THRESHOLD, 255, cv2.THRESH_BINARY_INV
+                            )[1]
+                        if cols.stop == width:
+                            gray.release(rows)
+                            if thresh is not None:
+                                thresh.release(rows)
+                    if source is not analysis._source and source is not analysis.__dict__.get("image"):
+                        source.close()
+            except Exception as e:
+                error_msg = f"Error loading image: {e}"
+                print(error_msg)
+                traceback.print_exc()
+                raise ValueError(error_msg)
+
+            if rooms is None:
+                try:
+                    with profiler.stage("detect"):
+                        if small is not None:
+                            rooms, _ = upscale_detection(detect_rooms_in_gray(small), None, factor, (width, height))
+                        else:
+                            rooms = detect_rooms_in_mask(thresh.array)
+                            thresh.close()
+                except Exception as e:
+                    error_msg = f"Error detecting rooms: {e}"
+                    print(error_msg)
+                    traceback.print_exc()
+                    raise ValueError(error_msg)
+                analysis.__dict__["_segmentation"] = (rooms, None)
+
+            # Walls: Canny and dilation over tiles grown by the halo
+            walls = buffer("walls", (height, width))
+            with profiler.stage("walls"):
+                kernel = np.ones((3, 3), np.uint8)
+                for rows, cols, halo_rows, halo_cols in iter_tiles(height, width, tile, WALL_TILE_HALO):
+                    edges = cv2.Canny(np.ascontiguousarray(gray.array[halo_rows, halo_cols]), *CANNY_THRESHOLDS)
+                    dilated = cv2.dilate(edges, kernel, iterations=1)
+                    walls.array[rows, cols] = dilated[inner_slices(rows, cols, halo_rows, halo_cols)]
+                    if cols.stop == width:
+                        gray.release(halo_rows)
+                        walls.release(rows)
+
+            # Room fills: one class map and palette lookup per tile
+            canvas = buffer("canvas", (height, width, 3))
+            with profiler.stage("fill"):
+                for rows, cols, _, _ in iter_tiles(height, width, tile):
+                    class_map, room_types = build_class_map(
+                        walls.array[rows, cols] > 0, rooms, None, (cols.start, rows.start), (width, height)
+                    )
+                    canvas.array[rows, cols] = scheme_palette(self.color_scheme, room_types)[class_map]
+                    if cols.stop == width:
+                        walls.release(rows)
+                        canvas.release(rows)
+
+            self._annotate(_PatchDraw(canvas.array), rooms, (width, height), self.color_scheme)
+
+            # Contrast needs the mean grey level of the whole plan before any tile is enhanced
+            settings = self.post_processing()
+            output = buffer("output", (height, width, 3))
+            with profiler.stage("enhance"):
+                mean = None
+                if settings[0] != 1.0:
+                    sums = np.zeros(4)
+                    for rows, cols, _, _ in iter_tiles(height, width, tile):
+                        sums += cv2.sumElems(canvas.array[rows, cols])
+                        if cols.stop == width:
+                            canvas.release(rows)
+                    mean = mean_gray_level(sums, width * height)
+
+                # Sharpening reads one pixel around each pixel
+                for rows, cols, halo_rows, halo_cols in iter_tiles(height, width, tile, 1):
+                    enhanced = self._post_process(
+                        np.array(canvas.array[halo_rows, halo_cols]), settings, mean,
+                        (halo_rows.start == 0, halo_rows.stop == height,
+                         halo_cols.start == 0, halo_cols.stop == width)
+                    )
+                    output.array[rows, cols] = enhanced[inner_slices(rows, cols, halo_rows, halo_cols)]
+                    if cols.stop == width:
+                        canvas.release(halo_rows)
+                        output.release(rows)
+
+            with profiler.stage("encode"):
+                if os.path.splitext(output_path)[1].lower() == ".png":
+                    write_png(output_path, output.array, (self.dpi, self.dpi), release=output.release,
+                              compress_level=self.compress_level)
+                else:
+                    # Other formats are encoded by PIL from the whole image
+                    save_image(Image.fromarray(output.array, "RGB"), output_path, self.dpi, self.quality,
+                               self.compress_level)
+            print(f"Enhanced floor plan saved to {output_path}")
+
+        return Image.open(output_path)
+
+    @profiler.profiled("svg")
+    def render_svg(self, input_path, output_path=None, room_data=None):
+        """
+        Render a floor plan as SVG straight from the detection results
 
-            # Set background color
-            ax.set_facecolor('white')
+        Rooms are simplified polygons filled with the scheme colors, walls are
+        the room outlines stroked in the wall color, and labels and dimensions
+        are text, so no raster is drawn and the plan stays sharp at any zoom.
+        Marks inside rooms that the raster renderer traces from the image
+        (doors, fixtures) are not drawn.
 
-            # Draw each room as a 3D box
+        Args:
+            input_path: Path to the input floor plan image, or a FloorPlanAnalysis
+            output_path: Path or binary file object to save the SVG to (if None, nothing is saved)
+            room_data: Optional dictionary with room information to override detection
+
+        Returns:
+            The SVG document as a string
+        """
+        analysis = self._analysis(input_path)
+        (width, height), rooms = self._load_rooms(analysis, room_data)
+        color_scheme = self.color_scheme
+        label_map = None if room_data else analysis.label_map
+        polygons = room_geometry(rooms, label_map, self.simplify)["polygons"]
+
+        elements = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}">',
+            f'<rect width="{width}" height="{height}" fill="#ffffff"/>'
+        ]
+
+        # Rooms in order so later rooms paint over earlier ones, then every wall as one path
+        elements.append('<g stroke="none">')
+        for room, polygon in zip(rooms, polygons):
+            fill = svg_color(color_scheme.get(room["type"], (220, 220, 220)))
+            elements.append(f'<path fill="{fill}" d="{svg_path_data(polygon)}"/>')
+        elements.append('</g>')
+        if polygons:
+            elements.append(
+                f'<path fill="none" stroke="{svg_color(color_scheme["walls"])}" stroke-width="{SVG_WALL_WIDTH}" '
+                f'stroke-linejoin="round" d="{"".join(svg_path_data(polygon) for polygon in polygons)}"/>'
+            )
+
+        # Labels centred on each room's bounding box, with the raster renderer's shadow
+        if self.show_labels and rooms:
+            font_size = int(min(width, height) / 30)
+            elements.append(f'<g font-family="{SVG_FONT_FAMILY}" font-size="{font_size}" text-anchor="middle" '
+                            f'dominant-baseline="hanging">')
             for room in rooms:
+                text = escape(room["type"].replace("_", " ").title())
                 x1, y1, x2, y2 = room["bbox"]
-                room_type = room["type"]
-                color = self.color_scheme.get(room_type, (220, 220, 220))
+                text_x, text_y = (x1 + x2) // 2, (y1 + y2) // 2
+                elements.append(f'<text x="{text_x + 1}" y="{text_y + 1}" fill="#000000">{text}</text>')
+                elements.append(f'<text x="{text_x}" y="{text_y}" fill="{svg_color(color_scheme["text"])}">'
+                                f'{text}</text>')
+            elements.append('</g>')
 
-                # Normalize color values to 0-1 for matplotlib
-                color = tuple(c/255 for c in color)
+        if self.show_dimensions:
+            font_size = int(min(width, height) / 40)
+            elements.append(
+                f'<text x="{width - 10}" y="{height - font_size - 10}" font-family="{SVG_FONT_FAMILY}" '
+                f'font-size="{font_size}" text-anchor="end" dominant-baseline="hanging" '
+                f'fill="{svg_color(color_scheme["dimensions"])}">{escape(self._dimension_text((width, height)))}</text>'
+            )
+
+        elements.append('</svg>')
+        svg = "\n".join(elements) + "\n"
+
+        if output_path is not None:
+            with profiler.stage("encode"):
+                if isinstance(output_path, (str, os.PathLike)):
+                    with open(output_path, "w", encoding="utf-8") as f:
+                        f.write(svg)
+                    print(f"Enhanced floor plan saved to {output_path}")
+                else:
+                    output_path.write(svg.encode("utf-8"))
 
-                # Create the floor
-                x = [x1, x2, x2, x1, x1]
-                y = [y1, y1, y2, y2, y1]
-                z = [0, 0, 0, 0, 0]
+        return svg
+
+    def render_schemes(self, input_path, color_schemes, output_path=None, room_data=None):
+        """
+        Render a floor plan in several color schemes from a single analysis
 
-                ax.plot(x, y, z, color='black')
+        The plan is analysed once into a per-pixel class map; each scheme then
+        costs one palette lookup plus labels and final enhancements.
 
-                # Create a polygon for the floor
-                verts = [(x1, y1, 0), (x2, y1, 0), (x2, y2, 0), (x1, y2, 0)]
-                ax.add_collection3d(plt.matplotlib.collections.PolyCollection(
-                    [verts], facecolors=color, alpha=0.7))
+        Args:
+            input_path: Path to the input floor plan image, or a FloorPlanAnalysis
+            color_schemes: Dictionary of scheme name to colors, see resolve_color_schemes
+            output_path: Optional output path; each scheme is saved as <name>_<scheme><ext>
+            room_data: Optional dictionary with room information to override detection
 
-                # Create the walls
-                for i in range(4):
-                    ax.plot([x[i], x[i]], [y[i], y[i]], [0, height], color='black')
+        Returns:
+            Dictionary of scheme name to (PIL Image, saved path or None)
+        """
+        analysis = self._analysis(input_path)
+        _, rooms = self._load_rooms(analysis, room_data)
 
-                # Add room label
-                room_label = room_type.replace("_", " ").title()
-                ax.text((x1+x2)/2, (y1+y2)/2, height/2, room_label,
-                        horizontalalignment='center', size=8, color='black')
+        label_map = None if room_data else analysis.label_map
+        wall_mask = analysis.wall_mask
+        with profiler.stage("fill"):
+            class_map, room_types = build_class_map(wall_mask > 0, rooms, label_map)
 
-            # Set axis limits
-            ax.set_xlim(0, img.width)
-            ax.set_ylim(0, img.height)
-            ax.set_zlim(0, height + 1)
+        results = {}
+        for name, color_scheme in color_schemes.items():
+            with profiler.stage("fill"):
+                canvas = scheme_palette(color_scheme, room_types)[class_map]
+            enhanced = self._decorate(canvas, rooms, color_scheme, name)
 
-            # Set labels
-            ax.set_xlabel('X (pixels)')
-            ax.set_ylabel('Y (pixels)')
-            ax.set_zlabel('Height (meters)')
+            scheme_path = None
+            if output_path:
+                root, ext = os.path.splitext(output_path)
+                scheme_path = f"{root}_{name}{ext}"
+                with profiler.stage("encode"):
+                    save_image(enhanced, scheme_path, self.dpi, self.quality, self.compress_level)
+                print(f"Enhanced floor plan ({name}) saved to {scheme_path}")
 
-            # Set title
-            ax.set_title('3D Floor Plan Visualization')
+            results[name] = (enhanced, scheme_path)
 
-            # Adjust view angle
-            ax.view_init(elev=30, azim=45)
+        return results
+
+    @profiler.profiled("3d")
+    def generate_3d_visualization(self, floor_plan_path, output_path=None, height=2.5, renderer="native"):
+        """
+        Generate a simple 3D visualization of the floor plan
+
+        Args:
+            floor_plan_path: Path to the floor plan image, or a FloorPlanAnalysis
+            output_path: Path or binary file object to save the 3D visualization to
+            height: Height of the walls in meters
+            renderer: "native" for the built-in isometric renderer, or "matplotlib"
+
+        Returns:
+            Path (or file object) of the saved 3D visualization
+        """
+        try:
+            # Load the floor plan and detect rooms
+            analysis = self._analysis(floor_plan_path)
+            rooms = analysis.rooms
+
+            if renderer == "matplotlib":
+                return self._render_3d_matplotlib(analysis.size, rooms, output_path, height)
+
+            faces = build_room_mesh(rooms, self.color_scheme, height, self.pixels_per_meter, analysis.label_map,
+                                    self.simplify)
+            rendered = render_isometric(
+                faces, rooms, analysis.width, self.color_scheme, self.font_path, height * self.pixels_per_meter
+            )
 
             # Save or show the result
             if output_path:
-                plt.savefig(output_path, dpi=self.dpi, bbox_inches='tight')
-                print(f"3D visualization saved to {output_path}")
-                plt.close(fig)
+                save_image(rendered, output_path, self.dpi)
+                if isinstance(output_path, str):
+                    print(f"3D visualization saved to {output_path}")
                 return output_path
             else:
-                plt.show()
-                plt.close(fig)
+                rendered.show()
                 return None
 
         except Exception as e:
             print(f"Error generating 3D visualization: {e}")
             return None
 
+    def _render_3d_matplotlib(self, size, rooms, output_path, height):
+        """Render the 3D visualization with matplotlib mplot3d (imported on demand)"""
+        import matplotlib
+        if output_path:
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+        width, length = size
+
+        # Create a figure for 3D plot
+        fig = plt.figure(figsize=(12, 10))
+        ax = fig.add_subplot(111, projection='3d')
+
+        # Set background color
+        ax.set_facecolor('white')
+
+        # Draw each room as a 3D box
+        for room in rooms:
+            x1, y1, x2, y2 = room["bbox"]
+            room_type = room["type"]
+            color = self.color_scheme.get(room_type, (220, 220, 220))
+
+            # Normalize color values to 0-1 for matplotlib
+            color = tuple(c/255 for c in color)
+
+            # Create the floor
+            x = [x1, x2, x2, x1, x1]
+            y = [y1, y1, y2, y2, y1]
+            z = [0, 0, 0, 0, 0]
+
+            ax.plot(x, y, z, color='black')
+
+            # Create a polygon for the floor
+            verts = [(x1, y1, 0), (x2, y1, 0), (x2, y2, 0), (x1, y2, 0)]
+            ax.add_collection3d(Poly3DCollection([verts], facecolors=color, alpha=0.7))
+
+            # Create the walls
+            for i in range(4):
+                ax.plot([x[i], x[i]], [y[i], y[i]], [0, height], color='black')
+
+            # Add room label
+            room_label = room_type.replace("_", " ").title()
+            ax.text((x1+x2)/2, (y1+y2)/2, height/2, room_label,
+                    horizontalalignment='center', size=8, color='black')
+
+        # Set axis limits
+        ax.set_xlim(0, width)
+        ax.set_ylim(0, length)
+        ax.set_zlim(0, height + 1)
+
+        # Set labels
+        ax.set_xlabel('X (pixels)')
+        ax.set_ylabel('Y (pixels)')
+        ax.set_zlabel('Height (meters)')
+
+        # Set title
+        ax.set_title('3D Floor Plan Visualization')
+
+        # Adjust view angle
+        ax.view_init(elev=30, azim=45)
+
+        # Save or show the result
+        if output_path:
+            plt.savefig(output_path, dpi=self.dpi, bbox_inches='tight')
+            if isinstance(output_path, str):
+                print(f"3D visualization saved to {output_path}")
+            plt.close(fig)
+            return output_path
+        else:
+            plt.show()
+            plt.close(fig)
+            return None
+
+    @profiler.profiled("mesh")
+    def export_mesh(self, floor_plan_path, output_path, height=2.5):
+        """
+        Export the extruded rooms as a 3D mesh for client-side rendering
+
+        Args:
+            floor_plan_path: Path to the floor plan image, or a FloorPlanAnalysis
+            output_path: Path of the mesh; .obj writes Wavefront OBJ, .gltf writes glTF 2.0
+            height: Height of the walls in meters
+
+        Returns:
+            Path to the saved mesh
+        """
+        try:
+            analysis = self._analysis(floor_plan_path)
+            faces = build_room_mesh(analysis.rooms, self.color_scheme, height, self.pixels_per_meter,
+                                    analysis.label_map, self.simplify)
+
+            if output_path.lower().endswith(".gltf"):
+                write_gltf(faces, output_path, self.pixels_per_meter)
+            else:
+                write_obj(faces, output_path, self.pixels_per_meter)
+            print(f"3D mesh saved to {output_path}")
+            return output_path
+
+        except Exception as e:
+            print(f"Error exporting 3D mesh: {e}")
+            return None
+
+    @profiler.profiled("export")
     def export_floor_plan_data(self, floor_plan_path, output_path):
         """
-        Export floor plan data as JSON
+        Export floor plan data as JSON, a JSONL line or columnar npz
+
+        Room areas, perimeters and centroids are measured on the room outlines
+        (see room_geometry), so non-rectangular rooms are not over-counted.
 
         Args:
-            floor_plan_path: Path to the floor plan image
-            output_path: Path to save the JSON data
+            floor_plan_path: Path to the floor plan image, or a FloorPlanAnalysis
+            output_path: Path to save the data, in the format of its extension
+                (see save_floor_plan_data); if not a path, nothing is saved
 
         Returns:
             Dictionary with floor plan data
         """
         try:
-            # Load the floor plan
-            img = Image.open(floor_plan_path).convert("RGB")
-
-            # Detect rooms
-            rooms = self.detect_rooms(img)
+            # Load the floor plan and detect rooms
+            analysis = self._analysis(floor_plan_path)
+            width, height = analysis.size
+            rooms = analysis.rooms
+            scale = self.pixels_per_meter
 
             # Calculate total area and dimensions
-            width_meters = img.width / 40  # Assuming 40 pixels per meter
-            height_meters = img.height / 40
+            width_meters = width / scale
+            height_meters = height / scale
             total_area = width_meters * height_meters
 
+            # Measure every room at once
+            with profiler.stage("geometry"):
+                geometry = room_geometry(rooms, analysis.label_map, self.simplify)
+
             # Prepare room data
             room_data = []
-            for room in rooms:
-                x1, y1, x2, y2 = room["bbox"]
-                room_width = (x2 - x1) / 40
-                room_height = (y2 - y1) / 40
-                room_area = room_width * room_height
+            for i, room in enumerate(rooms):
+                x1, y1, x2, y2 = (int(v) for v in room["bbox"])
+                centroid_x, centroid_y = geometry["centroids"][i]
 
                 room_data.append({
                     "type": room["type"],
                     "dimensions": {
-                        "width": round(room_width, 2),
-                        "length": round(room_height, 2),
-                        "area": round(room_area, 2)
+                        "width": round((x2 - x1) / scale, 2),
+                        "length": round((y2 - y1) / scale, 2),
+                        "area": round(float(geometry["areas"][i]) / scale ** 2, 2),
+                        "perimeter": round(float(geometry["perimeters"][i]) / scale, 2)
                     },
                     "position": {
                         "x1": x1,
                         "y1": y1,
                         "x2": x2,
                         "y2": y2
-                    }
+                    },
+                    "centroid": {
+                        "x": round(float(centroid_x), 1),
+                        "y": round(float(centroid_y), 1)
+                    },
+                    "polygon": geometry["polygons"][i].tolist()
                 })
 
             # Create the full data structure
@@ -436,20 +2715,20 @@ class FloorPlanGenerator:
                     "width": round(width_meters, 2),
                     "length": round(height_meters, 2),
                     "total_area": round(total_area, 2),
-                    "unit": "meters"
+                    "unit": "meters",
+                    "pixels_per_meter": scale
                 },
                 "rooms": room_data,
                 "image": {
-                    "width": img.width,
-                    "height": img.height,
-                    "path": floor_plan_path
+                    "width": width,
+                    "height": height,
+                    "path": analysis.path
                 }
             }
 
             # Save the data
-            if output_path:
-                with open(output_path, 'w') as f:
-                    json.dump(floor_plan_data, f, indent=2)
+            if isinstance(output_path, (str, os.PathLike)):
+                save_floor_plan_data(floor_plan_data, output_path)
                 print(f"Floor plan data saved to {output_path}")
 
             return floor_plan_data
@@ -459,25 +2738,1040 @@ class FloorPlanGenerator:
             return None
 
 
+# Generators kept warm inside a serve-mode worker, keyed by their settings
+_WORKER_GENERATORS = {}
+
+# Render states of editor sessions kept inside a serve-mode worker, least recently used first
+_RENDER_SESSIONS = OrderedDict()
+
+# Editor sessions a serve-mode worker keeps render states for
+MAX_RENDER_SESSIONS = 8
+
+# Process-wide cache, configured through the environment so workers share it
+_CACHE = None
+
+
+def get_cache():
+    """
+    Return the cache configured by FLOOR_PLAN_CACHE_DIR, or None if disabled
+    FLOOR_PLAN_CACHE_SIZE sets the size limit in megabytes.
+    """
+    global _CACHE
+    directory = os.environ.get("FLOOR_PLAN_CACHE_DIR")
+    if not directory:
+        return None
+    if _CACHE is None or _CACHE.directory != directory:
+        size_mb = os.environ.get("FLOOR_PLAN_CACHE_SIZE")
+        max_bytes = int(float(size_mb) * 1024 * 1024) if size_mb else DEFAULT_MAX_BYTES
+        _CACHE = FloorPlanCache(directory, max_bytes)
+    return _CACHE
+
+
+# Process-wide thread pools by size, shared by every generator in the process
+_THREAD_POOLS = {}
+_THREAD_POOLS_LOCK = threading.Lock()
+
+
+def get_thread_pool(threads):
+    """
+    Return the process-wide pool of this many worker threads, or None for serial processing
+
+    Only the thread driving a plan submits work to the pool and waits for it,
+    so tasks never wait on each other and a bounded pool cannot deadlock.
+    """
+    if not threads or threads <= 1:
+        return None
+    with _THREAD_POOLS_LOCK:
+        pool = _THREAD_POOLS.get(threads)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="floor_plan")
+            _THREAD_POOLS[threads] = pool
+        return pool
+
+
+def process_floor_plan(generator, input_path, output_path=None, three_d=False, export_data=None, cache=None,
+                       detection="contours", mesh=None, renderer_3d="native", tiled=False, memory_budget=None,
+                       scratch_dir=None, detection_scale=1, enhanced_format=None, renditions=None, max_pixels=None,
+                       degrade=DEGRADATIONS):
+    """
+    Run the enhance, 3D and export stages for a single floor plan
+
+    Args:
+        generator: FloorPlanGenerator instance to use
+        input_path: Path to the input floor plan image
+        output_path: Path to save the enhanced floor plan (if None, nothing is saved)
+        three_d: Whether to generate a 3D visualization next to the output
+        export_data: Optional path to export the floor plan data to (.json, .jsonl or .npz),
+            or True to only return it
+        cache: Optional FloorPlanCache for detection results and rendered outputs
+        detection: Room detection engine, one of DETECTION_ENGINES
+        mesh: Optional path to export the 3D mesh (.obj or .gltf)
+        renderer_3d: 3D renderer, "native" or "matplotlib"
+        tiled: Whether to enhance the plan in tiles with bounded working buffers
+            (the source image is still decoded whole)
+        memory_budget: Optional budget in bytes for intermediate buffers; plans
+            whose untiled buffers would exceed it are enhanced in tiles (contour
+            detection only)
+        scratch_dir: Directory for the scratch buffers of tiled processing
+        detection_scale: Downscale factor for room detection, or "auto"
+        enhanced_format: "png" for a raster or "svg" for vector output (defaults
+            to the output extension; raster formats other than PNG follow it too)
+        renditions: Optional rendition spec (see parse_renditions) of downscaled
+            copies to write next to a raster output, from the same render
+        max_pixels: Optional pixel budget; larger plans are degraded (see admit_floor_plan)
+        degrade: Degradations allowed for a plan over its pixel budget
+
+    With generator.threads > 1, walls are extracted while rooms are detected
+    and the 3D visualization renders on a worker thread alongside the 2D
+    output; the outputs are identical to serial processing.
+
+    Returns:
+        Dictionary with the enhanced image (the SVG document for vector output)
+        and paths of the generated outputs, plus the degradation report of a
+        plan over its pixel budget under "degraded"
+    """
+    # Decode the image and detect rooms once for every stage
+    analysis = FloorPlanAnalysis(input_path, detection, detection_scale)
+    vector = bool(output_path) and (enhanced_format or os.path.splitext(output_path)[1].lower().lstrip(".")) == "svg"
+    analysis_cached = False
+    result = {}
+
+    generator, analysis, three_d, degraded = admit_floor_plan(generator, analysis, max_pixels, degrade, three_d,
+                                                              vector)
+    if degraded:
+        result["degraded"] = degraded
+
+    pool = get_thread_pool(generator.threads)
+    three_d_output = f"{os.path.splitext(output_path)[0]}_3d.png" if three_d and output_path else None
+    visualization = None
+
+    # A cached render skips image analysis entirely
+    render_key = None
+    if cache and output_path:
+        render_key = generator.render_cache_key(analysis, "enhanced.svg" if vector else output_path)
+    rendered = None
+    if render_key:
+        with profiler.stage("cache"):
+            rendered = cache.get_render(render_key)
+
+    if rendered is not None:
+        with profiler.stage("encode"), open(output_path, "wb") as f:
+            f.write(rendered)
+        print(f"Enhanced floor plan saved to {output_path}")
+        result["enhanced"] = rendered.decode("utf-8") if vector else Image.open(output_path)
+    else:
+        analysis_cached = cache is not None and analysis.load_cached(cache)
+        # Only contour detection runs in tiles, so other engines are never tiled for the budget alone
+        tiled = bool(output_path) and not vector and (
+            tiled or (memory_budget is not None and detection == "contours" and
+                      needs_tiling(analysis.size, memory_budget))
+        )
+
+        # Near-duplicates of an analysed plan reuse its rooms; tiled runs never hold the signature's grayscale plan
+        if cache is not None and not analysis_cached and not tiled:
+            analysis_cached = analysis.load_similar(cache)
+
+        # Rooms are needed up front to start the 3D rendering; matplotlib's pyplot is not thread-safe
+        if three_d and pool is not None and not tiled and renderer_3d == "native":
+            generator._load_rooms(analysis, prefetch_walls=not vector)
+            visualization = pool.submit(
+                generator.generate_3d_visualization, analysis, three_d_output, renderer=renderer_3d
+            )
+
+        if vector:
+            result["enhanced"] = generator.render_svg(analysis, output_path)
+        elif tiled:
+            result["enhanced"] = generator.enhance_floor_plan_tiled(
+                analysis, output_path, memory_budget=memory_budget or DEFAULT_MEMORY_BUDGET,
+                scratch_dir=scratch_dir
+            )
+        else:
+            result["enhanced"] = generator.enhance_floor_plan(analysis, output_path)
+        if render_key:
+            with profiler.stage("cache"), open(output_path, "rb") as f:
+                cache.put_render(render_key, f.read())
+
+    if (three_d or export_data or mesh) and cache is not None and rendered is not None:
+        analysis_cached = analysis.load_cached(cache)
+
+    if visualization is not None:
+        result["visualization3D"] = visualization.result()
+    elif three_d:
+        result["visualization3D"] = generator.generate_3d_visualization(
+            analysis, three_d_output, renderer=renderer_3d
+        )
+
+    if renditions and output_path and not vector:
+        with profiler.stage("renditions"):
+            result["renditions"] = write_renditions(
+                result["enhanced"], output_path, renditions, generator.dpi, generator.quality,
+                generator.compress_level
+            )
+
+    if mesh:
+        result["mesh"] = generator.export_mesh(analysis, mesh)
+
+    if export_data:
+        result["data"] = generator.export_floor_plan_data(analysis, export_data)
+
+    # Tiled runs never hold the full-resolution wall mask the cache entry needs
+    if cache is not None and not analysis_cached and not tiled and "rooms" in analysis.__dict__:
+        analysis.store_cached(cache)
+
+    # Describe the plan for the profile report without forcing any extra work
+    if "size" in analysis.__dict__:
+        profiler.annotate(image={"width": analysis.width, "height": analysis.height, "path": input_path})
+    if "rooms" in analysis.__dict__:
+        profiler.annotate(rooms=len(analysis.rooms))
+
+    return result
+
+
+def process_floor_plan_bytes(generator, data, three_d=False, export_data=False, cache=None,
+                             detection="contours", detection_scale=1, renderer_3d="native", enhanced_format="png",
+                             max_pixels=None, degrade=DEGRADATIONS):
+    """
+    Run the enhance, 3D and export stages on an in-memory floor plan
+
+    Nothing is read from or written to disk apart from the cache.
+
+    Args:
+        generator: FloorPlanGenerator instance to use
+        data: Encoded image bytes, a grayscale or RGB uint8 array, or a PIL image
+        three_d: Whether to render the 3D visualization
+        export_data: Whether to return the floor plan data
+        cache: Optional FloorPlanCache for detection results and rendered outputs
+        detection: Room detection engine, one of DETECTION_ENGINES
+        detection_scale: Downscale factor for room detection, or "auto"
+        renderer_3d: 3D renderer, "native" or "matplotlib"
+        enhanced_format: "png" for a raster or "svg" for vector output
+        max_pixels: Optional pixel budget; larger plans are degraded (see admit_floor_plan)
+        degrade: Degradations allowed for a plan over its pixel budget
+
+    Returns:
+        Dictionary with the enhanced PNG (or SVG) as bytes under "enhanced",
+        plus the 3D PNG under "visualization3D" and the room data under "data"
+        if requested (None if that stage failed), and the degradation report
+        under "degraded" if the plan was over its pixel budget
+    """
+    analysis = FloorPlanAnalysis(data, detection, detection_scale)
+    analysis_cached = False
+    result = {}
+
+    generator, analysis, three_d, degraded = admit_floor_plan(generator, analysis, max_pixels, degrade, three_d,
+                                                              enhanced_format == "svg")
+    if degraded:
+        result["degraded"] = degraded
+
+    # Any name with the format's extension gives the render cache key
+    render_key = generator.render_cache_key(analysis, f"enhanced.{enhanced_format}") if cache else None
+    rendered = None
+    if render_key:
+        with profiler.stage("cache"):
+            rendered = cache.get_render(render_key)
+
+    if rendered is None:
+        analysis_cached = cache is not None and (analysis.load_cached(cache) or analysis.load_similar(cache))
+        buffer = io.BytesIO()
+        if enhanced_format == "svg":
+            generator.render_svg(analysis, buffer)
+        else:
+            generator.enhance_floor_plan(analysis, buffer)
+        rendered = buffer.getvalue()
+        if render_key:
+            with profiler.stage("cache"):
+                cache.put_render(render_key, rendered)
+    elif (three_d or export_data) and cache is not None:
+        analysis_cached = analysis.load_cached(cache)
+    result["enhanced"] = rendered
+
+    if three_d:
+        buffer = io.BytesIO()
+        saved = generator.generate_3d_visualization(analysis, buffer, renderer=renderer_3d)
+        result["visualization3D"] = buffer.getvalue() if saved is not None else None
+
+    if export_data:
+        result["data"] = generator.export_floor_plan_data(analysis, None)
+
+    if cache is not None and not analysis_cached and "rooms" in analysis.__dict__:
+        analysis.store_cached(cache)
+
+    if "size" in analysis.__dict__:
+        profiler.annotate(image={"width": analysis.width, "height": analysis.height, "path": None})
+    if "rooms" in analysis.__dict__:
+        profiler.annotate(rooms=len(analysis.rooms))
+
+    return result
+
+
+def write_frame(stream, name, payload):
+    """
+    Write one named output to a binary stream
+
+    A frame is the name length (one byte), the UTF-8 name, the payload length
+    (four bytes, big-endian) and the payload. Frames follow each other until
+    the end of the stream.
+    """
+    encoded = name.encode("utf-8")
+    stream.write(struct.pack(">B", len(encoded)) + encoded + struct.pack(">I", len(payload)))
+    stream.write(payload)
+
+
+def read_frames(stream):
+    """Yield (name, payload) for each frame written by write_frame until the stream ends"""
+    while True:
+        header = stream.read(1)
+        if not header:
+            return
+        name = stream.read(header[0]).decode("utf-8")
+        length, = struct.unpack(">I", stream.read(4))
+        yield name, stream.read(length)
+
+
+def run_job(job):
+    """
+    Process one serve-mode job and return a JSON-serialisable result
+
+    A job carries the same options as the command line: input, output,
+    color_scheme, dpi, show_dimensions, show_labels, contrast, sharpness,
+    pixels_per_meter, simplify, format ("png" or "svg"; defaults to the output
+    extension), quality, compress_level, threads, renditions, three_d, export_data (a
+    path, or true to only return the data), detection, detection_scale, mesh,
+    renderer_3d, tiled, memory_budget (in megabytes), scratch_dir, max_megapixels
+    and degrade (see admit_floor_plan; the result then reports the applied
+    degradations under degraded). A job with schemes (a list of names or "all")
+    and/or palettes (custom colors by name) renders every scheme from one
+    analysis. With profile set (or FLOOR_PLAN_PROFILE in the environment) the
+    result carries a per-stage profile report.
+
+    A job may carry the image base64-encoded as input_data instead of an
+    input path. Such jobs, and jobs with inline set, write no files: the
+    result carries the enhanced PNG (and the 3D PNG) base64-encoded as
+    enhancedFloorPlanData (and visualization3DData), plus the room data if
+    export_data is set.
+
+    A job with session renders for an editor: the worker keeps the render of
+    the detected rooms (see FloorPlanGenerator.render_state), and later jobs
+    of the session with the edited rooms as room_data only redraw the regions
+    the edit affects (see update_render). The result lists the updated boxes
+    as dirty ([left, top, right, bottom]) with their pixels as base64 PNG
+    patches, or writes the whole plan to output if given. Sessions live in
+    the worker that rendered them; with several workers, a job landing
+    elsewhere renders the detected rooms and applies room_data to them, with
+    the same result.
+    """
+    job_id = job.get("id")
+    try:
+        enabled = bool(job.get("profile")) or bool(os.environ.get("FLOOR_PLAN_PROFILE"))
+        with profiler.profiling(enabled) as stage_profiler:
+            result = _run_job(job)
+        if stage_profiler is not None:
+            result["profile"] = stage_profiler.report()
+        return result
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return {"id": job_id, "success": False, "error": str(e)}
+
+
+def _run_job(job):
+    """Process one serve-mode job; see run_job"""
+    job_id = job.get("id")
+    input_path = job.get("input")
+    input_data = base64.b64decode(job["input_data"]) if job.get("input_data") else None
+    if input_data is None and (not input_path or not os.path.exists(input_path)):
+        raise ValueError(f"Input file '{input_path}' does not exist")
+
+    color_scheme = job.get("color_scheme", "modern")
+    if color_scheme not in COLOR_SCHEMES:
+        raise ValueError(f"Unknown color scheme '{color_scheme}'")
+    max_pixels = float(job["max_megapixels"]) * 1_000_000 if job.get("max_megapixels") else None
+    degrade = parse_degradations(job["degrade"]) if "degrade" in job else DEGRADATIONS
+
+    settings = (
+        color_scheme,
+        int(job.get("dpi", 300)),
+        bool(job.get("show_dimensions", True)),
+        bool(job.get("show_labels", True)),
+        None if job.get("contrast") is None else float(job["contrast"]),
+        None if job.get("sharpness") is None else float(job["sharpness"]),
+        float(job.get("pixels_per_meter", PIXELS_PER_METER)),
+        float(job.get("simplify", SIMPLIFY_TOLERANCE)),
+        None if job.get("quality") is None else int(job["quality"]),
+        int(job.get("compress_level", PNG_COMPRESS_LEVEL)),
+        int(job.get("threads", 1))
+    )
+    generator = _WORKER_GENERATORS.get(settings)
+    if generator is None:
+        generator = FloorPlanGenerator(*settings)
+        _WORKER_GENERATORS[settings] = generator
+
+    if job.get("schemes") or job.get("palettes"):
+        color_schemes = resolve_color_schemes(job.get("schemes"), job.get("palettes"))
+        analysis = FloorPlanAnalysis(input_data if input_data is not None else input_path,
+                                     job.get("detection", "contours"), job.get("detection_scale", 1))
+        with contextlib.redirect_stdout(sys.stderr):
+            rendered = generator.render_schemes(analysis, color_schemes, job.get("output"))
+        return {
+            "id": job_id,
+            "success": True,
+            "schemes": {name: path for name, (_, path) in rendered.items()}
+        }
+
+    if job.get("session") is not None:
+        return _run_session_job(job, generator, settings, input_data if input_data is not None else input_path)
+
+    # Inline jobs return their outputs base64-encoded in the result instead of writing files
+    if input_data is not None or job.get("inline"):
+        if input_data is None:
+            with open(input_path, "rb") as f:
+                input_data = f.read()
+        with contextlib.redirect_stdout(sys.stderr):
+            outputs = process_floor_plan_bytes(
+                generator,
+                input_data,
+                three_d=bool(job.get("three_d", job.get("3d", False))),
+                export_data=bool(job.get("export_data")),
+                cache=get_cache(),
+                detection=job.get("detection", "contours"),
+                detection_scale=job.get("detection_scale", 1),
+                renderer_3d=job.get("renderer_3d", "native"),
+                enhanced_format=job.get("format") or "png",
+                max_pixels=max_pixels,
+                degrade=degrade
+            )
+        result = {
+            "id": job_id,
+            "success": True,
+            "enhancedFloorPlanData": base64.b64encode(outputs["enhanced"]).decode("ascii")
+        }
+        if "degraded" in outputs:
+            result["degraded"] = outputs["degraded"]
+        if "visualization3D" in outputs:
+            rendered_3d = outputs["visualization3D"]
+            result["visualization3DData"] = base64.b64encode(rendered_3d).decode("ascii") if rendered_3d else None
+        if "data" in outputs:
+            result["data"] = outputs["data"]
+        return result
+
+    # Keep stage messages off stdout, which carries the results
+    with contextlib.redirect_stdout(sys.stderr):
+        outputs = process_floor_plan(
+            generator,
+            input_path,
+            job.get("output"),
+            three_d=bool(job.get("three_d", job.get("3d", False))),
+            export_data=job.get("export_data"),
+            cache=get_cache(),
+            detection=job.get("detection", "contours"),
+            mesh=job.get("mesh"),
+            renderer_3d=job.get("renderer_3d", "native"),
+            tiled=bool(job.get("tiled", False)),
+            memory_budget=int(float(job["memory_budget"]) * 1024 * 1024) if job.get("memory_budget") else None,
+            scratch_dir=job.get("scratch_dir"),
+            detection_scale=job.get("detection_scale", 1),
+            enhanced_format=job.get("format"),
+            renditions=job.get("renditions"),
+            max_pixels=max_pixels,
+            degrade=degrade
+        )
+
+    result = {"id": job_id, "success": True, "enhancedFloorPlan": job.get("output")}
+    if "degraded" in outputs:
+        result["degraded"] = outputs["degraded"]
+    if "visualization3D" in outputs:
+        result["visualization3D"] = outputs["visualization3D"]
+    if "mesh" in outputs:
+        result["mesh"] = outputs["mesh"]
+    if "renditions" in outputs:
+        result["renditions"] = outputs["renditions"]
+    if "data" in outputs:
+        if isinstance(job.get("export_data"), str):
+            result["floorPlanData"] = job["export_data"]
+        result["data"] = outputs["data"]
+    if get_cache() is not None:
+        result["cache"] = get_cache().report()
+    return result
+
+
+def _run_session_job(job, generator, settings, source):
+    """
+    Render an editor session's plan, or apply its edited rooms to the previous render; see run_job
+
+    Returns:
+        Result dictionary with the updated boxes, and their PNG patches unless an output is written
+    """
+    detection, detection_scale = job.get("detection", "contours"), job.get("detection_scale", 1)
+    key = (job["session"], settings, job.get("input"), detection, detection_scale)
+    room_data = job.get("room_data")
+    state = _RENDER_SESSIONS.pop(key, None)
+    output_path = job.get("output")
+
+    # Keep stage messages off stdout, which carries the results
+    with contextlib.redirect_stdout(sys.stderr):
+        if state is None or room_data is None:
+            # Sessions start from the render of the detected rooms, whose label map and contrast pivot
+            # every edit keeps, so a worker without the session renders the same pixels
+            analysis = FloorPlanAnalysis(source, detection, detection_scale)
+            cache = get_cache()
+            analysis_cached = cache is not None and analysis.load_cached(cache)
+            state = generator.render_state(analysis)
+            if cache is not None and not analysis_cached:
+                analysis.store_cached(cache)
+            dirty = [(0, 0) + state.size]
+            if room_data is not None:
+                generator.update_render(state, room_data)
+        else:
+            dirty = generator.update_render(state, room_data)
+
+        if output_path:
+            with profiler.stage("encode"):
+                save_image(state.image, output_path, generator.dpi, generator.quality, generator.compress_level)
+
+    _RENDER_SESSIONS[key] = state
+    while len(_RENDER_SESSIONS) > MAX_RENDER_SESSIONS:
+        _RENDER_SESSIONS.popitem(last=False)
+
+    result = {"id": job.get("id"), "success": True, "session": job["session"], "size": list(state.size),
+              "dirty": [list(box) for box in dirty]}
+    if output_path:
+        result["enhancedFloorPlan"] = output_path
+    else:
+        patches = []
+        with profiler.stage("encode"):
+            for box in dirty:
+                buffer = io.BytesIO()
+                save_image(state.patch(box), buffer, generator.dpi, generator.quality, generator.compress_level)
+                patches.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+        result["patches"] = patches
+    return result
+
+
+def _warm_worker():
+    """Import the heavy dependencies up front so a worker's first job does not pay for them"""
+    cv2.__version__
+
+
+def _parse_job(line):
+    """Parse a newline-delimited JSON job, returning (job, error)"""
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        return None, f"Invalid job: {e}"
+    if not isinstance(job, dict) or ("input" not in job and "input_data" not in job):
+        return None, "Invalid job: expected an object with an 'input' or 'input_data' field"
+    return job, None
+
+
+def job_pixels(job):
+    """Pixel count of a job's input image, read from the image header"""
+    source = base64.b64decode(job["input_data"]) if job.get("input_data") else job["input"]
+    width, height = FloorPlanAnalysis(source).size
+    return width * height
+
+
+class _JobServer:
+    """
+    Dispatches newline-delimited JSON jobs to a pool of warm workers
+
+    With a global pixel_budget, the pixels of queued and running jobs are
+    counted against it: a job arriving while the budget is taken gets its
+    own budget (max_megapixels) lowered to what is left, but never below
+    MIN_ADMITTED_PIXELS, so huge plans are degraded during spikes instead of
+    starving normal ones.
+    """
+
+    def __init__(self, workers=None, max_jobs=None, pixel_budget=None):
+        import multiprocessing
+        self.pool = multiprocessing.Pool(processes=workers, maxtasksperchild=max_jobs, initializer=_warm_worker)
+        self.pixel_budget = pixel_budget
+        self.admitted_pixels = 0
+        self.lock = threading.Lock()
+
+    def _admit(self, job):
+        """Fit a job into the global pixel budget; returns the pixels it holds until it completes"""
+        if not self.pixel_budget:
+            return 0
+        try:
+            pixels = job_pixels(job)
+        except Exception:
+            # The worker reports unreadable inputs
+            return 0
+
+        with self.lock:
+            available = max(self.pixel_budget - self.admitted_pixels, min(MIN_ADMITTED_PIXELS, self.pixel_budget))
+            budget = min(float(job["max_megapixels"]) * 1_000_000 if job.get("max_megapixels") else available,
+                         available)
+            if pixels > budget:
+                job["max_megapixels"] = budget / 1_000_000
+            held = min(pixels, budget)
+            self.admitted_pixels += held
+        return held
+
+    def submit(self, line, reply):
+        """Submit one job line or job dictionary; reply is called with the result dictionary"""
+        job, error = (dict(line), None) if isinstance(line, dict) else _parse_job(line)
+        if error:
+            reply({"id": None, "success": False, "error": error})
+            return
+        held = self._admit(job)
+
+        def done(result):
+            with self.lock:
+                self.admitted_pixels -= held
+            reply(result)
+
+        self.pool.apply_async(
+            run_job, (job,),
+            callback=done,
+            error_callback=lambda e: done({"id": job.get("id"), "success": False, "error": str(e)})
+        )
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def serve_stdin(workers=None, max_jobs=None, pixel_budget=None):
+    """Read jobs from stdin and write one JSON result line per job to stdout"""
+    server = _JobServer(workers, max_jobs, pixel_budget)
+    lock = threading.Lock()
+
+    def reply(result):
+        with lock:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
+    try:
+        for line in sys.stdin:
+            if line.strip():
+                server.submit(line, reply)
+    finally:
+        server.close()
+
+
+def serve_socket(socket_path, workers=None, max_jobs=None, pixel_budget=None):
+    """Accept jobs over a Unix socket, one JSON result line per job line"""
+    import socketserver
+    server = _JobServer(workers, max_jobs, pixel_budget)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            lock = threading.Lock()
+            for raw in self.rfile:
+                line = raw.decode("utf-8").strip()
+                if not line:
+                    continue
+                done = threading.Event()
+
+                def reply(result):
+                    with lock:
+                        self.wfile.write((json.dumps(result) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    done.set()
+
+                server.submit(line, reply)
+                done.wait()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as unix_server:
+        print(f"Serving floor plan jobs on {socket_path}", file=sys.stderr)
+        try:
+            unix_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.unlink(socket_path)
+
+
+# Image types picked up when a batch source is a directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def iter_batch_jobs(source, output_dir=None, data_dir=None, **options):
+    """
+    Return the batch jobs of a directory, glob pattern or JSONL manifest
+
+    Manifest lines are passed through unchanged, as serve-mode jobs, and read
+    lazily. For directories and globs, each image gets a job built from
+    options, with outputs inside output_dir and data_dir named after the
+    image's path below the directory (or the glob's fixed leading part),
+    with the extension of the output format.
+
+    Raises:
+        ValueError: If two images would write the same outputs
+    """
+    if source.endswith('.jsonl') and os.path.isfile(source):
+        return _iter_manifest(source)
+
+    if os.path.isdir(source):
+        root = source
+        paths = [
+            entry.path for entry in sorted(os.scandir(source), key=lambda e: e.name)
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+    else:
+        # Paths are named below the directory holding the pattern's first wildcard
+        wildcard = min((source.find(c) for c in "*?[" if c in source), default=len(source))
+        root = os.path.dirname(source[:wildcard]) or "."
+        paths = sorted(glob.iglob(source, recursive=True))
+
+    extension = ".svg" if options.get("format") == "svg" else ".png"
+    jobs, names = [], {}
+    for path in paths:
+        name = os.path.splitext(os.path.relpath(path, root))[0]
+        if name in names:
+            raise ValueError(f"'{names[name]}' and '{path}' would write the same outputs")
+        names[name] = path
+        job = dict(options, id=path, input=path)
+        if output_dir:
+            job["output"] = os.path.join(output_dir, name + extension)
+            os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+        if data_dir:
+            job["export_data"] = os.path.join(data_dir, name + ".json")
+            os.makedirs(os.path.dirname(job["export_data"]), exist_ok=True)
+        jobs.append(job)
+    return iter(jobs)
+
+
+def _iter_manifest(path):
+    """Yield the job lines of a JSONL manifest"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def run_batch(jobs, workers=None, max_jobs=None, max_in_flight=None, data_stream=None, pixel_budget=None):
+    """
+    Process jobs on a process pool, streaming one JSON result line per plan
+
+    At most max_in_flight jobs (default: twice the worker count) are queued
+    at once, within the global pixel_budget if given (see _JobServer).
+    Failed plans are reported in their result line and do not stop the
+    batch. With data_stream (a binary file), the floor plan data of every
+    job that returns it is also written there as one JSONL line.
+
+    Returns:
+        Tuple of (succeeded, failed) counts
+    """
+    workers = workers or os.cpu_count() or 1
+    slots = threading.BoundedSemaphore(max_in_flight or workers * 2)
+    lock = threading.Lock()
+    counts = {"succeeded": 0, "failed": 0}
+
+    def reply(result):
+        with lock:
+            counts["succeeded" if result.get("success") else "failed"] += 1
+            if data_stream is not None and result.get("data") is not None:
+                data_stream.write(encode_floor_plan_data(result["data"], "jsonl"))
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+        slots.release()
+
+    server = _JobServer(workers, max_jobs, pixel_budget)
+    try:
+        for job in jobs:
+            slots.acquire()
+            server.submit(job, reply)
+    finally:
+        server.close()
+
+    return counts["succeeded"], counts["failed"]
+
+
+@contextlib.contextmanager
+def profile_report(target):
+    """
+    Profile the enclosed block and write one JSON report when it ends
+
+    Args:
+        target: Path of the report file, a text stream, or "-" for stdout;
+            other output is then moved to stderr so stdout carries only the report
+    """
+    real_stdout = sys.stdout
+    redirect = contextlib.redirect_stdout(sys.stderr) if target == "-" else contextlib.nullcontext()
+    with profiler.profiling() as stage_profiler, redirect:
+        try:
+            yield stage_profiler
+        finally:
+            report = json.dumps(stage_profiler.report())
+            stream = real_stdout if target == "-" else target if hasattr(target, "write") else None
+            if stream is not None:
+                stream.write(report + "\n")
+                stream.flush()
+            else:
+                with open(target, "w") as f:
+                    f.write(report + "\n")
+
+
+def _run_stdio(generator, args):
+    """
+    Process a plan read from stdin and/or written to stdout for the command line
+
+    The input "-" is read from stdin, and outputs named "-" go to stdout: as
+    raw bytes when only one output goes there, otherwise as frames (see
+    write_frame) named enhanced, visualization3D and data. With --3d the 3D
+    visualization follows the enhanced output to stdout. Stage messages go
+    to stderr.
+
+    Returns:
+        Exit code for the command line
+    """
+    if args.input == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        with open(args.input, "rb") as f:
+            data = f.read()
+
+    output = args.output or ("-" if args.input == "-" else None)
+    three_d_output = None
+    if args.three_d and output:
+        three_d_output = "-" if output == "-" else f"{os.path.splitext(output)[0]}_3d.png"
+    enhanced_format = args.format or ("svg" if output and output.lower().endswith(".svg") else "png")
+
+    with contextlib.redirect_stdout(sys.stderr):
+        result = process_floor_plan_bytes(
+            generator, data, three_d=bool(three_d_output), export_data=bool(args.export_data), cache=get_cache(),
+            detection=args.detection, detection_scale=args.detection_scale, renderer_3d=args.renderer_3d,
+            enhanced_format=enhanced_format, max_pixels=_megapixels(args.max_megapixels), degrade=args.degrade
+        )
+
+    outputs = [("enhanced", result["enhanced"], output)]
+    if three_d_output:
+        outputs.append(("visualization3D", result.get("visualization3D"), three_d_output))
+    if args.export_data:
+        data_format = "json" if args.export_data == "-" else floor_plan_data_format(args.export_data)
+        payload = encode_floor_plan_data(result["data"], data_format) if result["data"] is not None else None
+        outputs.append(("data", payload, args.export_data))
+
+    # Framing depends on what was requested, so readers know what to expect
+    framed = sum(target == "-" for _, _, target in outputs) > 1
+    stdout = sys.stdout.buffer
+    for name, payload, target in outputs:
+        # Outputs skipped by the degradation policy keep the framing as requested
+        if target is None or name not in result:
+            continue
+        if payload is None:
+            print(f"Warning: Failed to generate {name}", file=sys.stderr)
+        elif target != "-":
+            with open(target, "wb") as f:
+                f.write(payload)
+            print(f"Saved {name} to {target}", file=sys.stderr)
+        elif framed:
+            write_frame(stdout, name, payload)
+        else:
+            stdout.write(payload)
+    stdout.flush()
+
+    return 0 if result["enhanced"] else 1
+
+
+def _megapixels(value):
+    """Pixel count from a command-line megapixel value, or None if not given"""
+    return float(value) * 1_000_000 if value else None
+
+
+def _detection_scale(value):
+    """Parse a --detection-scale value: "auto" or a positive integer factor"""
+    if value == "auto":
+        return value
+    factor = int(value)
+    if factor < 1:
+        raise argparse.ArgumentTypeError("detection scale must be at least 1")
+    return factor
+
+
 def main():
     """Main function to run the script from command line"""
     parser = argparse.ArgumentParser(description='Floor Plan Generator')
-    parser.add_argument('input', help='Input floor plan image path')
-    parser.add_argument('--output', '-o', help='Output path for enhanced floor plan')
+    parser.add_argument('input', nargs='?', help='Input floor plan image path, or - for stdin')
+    parser.add_argument('--output', '-o',
+                        help='Output path for enhanced floor plan, or - for stdout (several outputs on '
+                             'stdout are framed)')
     parser.add_argument('--color-scheme', '-c', choices=COLOR_SCHEMES.keys(), default='modern',
                         help='Color scheme to use')
     parser.add_argument('--dpi', '-d', type=int, default=300, help='DPI for output image')
     parser.add_argument('--no-dimensions', action='store_true', help='Hide dimensions')
     parser.add_argument('--no-labels', action='store_true', help='Hide room labels')
+    parser.add_argument('--contrast', type=float, default=None,
+                        help='Contrast factor of the final enhancement (1 disables; default 1.2)')
+    parser.add_argument('--sharpness', type=float, default=None,
+                        help='Sharpness factor of the final enhancement (1 disables; default 1.5)')
     parser.add_argument('--3d', dest='three_d', action='store_true', help='Generate 3D visualization')
-    parser.add_argument('--export-data', help='Export floor plan data as JSON')
+    parser.add_argument('--3d-renderer', dest='renderer_3d', choices=['native', 'matplotlib'], default='native',
+                        help='Renderer for the 3D visualization')
+    parser.add_argument('--mesh', help='Export the 3D mesh as OBJ or glTF (by file extension)')
+    parser.add_argument('--export-data',
+                        help='Export floor plan data as JSON, a JSONL line or columnar .npz by extension '
+                             '(- for JSON on stdout); with --batch, a directory or one .jsonl stream')
+    parser.add_argument('--pixels-per-meter', type=float, default=PIXELS_PER_METER,
+                        help='Scale of dimensions and exported measurements')
+    parser.add_argument('--format', choices=['png', 'svg'], default=None,
+                        help='Enhanced output as a raster or as SVG vector graphics (default: from the output '
+                             'extension, PNG on stdout)')
+    parser.add_argument('--renditions', nargs='?', const=DEFAULT_RENDITIONS, metavar='SPEC',
+                        help='Also write downscaled renditions next to the output as comma-separated '
+                             'NAME[:FORMAT] items; NAME is thumbnail, preview, full or a longest edge in pixels '
+                             f'and FORMAT png, webp or jpeg (default: {DEFAULT_RENDITIONS})')
+    parser.add_argument('--quality', type=int, default=None,
+                        help='WebP and JPEG quality from 0 to 100 (WebP is lossless unless given)')
+    parser.add_argument('--compress-level', type=int, choices=range(10), default=PNG_COMPRESS_LEVEL,
+                        metavar='0-9', help='PNG compression level (0 fastest, 9 smallest)')
+    parser.add_argument('--simplify', type=float, default=SIMPLIFY_TOLERANCE,
+                        help='Tolerance of room polygons in SVG output and data exports, as a fraction of '
+                             'the room perimeter')
+    parser.add_argument('--detection', choices=DETECTION_ENGINES, default='contours',
+                        help='Room detection engine')
+    parser.add_argument('--detection-scale', type=_detection_scale, default=1,
+                        help='Detect rooms on a copy downscaled by this factor, or "auto" to pick one '
+                             'from the image size (default: 1). Pays off for components detection, and for '
+                             'contour detection above about 16 megapixels')
+    parser.add_argument('--schemes',
+                        help='Render several color schemes from one analysis: comma-separated names or "all"')
+    parser.add_argument('--palette',
+                        help='Custom palettes as JSON (or a JSON file) mapping a name to colors')
+    parser.add_argument('--tiled', action='store_true',
+                        help='Enhance the plan in overlapping tiles, bounding intermediate buffers '
+                             '(the source image is still decoded whole)')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='Budget in megabytes for intermediate buffers, not counting the decoded '
+                             'source image; plans that would exceed it are processed in tiles')
+    parser.add_argument('--scratch-dir',
+                        help='Directory for tiled scratch buffers (default: system temp; avoid tmpfs)')
+    parser.add_argument('--max-megapixels', type=float, default=None,
+                        help='Pixel budget of a plan, read from the image header; larger plans are degraded')
+    parser.add_argument('--pixel-budget', type=float, default=None, metavar='MEGAPIXELS',
+                        help='With --serve, --socket or --batch, pixels of all queued and running plans; '
+                             'plans arriving when it is taken get a lower budget of their own')
+    parser.add_argument('--degrade', default=",".join(DEGRADATIONS),
+                        help='Degradations of plans over their pixel budget, comma-separated from '
+                             f'{", ".join(DEGRADATIONS)}, or none to reject them (default: all)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a persistent worker reading JSON jobs from stdin')
+    parser.add_argument('--socket', help='Serve jobs on this Unix socket instead of stdin')
+    parser.add_argument('--batch', metavar='SOURCE',
+                        help='Process a directory, glob or JSONL manifest of jobs; '
+                             '--output and --export-data are then directories')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (defaults to the CPU count)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Worker threads per plan, running independent stages concurrently for lower '
+                             'latency on one large plan (output is identical; default 1)')
+    parser.add_argument('--max-jobs', type=int, default=None,
+                        help='Recycle a worker after this many jobs')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Maximum number of batch jobs queued at once')
+    parser.add_argument('--cache-dir', help='Cache detection results and renders in this directory')
+    parser.add_argument('--cache-size', type=float, default=None,
+                        help='Cache size limit in megabytes (default 512)')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='PATH',
+                        help='Write per-stage timing and memory as JSON to PATH (default: stdout)')
 
     args = parser.parse_args()
 
+    if args.renditions:
+        try:
+            parse_renditions(args.renditions)
+        except ValueError as e:
+            parser.error(str(e))
+    try:
+        args.degrade = parse_degradations(args.degrade)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # FLOOR_PLAN_PROFILE enables profiling too: a path, or any other value for stdout
+    profile_target = args.profile or os.environ.get("FLOOR_PLAN_PROFILE")
+    if profile_target and profile_target.lower() in ("1", "true", "yes", "-"):
+        profile_target = "-"
+    if profile_target and (args.batch or args.serve or args.socket):
+        # Jobs report their own profile in their result line
+        os.environ["FLOOR_PLAN_PROFILE"] = "1"
+
+    # Configure the cache through the environment so worker processes inherit it
+    if args.cache_dir:
+        os.environ["FLOOR_PLAN_CACHE_DIR"] = args.cache_dir
+    if args.cache_size:
+        os.environ["FLOOR_PLAN_CACHE_SIZE"] = str(args.cache_size)
+
+    if args.batch:
+        # A .jsonl data path collects every plan's data in one stream instead of a directory
+        data_stream_path = args.export_data if args.export_data and \
+            floor_plan_data_format(args.export_data) == "jsonl" else None
+        data_dir = None if data_stream_path else args.export_data
+        for directory in (args.output, data_dir):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        try:
+            jobs = iter_batch_jobs(
+                args.batch,
+                output_dir=args.output,
+                data_dir=data_dir,
+                color_scheme=args.color_scheme,
+                dpi=args.dpi,
+                show_dimensions=not args.no_dimensions,
+                show_labels=not args.no_labels,
+                contrast=args.contrast,
+                sharpness=args.sharpness,
+                pixels_per_meter=args.pixels_per_meter,
+                simplify=args.simplify,
+                format=args.format,
+                quality=args.quality,
+                compress_level=args.compress_level,
+                threads=args.threads,
+                renditions=args.renditions,
+                three_d=args.three_d,
+                detection=args.detection,
+                renderer_3d=args.renderer_3d,
+                tiled=args.tiled,
+                memory_budget=args.memory_budget,
+                scratch_dir=args.scratch_dir,
+                detection_scale=args.detection_scale,
+                max_megapixels=args.max_megapixels,
+                degrade=list(args.degrade),
+                **({"export_data": True} if data_stream_path else {})
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        with contextlib.ExitStack() as stack:
+            data_stream = stack.enter_context(open(data_stream_path, "ab")) if data_stream_path else None
+            succeeded, failed = run_batch(jobs, args.workers, args.max_jobs, args.max_in_flight, data_stream,
+                                          _megapixels(args.pixel_budget))
+        print(f"Batch completed: {succeeded} succeeded, {failed} failed", file=sys.stderr)
+        sys.exit(1 if failed else 0)
+
+    if args.serve or args.socket:
+        if args.socket:
+            serve_socket(args.socket, args.workers, args.max_jobs, _megapixels(args.pixel_budget))
+        else:
+            serve_stdin(args.workers, args.max_jobs, _megapixels(args.pixel_budget))
+        sys.exit(0)
+
+    if not args.input:
+        parser.error("the following arguments are required: input")
+
+    # Outputs streamed to stdout push a stdout profile report to stderr
+    streaming = args.input == "-" or "-" in (args.output, args.export_data)
+    if streaming and not (args.schemes or args.palette):
+        unsupported = [flag for flag, value in (("--mesh", args.mesh), ("--renditions", args.renditions),
+                                                ("--tiled", args.tiled), ("--memory-budget", args.memory_budget))
+                       if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be combined with reading from stdin or writing to stdout")
+    if profile_target == "-" and (args.output == "-" or args.export_data == "-" or
+                                  (args.input == "-" and not args.output)):
+        profile_target = sys.stderr
+
+    report = contextlib.ExitStack()
+    if profile_target:
+        report.enter_context(profile_report(profile_target))
+
     try:
         # Check if input file exists
-        if not os.path.exists(args.input):
-            print(f"Error: Input file '{args.input}' does not exist")
+        if args.input != "-" and not os.path.exists(args.input):
+            print(f"Error: Input file '{args.input}' does not exist", file=sys.stderr if streaming else None)
             sys.exit(1)
 
         # Create the generator
@@ -485,41 +3779,69 @@ def main():
             color_scheme=args.color_scheme,
             dpi=args.dpi,
             show_dimensions=not args.no_dimensions,
-            show_labels=not args.no_labels
+            show_labels=not args.no_labels,
+            contrast=args.contrast,
+            sharpness=args.sharpness,
+            pixels_per_meter=args.pixels_per_meter,
+            simplify=args.simplify,
+            quality=args.quality,
+            compress_level=args.compress_level,
+            threads=args.threads
         )
 
-        # Generate the enhanced floor plan
-        if args.output:
-            enhanced = generator.enhance_floor_plan(args.input, args.output)
-            if enhanced is None:
-                print("Error: Failed to enhance floor plan")
-                sys.exit(1)
-        else:
-            enhanced = generator.enhance_floor_plan(args.input)
-            if enhanced is None:
-                print("Error: Failed to enhance floor plan")
+        # Read from stdin and/or write to stdout without temporary files
+        if streaming and not (args.schemes or args.palette):
+            sys.exit(_run_stdio(generator, args))
+
+        # Render several color schemes from a single analysis
+        if args.schemes or args.palette:
+            if not args.output:
+                print("Error: --output is required when rendering several color schemes")
                 sys.exit(1)
+            names = args.schemes if args.schemes == "all" else [n for n in (args.schemes or "").split(",") if n]
+            color_schemes = resolve_color_schemes(names, args.palette)
+            source = sys.stdin.buffer.read() if args.input == "-" else args.input
+            analysis = FloorPlanAnalysis(source, args.detection, args.detection_scale)
+            generator.render_schemes(analysis, color_schemes, args.output)
+            print("Floor plan processing completed successfully")
+            sys.exit(0)
+
+        # Generate the enhanced floor plan, 3D visualization and data export
+        cache = get_cache()
+        result = process_floor_plan(generator, args.input, args.output, args.three_d, args.export_data,
+                                    cache=cache, detection=args.detection, mesh=args.mesh,
+                                    renderer_3d=args.renderer_3d, tiled=args.tiled,
+                                    memory_budget=int(args.memory_budget * 1024 * 1024) if args.memory_budget else None,
+                                    scratch_dir=args.scratch_dir, detection_scale=args.detection_scale,
+                                    enhanced_format=args.format, renditions=args.renditions,
+                                    max_pixels=_megapixels(args.max_megapixels), degrade=args.degrade)
+        enhanced = result["enhanced"]
+        if enhanced is None:
+            print("Error: Failed to enhance floor plan")
+            sys.exit(1)
+        if not args.output:
             enhanced.show()
 
-        # Generate 3D visualization if requested
-        if args.three_d:
-            three_d_output = args.output.replace('.png', '_3d.png') if args.output else None
-            result = generator.generate_3d_visualization(args.input, three_d_output)
-            if result is None:
-                print("Warning: Failed to generate 3D visualization")
+        if args.three_d and "visualization3D" in result and result["visualization3D"] is None:
+            print("Warning: Failed to generate 3D visualization")
+
+        if args.export_data and result["data"] is None:
+            print("Warning: Failed to export floor plan data")
+
+        if args.mesh and result["mesh"] is None:
+            print("Warning: Failed to export 3D mesh")
 
-        # Export data if requested
-        if args.export_data:
-            result = generator.export_floor_plan_data(args.input, args.export_data)
-            if result is None:
-                print("Warning: Failed to export floor plan data")
+        if cache is not None:
+            print(f"Cache stats: {json.dumps(cache.report())}")
 
         print("Floor plan processing completed successfully")
         sys.exit(0)
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Error: {e}", file=sys.stderr if streaming else None)
         traceback.print_exc()
         sys.exit(1)
+    finally:
+        report.close()
 
 
 if __name__ == "__main__":
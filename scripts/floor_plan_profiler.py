@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Profiler - Per-stage timing and memory instrumentation
+Records wall-clock time, CPU time and peak RSS for each pipeline stage and
+produces a single machine-readable report.
+"""
+
+import os
+import sys
+import time
+import threading
+import contextlib
+import functools
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Profiler that stage() records into, or None when profiling is disabled
+_ACTIVE = None
+
+
+def _read_peak_rss():
+    """Peak resident set size in bytes since the last reset, or None if unavailable"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS high-water mark where the kernel allows it (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class StageProfiler:
+    """
+    Collects per-stage measurements
+
+    Stage times are exclusive: time spent in a nested stage (for example
+    detection triggered from the 3D stage) is only counted for the inner
+    stage. Peak RSS is reset at the start of each stage on Linux; elsewhere
+    it is the process high-water mark at the end of the stage.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.metadata = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure the enclosed block as stage name"""
+        stack = self._stack()
+        if any(frame["name"] == name for frame in stack):
+            # Re-entering a running stage is counted once
+            yield
+            return
+
+        frame = {"name": name, "child_wall": 0.0, "child_cpu": 0.0, "child_peak": 0}
+        stack.append(frame)
+        _reset_peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            peak = _read_peak_rss()
+            if peak is not None:
+                # A nested stage resets the high-water mark, so keep its peak too
+                peak = max(peak, frame["child_peak"])
+            stack.pop()
+            if stack:
+                stack[-1]["child_wall"] += wall
+                stack[-1]["child_cpu"] += cpu
+                stack[-1]["child_peak"] = max(stack[-1]["child_peak"], peak or 0)
+
+            with self._lock:
+                entry = self.stages.setdefault(name, {
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "peak_rss_bytes": None,
+                    "calls": 0
+                })
+                entry["wall_seconds"] += wall - frame["child_wall"]
+                entry["cpu_seconds"] += cpu - frame["child_cpu"]
+                entry["calls"] += 1
+                if peak is not None:
+                    entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"] or 0, peak)
+
+    def report(self):
+        """Return the measurements as a JSON-serialisable dictionary"""
+        return dict(
+            self.metadata,
+            stages=self.stages,
+            total_wall_seconds=time.perf_counter() - self._started,
+            total_cpu_seconds=time.process_time() - self._cpu_started,
+            peak_rss_bytes=max(
+                [entry["peak_rss_bytes"] or 0 for entry in self.stages.values()] + [_read_peak_rss() or 0]
+            ),
+            pid=os.getpid()
+        )
+
+
+def stage(name):
+    """Context manager measuring a stage on the active profiler, a no-op when disabled"""
+    if _ACTIVE is None:
+        return contextlib.nullcontext()
+    return _ACTIVE.stage(name)
+
+
+def profiled(name):
+    """Decorator measuring every call of a function as stage name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**metadata):
+    """Attach metadata such as image size and room count to the active profiler"""
+    if _ACTIVE is not None:
+        _ACTIVE.metadata.update(metadata)
+
+
+@contextlib.contextmanager
+def profiling(enabled=True):
+    """Activate a new StageProfiler for the enclosed block and yield it (or None)"""
+    global _ACTIVE
+    if not enabled:
+        yield None
+        return
+
+    previous = _ACTIVE
+    _ACTIVE = StageProfiler()
+    try:
+        yield _ACTIVE
+    finally:
+        _ACTIVE = previous
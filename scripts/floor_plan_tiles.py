@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Tiles - Building blocks for tiled processing with bounded working buffers
+Provides scratch-file backed arrays whose pages can be dropped from memory,
+overlapping tile iteration, and a PNG writer that streams rows from an array.
+"""
+
+import os
+import mmap
+import math
+import zlib
+import struct
+import numpy as np
+
+# Default budget for the working buffers of tiled processing in bytes
+# (the decoded source image is not counted)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Approximate bytes of working memory per tile pixel across the tiled stages:
+# grayscale and edge buffers, OpenCV's Canny gradients, the class map, RGB
+# tiles and the intermediate images of the final enhancements
+TILE_BYTES_PER_PIXEL = 32
+
+# Approximate bytes per pixel held at once by the untiled pipeline
+FULL_BYTES_PER_PIXEL = 24
+
+# Smallest tile edge in pixels, so tiny budgets do not degenerate into slivers
+MIN_TILE_SIZE = 64
+
+
+def tile_size_for_budget(memory_budget, halo=0):
+    """
+    Largest square tile edge whose working set (including the halo) fits the budget
+
+    Args:
+        memory_budget: Working-memory budget in bytes
+        halo: Overlap in pixels added on every side of a tile
+
+    Returns:
+        Tile edge in pixels, at least MIN_TILE_SIZE
+    """
+    edge = int(math.sqrt(memory_budget / TILE_BYTES_PER_PIXEL)) - 2 * halo
+    return max(edge, MIN_TILE_SIZE)
+
+
+def needs_tiling(size, memory_budget):
+    """Whether the untiled pipeline would exceed the memory budget for an image of size (width, height)"""
+    width, height = size
+    return width * height * FULL_BYTES_PER_PIXEL > memory_budget
+
+
+def iter_tiles(height, width, tile, halo=0):
+    """
+    Iterate over a height x width image in row-major tiles
+
+    Yields:
+        Tuple of (rows, cols, halo_rows, halo_cols) slices: the tile itself and
+        the tile grown by halo pixels on every side, clipped to the image
+    """
+    for top in range(0, height, tile):
+        bottom = min(top + tile, height)
+        for left in range(0, width, tile):
+            right = min(left + tile, width)
+            yield (
+                slice(top, bottom),
+                slice(left, right),
+                slice(max(top - halo, 0), min(bottom + halo, height)),
+                slice(max(left - halo, 0), min(right + halo, width))
+            )
+
+
+def inner_slices(rows, cols, halo_rows, halo_cols):
+    """Slices selecting the tile (rows, cols) within an array covering (halo_rows, halo_cols)"""
+    return (
+        slice(rows.start - halo_rows.start, rows.stop - halo_rows.start),
+        slice(cols.start - halo_cols.start, cols.stop - halo_cols.start)
+    )
+
+
+class MappedArray:
+    """
+    NumPy array backed by a scratch file through a shared memory map
+
+    Written pages live in the page cache rather than in the process heap, and
+    release() drops them from the process's resident set once a band of rows
+    is finished, so the resident size stays bounded by the rows in use.
+    """
+
+    def __init__(self, path, shape, dtype=np.uint8):
+        """Create a zero-filled array of shape and dtype backed by a new file at path"""
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._row_bytes = int(np.prod(self.shape[1:], dtype=np.int64)) * self.dtype.itemsize
+        nbytes = max(self._row_bytes * self.shape[0], 1)
+
+        with open(path, "w+b") as f:
+            f.truncate(nbytes)
+            self._mmap = mmap.mmap(f.fileno(), nbytes)
+        self.array = np.frombuffer(self._mmap, self.dtype, count=int(np.prod(self.shape))).reshape(self.shape)
+
+    def release(self, rows=None):
+        """Drop the pages holding rows (a slice, or every row) from resident memory"""
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start, stop = (0, self.shape[0]) if rows is None else (rows.start, rows.stop)
+        begin = start * self._row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+        end = stop * self._row_bytes
+        if end > begin:
+            # Shared file pages stay in the page cache, so no data is lost
+            self._mmap.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+
+    def close(self):
+        """Unmap the array and delete its scratch file"""
+        if self.array is None:
+            return
+        self.array = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views of the array are still alive; the map is released with them
+            pass
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def write_png(path, rgb, dpi=None, rows_per_chunk=64, release=None, compress_level=6):
+    """
+    Encode an RGB uint8 array as PNG, streaming it in bands of rows
+
+    Only one band is held in memory at a time, so rgb can be a memory-mapped
+    array of any size. The pixels match a PNG written by PIL; the compressed
+    bytes differ because no row filters are applied.
+
+    Args:
+        path: Output file path
+        rgb: Array of shape (height, width, 3) and dtype uint8
+        dpi: Optional (x, y) resolution recorded in the pHYs chunk
+        rows_per_chunk: Number of rows compressed per band
+        release: Optional callback called with each finished slice of rows
+        compress_level: zlib level from 0 (fastest) to 9 (smallest)
+    """
+    height, width = rgb.shape[:2]
+
+    def chunk(f, kind, data):
+        f.write(struct.pack(">I", len(data)))
+        f.write(kind)
+        f.write(data)
+        f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        if dpi:
+            # Pixels per metre, as written by PIL
+            chunk(f, b"pHYs", struct.pack(">IIB", int(dpi[0] / 0.0254 + 0.5), int(dpi[1] / 0.0254 + 0.5), 1))
+
+        compressor = zlib.compressobj(compress_level)
+        band = np.zeros((min(rows_per_chunk, height), width * 3 + 1), dtype=np.uint8)
+        for top in range(0, height, rows_per_chunk):
+            rows = slice(top, min(top + rows_per_chunk, height))
+            count = rows.stop - rows.start
+            # Each row is prefixed with filter type 0 (none)
+            band[:count, 1:] = rgb[rows].reshape(count, width * 3)
+            data = compressor.compress(band[:count].tobytes())
+            if data:
+                chunk(f, b"IDAT", data)
+            if release is not None:
+                release(rows)
+        chunk(f, b"IDAT", compressor.flush())
+        chunk(f, b"IEND", b"")
@@ -17,9 +17,19 @@ const fs = require('fs');
  * @param {boolean} options.generate3D - Whether to generate a 3D visualization
  * @param {boolean} options.exportData - Whether to export floor plan data as JSON
  * @param {string} options.dataPath - Path to save the floor plan data JSON
+ * @param {string} options.renditions - Optional rendition spec such as 'thumbnail:webp,preview:webp'
+ * @param {number} options.threads - Worker threads for one plan, for lower latency on large plans
+ * @param {number} options.maxMegapixels - Pixel budget; larger plans are degraded and the result lists
+ *   the applied degradations under degraded
+ * @param {string} options.degrade - Allowed degradations, such as 'downscale,skip_3d', or 'none' to reject
  * @returns {Promise<Object>} - Result object with paths and status
  */
 function processFloorPlan(options) {
+  // Route through the persistent worker when it is enabled
+  if (process.env.FLOOR_PLAN_WORKERS) {
+    return processFloorPlanWithWorker(options);
+  }
+
   return new Promise((resolve, reject) => {
     const {
       inputPath,
@@ -30,7 +40,11 @@ function processFloorPlan(options) {
       dataPath = null,
       showDimensions = true,
       showLabels = true,
-      dpi = 300
+      dpi = 300,
+      renditions = null,
+      threads = 1,
+      maxMegapixels = null,
+      degrade = null
     } = options;
 
     // Validate inputs
@@ -62,6 +76,22 @@ function processFloorPlan(options) {
       args.push('--export-data', dataPath);
     }
 
+    if (renditions) {
+      args.push('--renditions', renditions);
+    }
+
+    if (threads > 1) {
+      args.push('--threads', threads.toString());
+    }
+
+    if (maxMegapixels) {
+      args.push('--max-megapixels', maxMegapixels.toString());
+    }
+
+    if (degrade) {
+      args.push('--degrade', degrade);
+    }
+
     // Determine the Python executable based on the OS
     const isWindows = process.platform === 'win32';
     const pythonExecutable = isWindows ? 'python' : 'python3';
@@ -75,9 +105,7 @@ function processFloorPlan(options) {
     }
 
     // Check if the required Python packages are installed
-    const checkPackagesProcess = spawn(pythonExecutable, ['-c', 'import cv2, numpy, matplotlib, PIL']);
-
-    checkPackagesProcess.on('close', (code) => {
+    checkPythonPackages(pythonExecutable).then((code) => {
       if (code !== 0) {
         return reject(new Error('Required Python packages are not installed. Please run: npm run install-python-deps'));
       }
@@ -113,14 +141,28 @@ function processFloorPlan(options) {
           stderr: stderrData
         };
 
-        // Add 3D visualization path if generated
-        if (generate3D) {
-          const threeDPath = outputPath.replace('.png', '_3d.png');
+        // Report degradations of a plan over its pixel budget
+        const degraded = parseDegraded(stdoutData);
+        if (degraded) {
+          result.degraded = degraded;
+        }
+
+        // Add 3D visualization path if generated (and not skipped for the pixel budget)
+        if (generate3D && !(degraded && degraded.applied.includes('skip_3d'))) {
+          const threeDPath = outputPath.replace(/\.[^./\\]*$/, '') + '_3d.png';
           if (fs.existsSync(threeDPath)) {
             result.visualization3D = threeDPath;
           }
         }
 
+        // Add rendition paths as reported by the script
+        if (renditions) {
+          result.renditions = {};
+          for (const match of stdoutData.matchAll(/^Rendition (\S+) saved to (.+)$/gm)) {
+            result.renditions[match[1]] = match[2];
+          }
+        }
+
         // Add data path if exported
         if (exportData && dataPath && fs.existsSync(dataPath)) {
           result.floorPlanData = dataPath;
@@ -140,15 +182,416 @@ function processFloorPlan(options) {
       pythonProcess.on('error', (err) => {
         reject(new Error(`Failed to start Python process: ${err.message}`));
       });
+    }, (err) => {
+      reject(new Error(`Failed to check Python packages: ${err.message}`));
+    });
+  });
+}
+
+// Exit code of the package check, shared by every call in this process
+let pythonPackagesCheck = null;
+
+/**
+ * Check the required Python packages once per Node process.
+ * check_packages.py resolves packages from their metadata and keeps a stamp
+ * file, so it does not import OpenCV or matplotlib on the request path.
+ * Failed checks are not remembered, so installing the packages takes effect
+ * without a restart.
+ *
+ * @param {string} pythonExecutable - Python executable to check
+ * @returns {Promise<number>} - Exit code of the check (0 when all are installed)
+ */
+function checkPythonPackages(pythonExecutable) {
+  if (!pythonPackagesCheck) {
+    pythonPackagesCheck = new Promise((resolve, reject) => {
+      const checkScript = path.join(__dirname, 'check_packages.py');
+      const checkPackagesProcess = spawn(pythonExecutable, [checkScript], { stdio: 'ignore' });
+      checkPackagesProcess.on('close', resolve);
+      checkPackagesProcess.on('error', reject);
     });
+    pythonPackagesCheck.then((code) => {
+      if (code !== 0) {
+        pythonPackagesCheck = null;
+      }
+    }, () => {
+      pythonPackagesCheck = null;
+    });
+  }
+  return pythonPackagesCheck;
+}
 
-    checkPackagesProcess.on('error', (err) => {
-      reject(new Error(`Failed to check Python packages: ${err.message}`));
+// Shared persistent worker process, started on first use
+let floorPlanWorker = null;
+
+/**
+ * Start (or reuse) a long-lived floor_plan_generator.py process in serve mode.
+ * Jobs are written to its stdin as newline-delimited JSON and results are
+ * read back one line per job, so Python startup and imports are paid once.
+ * FLOOR_PLAN_WORKERS, FLOOR_PLAN_MAX_JOBS and FLOOR_PLAN_PIXEL_BUDGET (in
+ * megapixels) set its --workers, --max-jobs and --pixel-budget.
+ *
+ * @returns {Object} - Worker with a send(job) method returning a Promise
+ */
+function getFloorPlanWorker() {
+  if (floorPlanWorker) {
+    return floorPlanWorker;
+  }
+
+  const isWindows = process.platform === 'win32';
+  const pythonExecutable = isWindows ? 'python' : 'python3';
+  const scriptPath = path.join(__dirname, 'floor_plan_generator.py');
+  const args = [scriptPath, '--serve', '--workers', process.env.FLOOR_PLAN_WORKERS || '1'];
+
+  if (process.env.FLOOR_PLAN_MAX_JOBS) {
+    args.push('--max-jobs', process.env.FLOOR_PLAN_MAX_JOBS);
+  }
+
+  // Global pixel budget of queued and running plans, in megapixels
+  if (process.env.FLOOR_PLAN_PIXEL_BUDGET) {
+    args.push('--pixel-budget', process.env.FLOOR_PLAN_PIXEL_BUDGET);
+  }
+
+  console.log(`Starting floor plan worker: ${pythonExecutable} ${args.join(' ')}`);
+  const child = spawn(pythonExecutable, args);
+  const pending = new Map();
+  let nextId = 1;
+  let buffered = '';
+
+  const failAll = (err) => {
+    for (const { reject } of pending.values()) {
+      reject(err);
+    }
+    pending.clear();
+    floorPlanWorker = null;
+  };
+
+  child.stdout.on('data', (data) => {
+    buffered += data.toString();
+    let newline;
+    while ((newline = buffered.indexOf('\n')) >= 0) {
+      const line = buffered.slice(0, newline).trim();
+      buffered = buffered.slice(newline + 1);
+      if (!line) continue;
+
+      let result;
+      try {
+        result = JSON.parse(line);
+      } catch (err) {
+        console.error(`Invalid worker output: ${line}`);
+        continue;
+      }
+
+      const job = pending.get(result.id);
+      if (!job) continue;
+      pending.delete(result.id);
+
+      if (result.success) {
+        job.resolve(result);
+      } else {
+        job.reject(new Error(result.error || 'Floor plan processing failed'));
+      }
+    }
+  });
+
+  child.stderr.on('data', (data) => {
+    console.error(`Python stderr: ${data.toString().trim()}`);
+  });
+
+  child.on('close', (code) => {
+    failAll(new Error(`Floor plan worker exited with code ${code}`));
+  });
+
+  child.on('error', (err) => {
+    failAll(new Error(`Failed to start Python worker: ${err.message}`));
+  });
+
+  floorPlanWorker = {
+    send(job) {
+      return new Promise((resolve, reject) => {
+        const id = nextId++;
+        pending.set(id, { resolve, reject });
+        child.stdin.write(JSON.stringify({ ...job, id }) + '\n');
+      });
+    }
+  };
+
+  return floorPlanWorker;
+}
+
+/**
+ * Process a floor plan using the persistent worker.
+ * Accepts the same options as processFloorPlan.
+ *
+ * @param {Object} options - Processing options
+ * @returns {Promise<Object>} - Result object with paths and status
+ */
+async function processFloorPlanWithWorker(options) {
+  const {
+    inputPath,
+    outputPath,
+    colorScheme = 'modern',
+    generate3D = false,
+    exportData = false,
+    dataPath = null,
+    showDimensions = true,
+    showLabels = true,
+    dpi = 300,
+    renditions = null,
+    threads = 1,
+    maxMegapixels = null,
+    degrade = null
+  } = options;
+
+  if (!inputPath || !fs.existsSync(inputPath)) {
+    throw new Error('Input file does not exist');
+  }
+
+  if (!outputPath) {
+    throw new Error('Output path is required');
+  }
+
+  const result = await getFloorPlanWorker().send({
+    input: inputPath,
+    output: outputPath,
+    color_scheme: colorScheme,
+    dpi,
+    show_dimensions: showDimensions,
+    show_labels: showLabels,
+    three_d: generate3D,
+    export_data: exportData && dataPath ? dataPath : null,
+    renditions,
+    threads,
+    max_megapixels: maxMegapixels,
+    ...(degrade ? { degrade } : {})
+  });
+
+  if (!result.visualization3D) {
+    delete result.visualization3D;
+  }
+
+  return result;
+}
+
+/**
+ * Split the framed stdout of floor_plan_generator.py into named outputs.
+ * Each frame is a one-byte name length, the name, a four-byte big-endian
+ * payload length and the payload.
+ *
+ * @param {Buffer} buffer - Complete stdout of the Python process
+ * @returns {Object} - Payload Buffers keyed by frame name
+ */
+function parseFrames(buffer) {
+  const frames = {};
+  let offset = 0;
+  while (offset < buffer.length) {
+    const nameLength = buffer.readUInt8(offset);
+    const name = buffer.toString('utf8', offset + 1, offset + 1 + nameLength);
+    offset += 1 + nameLength;
+    const payloadLength = buffer.readUInt32BE(offset);
+    offset += 4;
+    frames[name] = buffer.subarray(offset, offset + payloadLength);
+    offset += payloadLength;
+  }
+  return frames;
+}
+
+/**
+ * Parse the degradations the script reports for a plan over its pixel budget.
+ *
+ * @param {string} output - Script output
+ * @returns {Object|null} - applied degradations, plan pixels and budget, or null if none were needed
+ */
+function parseDegraded(output) {
+  const match = output.match(/^Image of (\d+)x(\d+) pixels exceeds the pixel budget of (\d+) pixels, applied: (.+)$/m);
+  if (!match) {
+    return null;
+  }
+  return {
+    applied: match[4] === 'nothing' ? [] : match[4].split(', '),
+    pixels: parseInt(match[1], 10) * parseInt(match[2], 10),
+    max_pixels: parseInt(match[3], 10)
+  };
+}
+
+/**
+ * Process a floor plan held in memory, such as an upload's request buffer.
+ * Nothing is written to disk: the image is piped to Python (or sent to the
+ * persistent worker) and the outputs come back as Buffers.
+ *
+ * @param {Buffer} imageBuffer - Encoded floor plan image
+ * @param {Object} options - colorScheme, generate3D, exportData, showDimensions, showLabels, dpi,
+ *   threads, maxMegapixels and degrade, as for processFloorPlan, plus format ('png' or 'svg')
+ * @returns {Promise<Object>} - Result with enhancedFloorPlan (PNG or SVG Buffer), visualization3D (PNG
+ *   Buffer, if requested), data (floor plan data, if requested) and degraded (if over the pixel budget)
+ */
+function processFloorPlanBuffer(imageBuffer, options = {}) {
+  const {
+    colorScheme = 'modern',
+    generate3D = false,
+    exportData = false,
+    showDimensions = true,
+    showLabels = true,
+    dpi = 300,
+    format = 'png',
+    threads = 1,
+    maxMegapixels = null,
+    degrade = null
+  } = options;
+
+  if (!Buffer.isBuffer(imageBuffer) || imageBuffer.length === 0) {
+    return Promise.reject(new Error('Input image buffer is empty'));
+  }
+
+  if (process.env.FLOOR_PLAN_WORKERS) {
+    return getFloorPlanWorker().send({
+      input_data: imageBuffer.toString('base64'),
+      format,
+      color_scheme: colorScheme,
+      dpi,
+      show_dimensions: showDimensions,
+      show_labels: showLabels,
+      three_d: generate3D,
+      export_data: exportData,
+      threads,
+      max_megapixels: maxMegapixels,
+      ...(degrade ? { degrade } : {})
+    }).then((result) => {
+      const output = { success: true, enhancedFloorPlan: Buffer.from(result.enhancedFloorPlanData, 'base64') };
+      if (result.visualization3DData) {
+        output.visualization3D = Buffer.from(result.visualization3DData, 'base64');
+      }
+      if (result.data) {
+        output.data = result.data;
+      }
+      if (result.degraded) {
+        output.degraded = result.degraded;
+      }
+      return output;
+    });
+  }
+
+  const isWindows = process.platform === 'win32';
+  const pythonExecutable = isWindows ? 'python' : 'python3';
+  const scriptPath = path.join(__dirname, 'floor_plan_generator.py');
+  const args = [scriptPath, '-', '-o', '-', '--format', format, '-c', colorScheme, '-d', dpi.toString()];
+
+  if (!showDimensions) {
+    args.push('--no-dimensions');
+  }
+
+  if (!showLabels) {
+    args.push('--no-labels');
+  }
+
+  if (threads > 1) {
+    args.push('--threads', threads.toString());
+  }
+
+  if (maxMegapixels) {
+    args.push('--max-megapixels', maxMegapixels.toString());
+  }
+
+  if (degrade) {
+    args.push('--degrade', degrade);
+  }
+
+  if (generate3D) {
+    args.push('--3d');
+  }
+
+  if (exportData) {
+    args.push('--export-data', '-');
+  }
+
+  // More than one output on stdout is framed
+  const framed = generate3D || exportData;
+
+  return checkPythonPackages(pythonExecutable).then((code) => {
+    if (code !== 0) {
+      throw new Error('Required Python packages are not installed. Please run: npm run install-python-deps');
+    }
+
+    return new Promise((resolve, reject) => {
+      const pythonProcess = spawn(pythonExecutable, args);
+      const chunks = [];
+      let stderrData = '';
+
+      pythonProcess.stdout.on('data', (data) => chunks.push(data));
+      pythonProcess.stderr.on('data', (data) => {
+        stderrData += data.toString();
+      });
+
+      pythonProcess.on('close', (exitCode) => {
+        if (exitCode !== 0) {
+          return reject(new Error(`Python script exited with code ${exitCode}: ${stderrData}`));
+        }
+
+        const stdout = Buffer.concat(chunks);
+        const frames = framed ? parseFrames(stdout) : { enhanced: stdout };
+        const result = { success: true, enhancedFloorPlan: frames.enhanced, stderr: stderrData };
+        if (frames.visualization3D) {
+          result.visualization3D = frames.visualization3D;
+        }
+        if (frames.data) {
+          try {
+            result.data = JSON.parse(frames.data.toString('utf8'));
+          } catch (err) {
+            console.error('Error parsing floor plan data:', err);
+          }
+        }
+        const degraded = parseDegraded(stderrData);
+        if (degraded) {
+          result.degraded = degraded;
+        }
+        resolve(result);
+      });
+
+      pythonProcess.on('error', (err) => {
+        reject(new Error(`Failed to start Python process: ${err.message}`));
+      });
+
+      pythonProcess.stdin.end(imageBuffer);
     });
   });
 }
 
-module.exports = { processFloorPlan };
+/**
+ * Render a floor plan for an editor session, redrawing only what each room edit changes.
+ * The first call of a session (or one without roomData) renders the whole plan; later calls with
+ * the edited rooms return just the updated regions. Sessions are kept by the persistent worker
+ * process that rendered them, so editors should run it with FLOOR_PLAN_WORKERS=1.
+ *
+ * @param {string} inputPath - Path to the input floor plan image
+ * @param {string} session - Editor session id
+ * @param {Array|null} roomData - Edited rooms (type, bbox and optionally contour), or null to start over
+ * @param {Object} options - colorScheme, showDimensions, showLabels and dpi, as for processFloorPlan
+ * @returns {Promise<Object>} - Result with size ([width, height]) and patches, a list of
+ *   { box: [left, top, right, bottom], image: PNG Buffer } to draw over the previous render
+ */
+function renderFloorPlanEdit(inputPath, session, roomData, options = {}) {
+  const {
+    colorScheme = 'modern',
+    showDimensions = true,
+    showLabels = true,
+    dpi = 300
+  } = options;
+
+  return getFloorPlanWorker().send({
+    input: inputPath,
+    session,
+    color_scheme: colorScheme,
+    dpi,
+    show_dimensions: showDimensions,
+    show_labels: showLabels,
+    ...(roomData ? { room_data: roomData } : {})
+  }).then((result) => ({
+    success: true,
+    size: result.size,
+    patches: result.dirty.map((box, i) => ({ box, image: Buffer.from(result.patches[i], 'base64') }))
+  }));
+}
+
+module.exports = { processFloorPlan, processFloorPlanWithWorker, processFloorPlanBuffer, renderFloorPlanEdit };
 
 // Example usage:
 /*
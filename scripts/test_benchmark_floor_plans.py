@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Benchmark tests - Synthetic plans and baseline comparison
+Run with: python -m pytest -q scripts
+"""
+
+import numpy as np
+import pytest
+
+import floor_plan_generator as fpg
+from benchmark_floor_plans import STAGES, benchmark_plan, compare_to_baseline, generate_synthetic_plan
+
+
+@pytest.mark.parametrize("rooms, wall_thickness", [(2, 8), (12, 4), (50, 2)])
+def test_synthetic_plans_are_deterministic_and_detected(rooms, wall_thickness):
+    plan = generate_synthetic_plan(1000, 700, rooms, wall_thickness)
+    assert plan.size == (1000, 700)
+    assert np.array_equal(np.asarray(plan), np.asarray(generate_synthetic_plan(1000, 700, rooms, wall_thickness)))
+    assert not np.array_equal(np.asarray(plan), np.asarray(generate_synthetic_plan(1000, 700, rooms, wall_thickness,
+                                                                                      seed=1)))
+    assert len(fpg.FloorPlanAnalysis(np.asarray(plan)).rooms) == rooms
+
+
+def test_every_stage_is_timed(tmp_path):
+    path = tmp_path / "plan.png"
+    generate_synthetic_plan(400, 300, 4).save(path)
+    stages, detected, check = benchmark_plan(str(path), fpg.FloorPlanGenerator())
+    assert set(STAGES) <= set(stages)
+    assert all(stages[stage]["seconds"] >= 0 for stage in STAGES)
+    assert detected == 4 and check["within_tolerance"] and check["factor"] == 1
+
+
+def test_only_stages_slower_than_the_threshold_are_regressions():
+    def results(**seconds):
+        return {"cases": [{"name": "plan", "stages": {stage: {"seconds": value} for stage, value in seconds.items()}}]}
+
+    baseline = results(detect=0.010, fill=0.010, encode=0.0005)
+    # detect is 30% slower, fill 10% and encode is below min_seconds in the baseline
+    measured = results(detect=0.013, fill=0.011, encode=0.005, labels=0.5)
+
+    regressions = compare_to_baseline(measured, baseline, threshold=20)
+    assert len(regressions) == 1 and regressions[0].startswith("plan detect:")
+    assert len(compare_to_baseline(measured, baseline, threshold=5)) == 2
+    assert len(compare_to_baseline(measured, baseline, threshold=20, min_seconds=0.0001)) == 2
+    assert compare_to_baseline(measured, {"cases": []}) == []
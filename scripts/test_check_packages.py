@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Package check tests - Resolving packages without importing them, and the stamp file
+Run with: python -m pytest -q scripts
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+
+import check_packages
+from benchmark_floor_plans import benchmark_import
+
+
+def test_packages_are_resolved_without_importing_them():
+    code = (
+        "import sys, check_packages\n"
+        "versions = [check_packages.find_package(package) for package in check_packages.PACKAGES]\n"
+        "print(None not in versions, [m for m in ('numpy', 'PIL', 'cv2', 'matplotlib') if m in sys.modules])\n"
+    )
+    completed = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, check=True)
+    assert completed.stdout.split() == ["True", "[]"]
+    assert check_packages.find_package("floor-plan-missing-package") is None
+
+
+def test_stamp_skips_the_second_check(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("PYTHON_ENV_STAMP", str(tmp_path / "stamp.json"))
+    calls = []
+    find_package = check_packages.find_package
+    monkeypatch.setattr(check_packages, "find_package", lambda package: calls.append(package) or find_package(package))
+
+    for _ in range(2):
+        with pytest.raises(SystemExit) as exit_info:
+            check_packages.main()
+        assert exit_info.value.code == 0
+    assert calls == list(check_packages.PACKAGES)
+    assert "All required packages are installed" in capsys.readouterr().out
+
+    # Another interpreter or package set does not reuse the stamp
+    assert check_packages.load_stamp("other") is None
+
+
+def test_cold_import_loads_no_heavy_modules():
+    case = benchmark_import(repeat=1)
+    assert case["heavy_modules_loaded"] == []
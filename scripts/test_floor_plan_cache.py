@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Cache tests - Round trips, eviction and cache hits of the pipeline
+Run with: python -m pytest -q scripts
+"""
+
+import os
+import time
+import numpy as np
+from PIL import Image
+
+import floor_plan_generator as fpg
+from floor_plan_cache import FloorPlanCache
+from benchmark_floor_plans import generate_synthetic_plan
+
+
+def test_analysis_round_trip(tmp_path):
+    cache = FloorPlanCache(str(tmp_path))
+    analysis = fpg.FloorPlanAnalysis(np.array(generate_synthetic_plan(400, 300, 4)), "components")
+    # A room given by its box only keeps neither contour nor label
+    rooms = analysis.rooms + [{"type": "kitchen", "bbox": (10, 10, 50, 40)}]
+    cache.put_analysis("a" * 64, analysis.size, analysis.wall_mask, rooms, analysis.label_map)
+
+    cached = cache.get_analysis("a" * 64)
+    assert cached["size"] == analysis.size
+    assert np.array_equal(cached["wall_mask"], analysis.wall_mask)
+    assert np.array_equal(cached["label_map"], analysis.label_map)
+    assert [(room["type"], room["bbox"], room.get("label")) for room in cached["rooms"]] == \
+           [(room["type"], tuple(room["bbox"]), room.get("label")) for room in rooms]
+    assert cache.get_analysis("b" * 64) is None
+    assert (cache.stats["analysis_hits"], cache.stats["analysis_misses"]) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FloorPlanCache(str(tmp_path), max_bytes=2500)
+    for age, key in ((200, "a"), (100, "b")):
+        cache.put_render(key * 64, os.urandom(1000))
+        stamp = time.time() - age
+        os.utime(cache._path(key * 64, cache.RENDER_SUFFIX), (stamp, stamp))
+
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get_render("a" * 64) is not None
+    cache.put_render("c" * 64, os.urandom(1000))
+
+    assert cache.get_render("b" * 64) is None
+    assert cache.get_render("a" * 64) is not None and cache.get_render("c" * 64) is not None
+    assert cache.stats["evictions"] == 1
+
+
+def test_second_run_reuses_detection_and_render(tmp_path):
+    path = tmp_path / "plan.png"
+    generate_synthetic_plan(400, 300, 4).save(path)
+    cache = FloorPlanCache(str(tmp_path / "cache"))
+    generator = fpg.FloorPlanGenerator()
+
+    fpg.process_floor_plan(generator, str(path), str(tmp_path / "first.png"), cache=cache)
+    result = fpg.process_floor_plan(generator, str(path), str(tmp_path / "second.png"),
+                                    export_data=str(tmp_path / "data.json"), cache=cache)
+
+    assert cache.stats["render_hits"] == 1 and cache.stats["analysis_hits"] == 1
+    assert len(result["data"]["rooms"]) == 4
+    assert np.array_equal(np.asarray(Image.open(tmp_path / "first.png")),
+                          np.asarray(Image.open(tmp_path / "second.png")))
@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Generator tests - Regression checks on deterministic synthetic plans
+Run with: python -m pytest -q scripts
+"""
+
+import io
+import os
+import base64
+import sys
+import json
+import subprocess
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import floor_plan_generator as fpg
+from benchmark_floor_plans import generate_synthetic_plan
+
+
+@pytest.fixture
+def plan_path(tmp_path):
+    """Path to an 800x600 synthetic plan with 12 rooms"""
+    path = tmp_path / "plan.png"
+    generate_synthetic_plan(800, 600, 12).save(path)
+    return str(path)
+
+
+def _recoloured(rooms, index):
+    """Copy of rooms (as JSON, like an editor sends them) with one room's type changed"""
+    rooms = json.loads(json.dumps(rooms, default=lambda value: np.asarray(value).tolist()))
+    rooms[index]["type"] = "kitchen" if rooms[index]["type"] != "kitchen" else "bedroom"
+    return rooms
+
+
+def _script():
+    """Path of floor_plan_generator.py, to run it as a command"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "floor_plan_generator.py")
+
+
+def test_session_edit_matches_in_warm_and_cold_workers(plan_path, tmp_path):
+    rooms = fpg.FloorPlanAnalysis(plan_path, "components").rooms
+    first, second = _recoloured(rooms, 2), _recoloured(_recoloured(rooms, 2), 7)
+    job = {"input": plan_path, "session": "editor", "detection": "components"}
+
+    fpg._RENDER_SESSIONS.clear()
+    assert fpg.run_job(dict(job, id=1))["success"]
+    assert fpg.run_job(dict(job, id=2, room_data=first))["success"]
+    warm = fpg.run_job(dict(job, id=3, room_data=second, output=str(tmp_path / "warm.png")))
+
+    # A worker that never saw the session
+    fpg._RENDER_SESSIONS.clear()
+    cold = fpg.run_job(dict(job, id=4, room_data=second, output=str(tmp_path / "cold.png")))
+
+    assert warm["success"] and cold["success"]
+    assert np.array_equal(np.asarray(Image.open(tmp_path / "warm.png")), np.asarray(Image.open(tmp_path / "cold.png")))
+
+
+@pytest.mark.parametrize("detection", fpg.DETECTION_ENGINES)
+def test_single_room_edit_stays_within_the_room(plan_path, detection):
+    generator = fpg.FloorPlanGenerator()
+    analysis = fpg.FloorPlanAnalysis(plan_path, detection)
+    state = generator.render_state(analysis)
+    width, height = state.size
+
+    for index, room in enumerate(analysis.rooms):
+        rooms = _recoloured(state.rooms, index)
+        dirty = generator.update_render(state, rooms)
+
+        # The room's outlined bounding box, plus the pixel sharpening reaches past it
+        x1, y1, x2, y2 = room["bbox"]
+        bound = (max(x1 - 1, 0), max(y1 - 1, 0), min(x2 + 2, width), min(y2 + 2, height))
+        assert dirty and all(fpg.intersect_boxes(box, bound) == box for box in dirty)
+
+        expected = generator.render_state(analysis)
+        generator.update_render(expected, rooms)
+        # Same pixels as applying the edit to a fresh render
+        assert np.array_equal(state.output, expected.output)
+
+
+def test_tiled_rejects_components_detection_loaded_from_cache(plan_path, tmp_path):
+    cache = fpg.FloorPlanCache(str(tmp_path / "cache"))
+    analysis = fpg.FloorPlanAnalysis(plan_path, "components")
+    analysis.store_cached(cache)
+
+    cached = fpg.FloorPlanAnalysis(plan_path, "components")
+    assert cached.load_cached(cache)
+    with pytest.raises(ValueError, match="only supports contour detection"):
+        fpg.FloorPlanGenerator().enhance_floor_plan_tiled(cached, str(tmp_path / "tiled.png"))
+
+
+def _mesh_extent(path):
+    """Largest x, y and z (plan width, wall height and plan depth) of the vertices of an OBJ mesh, in metres"""
+    with open(path) as f:
+        vertices = np.array([line.split()[1:4] for line in f if line.startswith("v ")], dtype=np.float64)
+    return vertices.max(axis=0)
+
+
+def test_mesh_extent_follows_the_plan_scale(plan_path, tmp_path):
+    generator = fpg.FloorPlanGenerator()
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    generator.export_mesh(analysis, str(tmp_path / "full.obj"))
+    full = _mesh_extent(tmp_path / "full.obj")
+    assert full[1] == pytest.approx(2.5)
+
+    # Downscaling to fit a pixel budget keeps measurements in metres
+    degraded, small, _, report = fpg.admit_floor_plan(generator, fpg.FloorPlanAnalysis(plan_path), 120_000,
+                                                      ("downscale",))
+    assert report["applied"] == ["downscale"]
+    degraded.export_mesh(small, str(tmp_path / "small.obj"))
+    assert np.allclose(_mesh_extent(tmp_path / "small.obj"), full, rtol=0.02)
+
+    # Twice the pixels per metre halves the plan in metres
+    fpg.FloorPlanGenerator(pixels_per_meter=2 * fpg.PIXELS_PER_METER).export_mesh(analysis, str(tmp_path / "dense.obj"))
+    assert np.allclose(_mesh_extent(tmp_path / "dense.obj"), full * [0.5, 1, 0.5])
+
+
+def test_batch_outputs_keep_subdirectories_and_format(tmp_path):
+    for folder in ("a", "b"):
+        (tmp_path / "in" / folder).mkdir(parents=True)
+        generate_synthetic_plan(200, 150, 2).save(tmp_path / "in" / folder / "x.png")
+    output_dir = tmp_path / "out"
+
+    jobs = list(fpg.iter_batch_jobs(str(tmp_path / "in" / "**" / "*.png"), str(output_dir), format="svg"))
+    assert sorted(job["output"] for job in jobs) == [str(output_dir / "a" / "x.svg"), str(output_dir / "b" / "x.svg")]
+
+    # Images whose outputs would overwrite each other are rejected before any job runs
+    generate_synthetic_plan(200, 150, 2).save(tmp_path / "in" / "a" / "x.jpg")
+    with pytest.raises(ValueError, match="would write the same outputs"):
+        fpg.iter_batch_jobs(str(tmp_path / "in" / "a"), str(output_dir))
+
+
+@pytest.mark.parametrize("flag", [["--mesh", "plan.obj"], ["--renditions"], ["--tiled"]])
+def test_streaming_rejects_file_only_options(plan_path, flag):
+    with open(plan_path, "rb") as f:
+        completed = subprocess.run([sys.executable, _script(), "-", "-o", "-"] + flag, stdin=f, capture_output=True)
+    assert completed.returncode == 2
+    assert b"cannot be combined with reading from stdin" in completed.stderr
+
+
+@pytest.mark.parametrize("detection", fpg.DETECTION_ENGINES)
+def test_mesh_keeps_the_shape_of_an_l_shaped_room(detection):
+    plan = np.full((400, 500, 3), 255, dtype=np.uint8)
+    corners = np.array([(50, 50), (450, 50), (450, 200), (250, 200), (250, 350), (50, 350)], dtype=np.int32)
+    cv2.polylines(plan, [corners], True, (0, 0, 0), 4)
+    analysis = fpg.FloorPlanAnalysis(plan, detection)
+
+    faces = fpg.build_room_mesh(analysis.rooms, fpg.COLOR_SCHEMES["modern"], 2.5, label_map=analysis.label_map)
+    assert [len(vertices) for vertices, _, kind in faces if kind == "floor"] == [6]
+
+
+def test_scheme_renders_use_the_configured_encoding(plan_path, tmp_path):
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    schemes = fpg.resolve_color_schemes(["modern"])
+    sizes = []
+    for quality in (95, 20):
+        generator = fpg.FloorPlanGenerator(quality=quality)
+        _, path = generator.render_schemes(analysis, schemes, str(tmp_path / f"q{quality}.jpg"))["modern"]
+        sizes.append(os.path.getsize(path))
+    assert sizes[1] < sizes[0]
+
+
+
+@pytest.mark.parametrize("detection", fpg.DETECTION_ENGINES)
+def test_near_duplicate_with_an_erased_wall_is_not_reused(tmp_path, detection):
+    plan = np.array(generate_synthetic_plan(800, 600, 12))
+    cache = fpg.FloorPlanCache(str(tmp_path / "cache"))
+    original = fpg.FloorPlanAnalysis(plan, detection)
+    original.store_cached(cache)
+
+    # A recompressed copy of the same plan reuses its rooms
+    resaved = tmp_path / "resaved.jpg"
+    Image.fromarray(plan).save(resaved, quality=90)
+    assert fpg.FloorPlanAnalysis(str(resaved), detection).load_similar(cache)
+
+    # Erasing a stretch of one room's top wall opens that room
+    x1, y1, x2, _ = original.rooms[0]["bbox"]
+    edited = plan.copy()
+    edited[max(y1 - 8, 0):y1 + 12, x1 + 10:x2 - 10] = 255
+    near_duplicate = fpg.FloorPlanAnalysis(edited, detection)
+    # Index the original's rooms under the edited plan's fingerprint, as a hash collision would
+    cache.put_analysis(original.cache_key, original.size, original.wall_mask, original.rooms, original.label_map,
+                       near_duplicate.signature, original.detection_key)
+
+    assert not near_duplicate.load_similar(cache)
+    assert cache.stats["similar_rejected"] == 1
+    assert len(near_duplicate.rooms) == len(original.rooms) - 1
+
+
+def test_batch_streams_data_to_one_jsonl_file(tmp_path):
+    (tmp_path / "in" / "a").mkdir(parents=True)
+    for path in ("x.png", "a/y.png"):
+        generate_synthetic_plan(200, 150, 2).save(tmp_path / "in" / path)
+
+    completed = subprocess.run([sys.executable, _script(), "--batch", str(tmp_path / "in" / "**" / "*.png"),
+                                "-o", str(tmp_path / "out"), "--export-data", str(tmp_path / "data.jsonl"),
+                                "--workers", "1"], capture_output=True)
+    assert completed.returncode == 0, completed.stderr
+    with open(tmp_path / "data.jsonl") as f:
+        assert len([json.loads(line) for line in f]) == 2
+    assert (tmp_path / "out" / "a" / "y.png").exists()
+
+
+def test_blueprint_keeps_the_default_enhancement(plan_path):
+    assert fpg.FloorPlanGenerator("blueprint").post_processing() == (1.2, 1.5)
+    assert fpg.FloorPlanGenerator("blueprint", contrast=1.0, sharpness=1.0).post_processing() == (1.0, 1.0)
+
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    schemes = fpg.resolve_color_schemes(["blueprint"])
+    rendered, _ = fpg.FloorPlanGenerator().render_schemes(analysis, schemes)["blueprint"]
+    single = fpg.FloorPlanGenerator("blueprint").enhance_floor_plan(analysis)
+    assert np.array_equal(np.asarray(rendered), np.asarray(single))
+
+
+def test_missing_lazy_module_raises_with_its_install_hint(capsys):
+    missing = fpg._LazyModule("floor_plan_missing_module", "Install it with: pip install missing")
+    with pytest.raises(ImportError, match="pip install missing"):
+        missing.anything
+    assert capsys.readouterr().out == ""
+
+
+def test_benchmark_peak_memory_includes_opencv_buffers():
+    from benchmark_floor_plans import _measure
+    image = (np.random.default_rng(0).random((4096, 4096)) * 255).astype(np.uint8)
+    _, _, before = _measure(lambda: None)
+    if before is None:
+        pytest.skip("peak RSS is not available on this platform")
+    # Canny's gradient buffers are allocated by OpenCV, several times the size of its result
+    _, _, peak = _measure(lambda: cv2.Canny(image, 50, 150))
+    assert peak - before > 2 * image.nbytes
+
+
+def test_auto_detection_scale_leaves_mid_sized_contour_plans_at_full_resolution(tmp_path):
+    plan = tmp_path / "large.png"
+    Image.new("RGB", (3200, 2400), "white").save(plan)
+    assert fpg.FloorPlanAnalysis(str(plan), "contours", "auto").detection_factor == 1
+    assert fpg.FloorPlanAnalysis(str(plan), "components", "auto").detection_factor == 2
+    assert fpg.FloorPlanAnalysis(str(plan), "contours").detection_factor == 1
+
+
+def test_benchmark_reports_scaled_detection_slower_than_full_resolution():
+    from benchmark_floor_plans import SCALED_DETECT_STAGE, compare_to_baseline
+    check = {"rooms": 2, "scaled_rooms": 2, "max_bbox_error": 1, "type_changes": 0, "within_tolerance": True,
+             "factor": 2}
+    case = {"name": "plan", "detection_check": check,
+            "stages": {"detect": {"seconds": 0.004}, SCALED_DETECT_STAGE: {"seconds": 0.005}}}
+    regressions = compare_to_baseline({"cases": [case]}, {"cases": []})
+    assert len(regressions) == 1 and "slower" in regressions[0]
+
+
+def test_mesh_outlines_follow_the_simplify_tolerance(tmp_path):
+    plan = np.full((400, 400, 3), 255, dtype=np.uint8)
+    cv2.circle(plan, (200, 200), 150, (0, 0, 0), 4)
+    analysis = fpg.FloorPlanAnalysis(plan)
+
+    vertices = []
+    for simplify in (0.001, 0.05):
+        path = tmp_path / f"{simplify}.obj"
+        fpg.FloorPlanGenerator(simplify=simplify).export_mesh(analysis, str(path))
+        with open(path) as f:
+            vertices.append(sum(line.startswith("v ") for line in f))
+    assert vertices[0] > vertices[1]
+
+
+def _reference_composite(wall_mask, rooms, color_scheme):
+    """Walls and room fills painted one full-frame mask at a time, as before vectorized compositing"""
+    height, width = wall_mask.shape
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    canvas = np.array(image)
+    canvas[wall_mask] = color_scheme["walls"]
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    for room in rooms:
+        color = color_scheme.get(room["type"], (220, 220, 220))
+        if "contour" in room:
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.drawContours(mask, [room["contour"]], 0, 255, -1)
+            canvas = np.array(image)
+            canvas[(mask > 0) & ~wall_mask] = color
+            image = Image.fromarray(canvas)
+            draw = ImageDraw.Draw(image)
+        else:
+            draw.rectangle(room["bbox"], fill=color, outline=color_scheme["walls"])
+    return np.array(image)
+
+
+def test_composite_matches_painting_rooms_one_by_one(plan_path):
+    generator = fpg.FloorPlanGenerator()
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    wall_mask = analysis.wall_mask > 0
+    # A room given by its box only, overlapping detected rooms and the right edge
+    rooms = analysis.rooms + [{"type": "kitchen", "bbox": (700, 100, 799, 300)}]
+
+    canvas = generator._composite(wall_mask, rooms)
+    assert np.array_equal(canvas, _reference_composite(wall_mask, rooms, generator.color_scheme))
+
+
+def test_serve_answers_every_job_line(plan_path, tmp_path):
+    jobs = [{"id": i, "input": plan_path, "output": str(tmp_path / f"out{i}.png")} for i in (1, 2)]
+    lines = "".join(json.dumps(job) + "\n" for job in jobs) + "not json\n" + json.dumps({"id": 3}) + "\n"
+
+    completed = subprocess.run([sys.executable, _script(), "--serve", "--workers", "1"], input=lines.encode(),
+                               capture_output=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    results = [json.loads(line) for line in completed.stdout.decode().splitlines()]
+
+    assert len(results) == 4
+    succeeded = {result["id"]: result for result in results if result["success"]}
+    assert sorted(succeeded) == [1, 2]
+    for job in jobs:
+        assert succeeded[job["id"]]["enhancedFloorPlan"] == job["output"]
+        assert Image.open(job["output"]).size == (800, 600)
+    assert all(result["error"].startswith("Invalid job") for result in results if not result["success"])
+
+
+def test_outputs_share_one_decode_and_detection(plan_path, tmp_path, monkeypatch):
+    calls = {"decode": 0, "detect": 0}
+    decode = fpg.FloorPlanAnalysis.image.func
+    detect = fpg.detect_rooms_multiscale
+
+    def counted_decode(analysis):
+        calls["decode"] += 1
+        return decode(analysis)
+
+    def counted_detect(*args, **kwargs):
+        calls["detect"] += 1
+        return detect(*args, **kwargs)
+
+    image = fpg.cached_property(counted_decode)
+    image.__set_name__(fpg.FloorPlanAnalysis, "image")
+    monkeypatch.setattr(fpg.FloorPlanAnalysis, "image", image)
+    monkeypatch.setattr(fpg, "detect_rooms_multiscale", counted_detect)
+
+    result = fpg.process_floor_plan(fpg.FloorPlanGenerator(), plan_path, str(tmp_path / "out.png"), three_d=True,
+                                    export_data=str(tmp_path / "data.json"), mesh=str(tmp_path / "plan.obj"))
+    assert result["visualization3D"] and result["data"] and result["mesh"]
+    assert calls == {"decode": 1, "detect": 1}
+
+
+def test_batch_reports_failures_without_stopping(tmp_path, capsys):
+    for name in ("a", "b"):
+        generate_synthetic_plan(200, 150, 2).save(tmp_path / f"{name}.png")
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text("".join(json.dumps(job) + "\n" for job in [
+        {"id": "a", "input": str(tmp_path / "a.png"), "output": str(tmp_path / "a_out.png")},
+        {"id": "missing", "input": str(tmp_path / "missing.png"), "output": str(tmp_path / "missing_out.png")},
+        {"id": "b", "input": str(tmp_path / "b.png"), "output": str(tmp_path / "b_out.png")}
+    ]))
+
+    assert fpg.run_batch(fpg.iter_batch_jobs(str(manifest)), workers=2, max_in_flight=1) == (2, 1)
+    results = {result["id"]: result for result in map(json.loads, capsys.readouterr().out.splitlines())}
+    assert not results["missing"]["success"] and "does not exist" in results["missing"]["error"]
+    assert (tmp_path / "a_out.png").exists() and (tmp_path / "b_out.png").exists()
+
+
+def test_components_engine_finds_the_contour_rooms(plan_path):
+    contours = fpg.FloorPlanAnalysis(plan_path, "contours")
+    components = fpg.FloorPlanAnalysis(plan_path, "components")
+
+    # Same regions, boxes within a pixel of the contour engine's
+    assert len(components.rooms) == len(contours.rooms) == 12
+    for room, reference in zip(sorted(components.rooms, key=lambda room: room["bbox"]),
+                               sorted(contours.rooms, key=lambda room: room["bbox"])):
+        assert np.abs(np.subtract(room["bbox"], reference["bbox"])).max() <= 1
+
+    # Each room's label covers exactly its bounding box in the label map
+    label_map = components.label_map
+    assert label_map.dtype == np.int32 and label_map.shape == (600, 800)
+    for room in components.rooms:
+        ys, xs = np.nonzero(label_map == room["label"])
+        assert (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1) == room["bbox"]
+
+
+@pytest.mark.parametrize("detection", fpg.DETECTION_ENGINES)
+def test_scheme_renders_match_one_render_per_scheme(plan_path, detection):
+    palette = {"sunset": {"walls": [90, 20, 20], "bedroom": [250, 200, 150]}}
+    schemes = fpg.resolve_color_schemes("all", json.dumps(palette))
+    assert list(schemes) == list(fpg.COLOR_SCHEMES) + ["sunset"]
+
+    analysis = fpg.FloorPlanAnalysis(plan_path, detection)
+    results = fpg.FloorPlanGenerator().render_schemes(analysis, schemes)
+    for name, (image, saved) in results.items():
+        # A custom palette renders like a generator configured with its colors
+        generator = fpg.FloorPlanGenerator(palette[name] if name in palette else name)
+        expected = generator.enhance_floor_plan(analysis)
+        assert saved is None and np.array_equal(np.asarray(image), np.asarray(expected))
+
+
+def test_unknown_scheme_name_is_rejected():
+    with pytest.raises(ValueError, match="pastel"):
+        fpg.resolve_color_schemes(["modern", "pastel"])
+
+
+def test_gltf_triangles_cover_the_room_floors(plan_path, tmp_path):
+    generator = fpg.FloorPlanGenerator()
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    generator.export_mesh(analysis, str(tmp_path / "plan.gltf"))
+    with open(tmp_path / "plan.gltf") as f:
+        gltf = json.load(f)
+
+    data = base64.b64decode(gltf["buffers"][0]["uri"].split(",", 1)[1])
+    views = [data[view["byteOffset"]:view["byteOffset"] + view["byteLength"]] for view in gltf["bufferViews"]]
+    positions = np.frombuffer(views[0], dtype=np.float32).reshape(-1, 3)
+    indices = np.frombuffer(views[2], dtype=np.uint32)
+    assert gltf["accessors"][0]["count"] == len(positions) and gltf["accessors"][2]["count"] == len(indices)
+
+    # Triangles lying on the floor (y = 0) add up to the area of the room outlines
+    triangles = positions[indices.reshape(-1, 3)]
+    flat = triangles[(triangles[:, :, 1] == 0).all(axis=1)][:, :, [0, 2]]
+    u, v = flat[:, 1] - flat[:, 0], flat[:, 2] - flat[:, 0]
+    floor_area = np.abs(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]).sum() / 2
+    outlines = [fpg.room_outline(room, analysis.label_map) for room in analysis.rooms]
+    expected = sum(cv2.contourArea(outline.astype(np.float32)) for outline in outlines) / fpg.PIXELS_PER_METER ** 2
+    assert floor_area == pytest.approx(expected, rel=1e-4)
+
+
+def test_native_3d_render_does_not_import_matplotlib(plan_path, tmp_path):
+    code = (
+        "import sys, floor_plan_generator as fpg\n"
+        f"assert fpg.FloorPlanGenerator().generate_3d_visualization({plan_path!r}, {str(tmp_path / '3d.png')!r})\n"
+        "print('matplotlib' in sys.modules)\n"
+    )
+    completed = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(_script()),
+                               capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.strip().endswith("False")
+    assert Image.open(tmp_path / "3d.png").width == 800
+
+
+@pytest.mark.parametrize("detection", fpg.DETECTION_ENGINES)
+@pytest.mark.parametrize("factor", [2, 4])
+def test_downscaled_detection_matches_full_resolution(detection, factor):
+    # Thin walls must survive the downscale to keep rooms apart
+    gray = np.asarray(generate_synthetic_plan(1600, 1200, 12, wall_thickness=2).convert("L"))
+    rooms, _ = fpg.detect_rooms_multiscale(gray, detection)
+    scaled, label_map = fpg.detect_rooms_multiscale(gray, detection, factor)
+
+    check = fpg.compare_room_detections(rooms, scaled, tolerance=factor)
+    assert check["within_tolerance"] and check["rooms"] == 12
+    if label_map is not None:
+        assert label_map.shape == gray.shape
+        for room in scaled:
+            x1, y1, x2, y2 = room["bbox"]
+            assert label_map[(y1 + y2) // 2, (x1 + x2) // 2] == room["label"]
+
+
+def test_downscale_keeps_the_darkest_pixel_of_each_block():
+    gray = np.full((9, 10), 255, dtype=np.uint8)
+    gray[4, :] = 0
+    gray[8, 9] = 10
+    small = fpg.downscale_for_detection(gray, 4)
+    assert small.shape == (3, 3)
+    assert (small[1] == 0).all() and small[2, 2] == 10 and small[0].min() == 255
+
+
+def test_bytes_entry_point_matches_the_file_outputs(plan_path, tmp_path):
+    generator = fpg.FloorPlanGenerator()
+    fpg.process_floor_plan(generator, plan_path, str(tmp_path / "out.png"), export_data=str(tmp_path / "out.json"))
+    with open(plan_path, "rb") as f:
+        data = f.read()
+
+    # Encoded bytes and an already decoded array give the same outputs as the files
+    for source in (data, np.asarray(Image.open(plan_path).convert("RGB"))):
+        result = fpg.process_floor_plan_bytes(generator, source, export_data=True)
+        assert np.array_equal(np.asarray(Image.open(io.BytesIO(result["enhanced"]))),
+                              np.asarray(Image.open(tmp_path / "out.png")))
+        with open(tmp_path / "out.json") as f:
+            saved = json.load(f)
+        # Only the path of the source differs
+        assert json.loads(json.dumps(result["data"]))["rooms"] == saved["rooms"]
+        assert result["data"]["image"] == dict(saved["image"], path=None)
+
+
+def test_stdin_to_stdout_frames_every_output(plan_path):
+    with open(plan_path, "rb") as f:
+        data = f.read()
+    raw = subprocess.run([sys.executable, _script(), "-"], input=data, capture_output=True, check=True).stdout
+    framed = subprocess.run([sys.executable, _script(), "-", "--3d", "--export-data", "-"], input=data,
+                            capture_output=True, check=True).stdout
+
+    # One output is written raw, several as named frames
+    frames = dict(fpg.read_frames(io.BytesIO(framed)))
+    assert list(frames) == ["enhanced", "visualization3D", "data"]
+    assert frames["enhanced"] == raw and raw.startswith(b"\x89PNG")
+    assert Image.open(io.BytesIO(frames["visualization3D"])).width == 800
+    assert len(json.loads(frames["data"])["rooms"]) == 12
+
+
+def test_fused_post_processing_matches_the_image_enhance_passes(plan_path):
+    from PIL import ImageEnhance
+    generator = fpg.FloorPlanGenerator(contrast=1.0, sharpness=1.0)
+    raw = np.asarray(generator.enhance_floor_plan(plan_path)).copy()
+
+    def difference(fused, reference):
+        return np.abs(fused.astype(np.int16) - np.asarray(reference, dtype=np.int16)).max()
+
+    contrasted = ImageEnhance.Contrast(Image.fromarray(raw)).enhance(1.2)
+    sharpened = ImageEnhance.Sharpness(Image.fromarray(raw)).enhance(1.5)
+    both = ImageEnhance.Sharpness(contrasted).enhance(1.5)
+
+    # Each step is within one grey level of its pass, the chain within two
+    assert difference(fpg.post_process_array(raw.copy(), contrast=1.2), contrasted) <= 1
+    assert difference(fpg.post_process_array(raw.copy(), sharpness=1.5), sharpened) <= 1
+    assert difference(fpg.post_process_array(raw.copy(), 1.2, 1.5), both) <= 2
+    assert np.array_equal(fpg.post_process_array(raw.copy()), raw)
+
+
+def test_room_fills_within_bounding_boxes_match_full_frame_masks():
+    wall_mask = np.zeros((300, 400), dtype=bool)
+    wall_mask[::37] = True
+    triangle = np.array([[[10, 10]], [[390, 40]], [[60, 290]]], dtype=np.int32)
+    # A room reaching past the image border and a later room overlapping the first
+    rooms = [
+        {"type": "bedroom", "contour": triangle, "bbox": (10, 10, 391, 291)},
+        {"type": "kitchen", "contour": np.array([[[-20, 150]], [[200, 120]], [[150, 320]]], dtype=np.int32),
+         "bbox": (-20, 120, 201, 321)},
+        {"type": "hallway", "bbox": (300, 200, 380, 260)}
+    ]
+    class_map, room_types = fpg.build_class_map(wall_mask, rooms)
+    assert room_types == ["bedroom", "kitchen", "hallway"]
+
+    expected = wall_mask.astype(np.uint8)
+    for index, room in enumerate(rooms[:2]):
+        mask = np.zeros(wall_mask.shape, dtype=np.uint8)
+        cv2.drawContours(mask, [room["contour"]], 0, 255, -1)
+        expected[(mask > 0) & ~wall_mask] = index + 2
+    expected[200:261, 300:381] = 4
+    expected[[200, 260], 300:381] = 1
+    expected[200:261, [300, 380]] = 1
+    assert np.array_equal(class_map, expected)
+
+    # Any tile of the plan fills like the same window of the whole plan
+    for top, left in [(0, 0), (100, 150), (250, 330)]:
+        tile, _ = fpg.build_class_map(wall_mask[top:top + 64, left:left + 80], rooms, origin=(left, top),
+                                      image_size=(400, 300))
+        assert np.array_equal(tile, class_map[top:top + 64, left:left + 80])
+
+
+def test_room_geometry_matches_opencv_measurements():
+    l_shape = np.array([(50, 50), (450, 50), (450, 200), (250, 200), (250, 350), (50, 350)], dtype=np.int32)
+    triangle = np.array([(500, 60), (700, 300), (520, 340)], dtype=np.int32)
+    rooms = [{"type": "living_room", "bbox": (50, 50, 451, 351), "contour": l_shape.reshape(-1, 1, 2)},
+             {"type": "kitchen", "bbox": (500, 60, 701, 341), "contour": triangle.reshape(-1, 1, 2)}]
+    geometry = fpg.room_geometry(rooms)
+
+    for index, contour in enumerate((l_shape, triangle)):
+        moments = cv2.moments(contour)
+        assert geometry["areas"][index] == pytest.approx(cv2.contourArea(contour))
+        assert geometry["perimeters"][index] == pytest.approx(cv2.arcLength(contour, True))
+        assert geometry["centroids"][index] == pytest.approx((moments["m10"] / moments["m00"],
+                                                              moments["m01"] / moments["m00"]))
+    # The L-shaped room is measured by its outline, not its bounding box
+    assert geometry["areas"][0] < 400 * 300
+    assert [len(polygon) for polygon in geometry["polygons"]] == [6, 3]
+
+
+@pytest.mark.parametrize("extension", [".npz", ".jsonl"])
+def test_compact_data_exports_hold_the_json_data(plan_path, tmp_path, extension):
+    generator = fpg.FloorPlanGenerator(pixels_per_meter=50)
+    data = generator.export_floor_plan_data(plan_path, str(tmp_path / f"plan{extension}"))
+    rooms = data["rooms"]
+    assert data["dimensions"]["pixels_per_meter"] == 50 and len(rooms) == 12
+
+    if extension == ".jsonl":
+        with open(tmp_path / "plan.jsonl") as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 1 and json.loads(lines[0]) == json.loads(json.dumps(data))
+        return
+
+    with np.load(tmp_path / "plan.npz") as columns:
+        assert columns["size"].tolist() == [800, 600] and float(columns["pixels_per_meter"]) == 50
+        assert columns["room_types"].tolist() == [room["type"] for room in rooms]
+        assert columns["areas"].tolist() == [room["dimensions"]["area"] for room in rooms]
+        assert columns["bboxes"].tolist() == [list(room["position"].values()) for room in rooms]
+        polygons = np.split(columns["polygon_points"], np.cumsum(columns["polygon_lengths"])[:-1])
+        assert [polygon.tolist() for polygon in polygons] == [room["polygon"] for room in rooms]
+
+
+def test_svg_draws_each_room_without_raster_work(plan_path, tmp_path):
+    from xml.etree import ElementTree
+    generator = fpg.FloorPlanGenerator()
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    generator.render_svg(analysis, str(tmp_path / "plan.svg"))
+    generator.enhance_floor_plan(plan_path, str(tmp_path / "plan.png"))
+
+    svg = "{http://www.w3.org/2000/svg}"
+    root = ElementTree.parse(tmp_path / "plan.svg").getroot()
+    assert (root.get("width"), root.get("height")) == ("800", "600")
+    fills = [path.get("fill") for path in root.find(f"{svg}g").iter(f"{svg}path")]
+    assert fills == [fpg.svg_color(fpg.COLOR_SCHEMES["modern"][room["type"]]) for room in analysis.rooms]
+    labels = [text.text for text in root.iter(f"{svg}text")]
+    assert all(room["type"].replace("_", " ").title() in labels for room in analysis.rooms)
+
+    # Drawn from the rooms alone, a fraction of the size of the raster
+    assert "wall_mask" not in analysis.__dict__
+    assert os.path.getsize(tmp_path / "plan.svg") < os.path.getsize(tmp_path / "plan.png") / 4
+
+
+def test_renditions_are_written_from_one_render(plan_path, tmp_path):
+    output = str(tmp_path / "plan.png")
+    result = fpg.process_floor_plan(fpg.FloorPlanGenerator(), plan_path, output,
+                                    renditions="thumbnail:webp,200:jpeg,200:png,full:webp")
+    assert set(result["renditions"]) == {"thumbnail.webp", "200.jpeg", "200.png", "full.webp"}
+
+    sizes = {}
+    for key, path in result["renditions"].items():
+        with Image.open(path) as image:
+            sizes[key] = (image.format, image.size)
+    assert sizes == {"thumbnail.webp": ("WEBP", (320, 240)), "200.jpeg": ("JPEG", (200, 150)),
+                     "200.png": ("PNG", (200, 150)), "full.webp": ("WEBP", (800, 600))}
+    # Lossless WebP of the full size keeps the render's pixels
+    with Image.open(result["renditions"]["full.webp"]) as full, Image.open(output) as enhanced:
+        assert np.array_equal(np.asarray(full.convert("RGB")), np.asarray(enhanced.convert("RGB")))
+
+
+@pytest.mark.parametrize("spec, message", [("poster", "Unknown rendition 'poster'"),
+                                           ("thumbnail:gif", "Unknown rendition format 'gif'"),
+                                           ("0:png", "Unknown rendition '0'")])
+def test_invalid_renditions_are_rejected(spec, message):
+    with pytest.raises(ValueError, match=message):
+        fpg.parse_renditions(spec)
+
+
+@pytest.mark.parametrize("detection", fpg.DETECTION_ENGINES)
+def test_threaded_outputs_match_serial_outputs(plan_path, tmp_path, detection):
+    outputs = []
+    for threads in (1, 4):
+        output = str(tmp_path / f"threads{threads}.png")
+        result = fpg.process_floor_plan(fpg.FloorPlanGenerator(threads=threads), plan_path, output, three_d=True,
+                                        export_data=str(tmp_path / f"threads{threads}.json"), detection=detection)
+        with Image.open(output) as enhanced, Image.open(result["visualization3D"]) as rendered:
+            outputs.append((np.asarray(enhanced).copy(), np.asarray(rendered).copy(), result["data"]))
+
+    (serial, serial_3d, serial_data), (threaded, threaded_3d, threaded_data) = outputs
+    assert np.array_equal(serial, threaded) and np.array_equal(serial_3d, threaded_3d)
+    assert threaded_data == serial_data
+    assert fpg.get_thread_pool(4) is fpg.get_thread_pool(4) and fpg.get_thread_pool(1) is None
+
+
+def test_plan_over_its_pixel_budget_is_degraded(plan_path):
+    generator = fpg.FloorPlanGenerator()
+    analysis = fpg.FloorPlanAnalysis(plan_path)
+    admitted, small, three_d, report = fpg.admit_floor_plan(generator, analysis, 120_000, three_d=True)
+
+    # The budget is checked from the image header, before any decode
+    assert "image" not in analysis.__dict__
+    assert report["applied"] == ["downscale", "skip_3d", "fast_encode"] and report["pixels"] == 480_000
+    assert small.width * small.height <= 120_000 and small.size == (400, 300) and not three_d
+    assert (admitted.dpi, admitted.compress_level) == (150, fpg.FAST_COMPRESS_LEVEL)
+    assert (generator.dpi, generator.compress_level) == (300, fpg.PNG_COMPRESS_LEVEL)
+
+    assert fpg.admit_floor_plan(generator, analysis, 480_000, three_d=True)[2:] == (True, None)
+    with pytest.raises(ValueError, match="exceeds the pixel budget"):
+        fpg.admit_floor_plan(generator, analysis, 120_000, fpg.parse_degradations("none"))
+
+
+def test_jobs_arriving_during_a_spike_get_a_lower_budget(plan_path, monkeypatch):
+    monkeypatch.setattr(fpg, "MIN_ADMITTED_PIXELS", 100_000)
+    server = fpg._JobServer.__new__(fpg._JobServer)
+    server.pixel_budget, server.admitted_pixels, server.lock = 1_000_000, 0, fpg.threading.Lock()
+
+    # Two plans fit; the next ones get what is left, but never less than MIN_ADMITTED_PIXELS
+    jobs = [{"input": plan_path} for _ in range(4)]
+    held = [server._admit(job) for job in jobs]
+    assert held == [480_000, 480_000, 100_000, 100_000]
+    assert "max_megapixels" not in jobs[0] and "max_megapixels" not in jobs[1]
+    assert jobs[2]["max_megapixels"] == jobs[3]["max_megapixels"] == pytest.approx(0.1)
+    assert server.admitted_pixels == sum(held)
+
+
+def test_session_patches_rebuild_the_edited_render(plan_path, tmp_path):
+    rooms = fpg.FloorPlanAnalysis(plan_path).rooms
+    fpg._RENDER_SESSIONS.clear()
+    job = {"input": plan_path, "session": "patches"}
+    first = fpg.run_job(job)
+    assert first["dirty"] == [[0, 0, 800, 600]]
+    canvas = np.asarray(Image.open(io.BytesIO(base64.b64decode(first["patches"][0])))).copy()
+
+    # Move and relabel one room, then remove another
+    edited = _recoloured(rooms, 5)
+    x1, y1, x2, y2 = edited[5]["bbox"]
+    edited[5] = {"type": edited[5]["type"], "bbox": [x1 + 6, y1 + 4, x2 - 6, y2 - 4]}
+    for edit in (edited, edited[:-1]):
+        update = fpg.run_job(dict(job, room_data=edit))
+        assert update["success"] and 0 < len(update["dirty"]) == len(update["patches"])
+        # Only the edited room's region is sent back
+        assert sum((right - left) * (bottom - top) for left, top, right, bottom in update["dirty"]) < 800 * 600 / 4
+        for (left, top, right, bottom), patch in zip(update["dirty"], update["patches"]):
+            canvas[top:bottom, left:right] = np.asarray(Image.open(io.BytesIO(base64.b64decode(patch))))
+
+    fpg._RENDER_SESSIONS.clear()
+    fpg.run_job(dict(job, room_data=edited[:-1], output=str(tmp_path / "edited.png")))
+    assert np.array_equal(canvas, np.asarray(Image.open(tmp_path / "edited.png")))
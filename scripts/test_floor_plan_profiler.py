@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Profiler tests - Stage measurements and the JSON report
+Run with: python -m pytest -q scripts
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+import floor_plan_profiler as profiler
+from floor_plan_profiler import StageProfiler
+from benchmark_floor_plans import generate_synthetic_plan
+
+
+def test_nested_stage_time_is_only_counted_once():
+    stage_profiler = StageProfiler()
+    with stage_profiler.stage("3d"):
+        time.sleep(0.02)
+        with stage_profiler.stage("detect"):
+            time.sleep(0.05)
+            # Re-entering a running stage is not a new call
+            with stage_profiler.stage("detect"):
+                pass
+
+    stages = stage_profiler.stages
+    assert stages["detect"]["calls"] == 1 and stages["3d"]["calls"] == 1
+    # The outer stage keeps only its own 20 ms, not the 50 ms spent detecting
+    assert stages["detect"]["wall_seconds"] >= 0.05
+    assert 0.02 <= stages["3d"]["wall_seconds"] < stages["detect"]["wall_seconds"]
+
+    report = json.loads(json.dumps(stage_profiler.report()))
+    assert set(report["stages"]) == {"3d", "detect"}
+    assert report["total_wall_seconds"] >= 0.07 and report["pid"] == os.getpid()
+
+
+def test_stages_are_not_recorded_without_an_active_profiler():
+    with profiler.stage("detect"):
+        profiler.annotate(rooms=3)
+
+    with profiler.profiling() as stage_profiler:
+        with profiler.stage("detect"):
+            profiler.annotate(rooms=3)
+    with profiler.profiling(False) as disabled:
+        assert disabled is None
+
+    assert profiler._ACTIVE is None
+    assert list(stage_profiler.stages) == ["detect"] and stage_profiler.metadata == {"rooms": 3}
+
+
+def test_profile_flag_writes_one_report_on_stdout(tmp_path):
+    path = tmp_path / "plan.png"
+    generate_synthetic_plan(400, 300, 4).save(path)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "floor_plan_generator.py")
+    completed = subprocess.run([sys.executable, script, str(path), "-o", str(tmp_path / "out.png"), "--profile"],
+                               capture_output=True, text=True, check=True)
+
+    # Progress messages move to stderr so stdout is the report alone
+    report = json.loads(completed.stdout)
+    assert report["image"]["width"] == 400 and report["image"]["height"] == 300 and report["rooms"] == 4
+    assert {"decode", "detect", "walls", "fill", "labels", "dimensions", "enhance", "encode"} <= set(report["stages"])
+    assert "saved to" in completed.stderr
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Similarity tests - Perceptual hashes, the near-duplicate index and its reuse
+Run with: python -m pytest -q scripts
+"""
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+
+import floor_plan_generator as fpg
+from floor_plan_cache import FloorPlanCache
+from floor_plan_similarity import MAX_INDEX_DISTANCE, PENDING_CAPACITY, PerceptualIndex, hamming_distances, \
+    perceptual_hash
+from benchmark_floor_plans import generate_synthetic_plan
+
+
+def _hash(plan):
+    return perceptual_hash(fpg.FloorPlanAnalysis(np.asarray(plan)).signature)
+
+
+def _distance(a, b):
+    return int(hamming_distances(np.array([a], dtype=np.uint64), b)[0])
+
+
+def test_hash_survives_resizing_and_recompression():
+    plan = generate_synthetic_plan(800, 600, 12)
+    jpeg = io.BytesIO()
+    plan.save(jpeg, "JPEG", quality=70)
+
+    original = _hash(plan)
+    for copy in (plan.resize((1000, 750)), plan.resize((640, 480)), Image.open(jpeg)):
+        assert _distance(original, _hash(copy)) <= MAX_INDEX_DISTANCE
+    for other in (generate_synthetic_plan(800, 600, 12, seed=3), generate_synthetic_plan(800, 600, 6)):
+        assert _distance(original, _hash(other)) > 4 * MAX_INDEX_DISTANCE
+
+
+def test_index_finds_every_hash_within_the_distance(tmp_path):
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2 ** 63, PENDING_CAPACITY + 500, dtype=np.uint64)
+    query = int(hashes[0])
+    # Plant near copies of the query, one with other detection parameters
+    flips = [0, 1, 2, 3, 4, 5]
+    hashes[1:7] = [query ^ int(sum(1 << (7 * bit) for bit in range(flip))) for flip in flips]
+    records = [(int(value), (100, 80), 1 if i != 3 else 2, f"{i:064x}") for i, value in enumerate(hashes)]
+
+    path = str(tmp_path / "similar.idx")
+    index = PerceptualIndex(path)
+    for phash, size, params, key in records:
+        index.add(phash, size, params, key)
+
+    expected = sorted((_distance(phash, query), key) for phash, _, params, key in records
+                      if params == 1 and _distance(phash, query) <= MAX_INDEX_DISTANCE)
+    assert [(distance, key) for distance, _, key in index.query(query, 1)] == expected
+    assert [distance for distance, _, _ in index.query(query, 1)] == [0, 0, 1, 3, 4]
+
+    # Another process opening the index sees every record
+    reopened = PerceptualIndex(path)
+    assert len(reopened) == len(records) and reopened.query(query, 1) == index.query(query, 1)
+    with pytest.raises(ValueError):
+        index.query(query, 1, MAX_INDEX_DISTANCE + 1)
+
+
+def test_resized_upload_reuses_the_original_rooms(tmp_path):
+    plan = generate_synthetic_plan(800, 600, 12)
+    plan.save(tmp_path / "plan.png")
+    plan.resize((1000, 750)).save(tmp_path / "resized.png")
+    cache = FloorPlanCache(str(tmp_path / "cache"))
+    generator = fpg.FloorPlanGenerator()
+
+    fpg.process_floor_plan(generator, str(tmp_path / "plan.png"), str(tmp_path / "plan_out.png"), cache=cache)
+    result = fpg.process_floor_plan(generator, str(tmp_path / "resized.png"), str(tmp_path / "resized_out.png"),
+                                    export_data=str(tmp_path / "resized.json"), cache=cache)
+
+    # The first upload missed the empty index, the resized one hit it
+    assert (cache.stats["similar_hits"], cache.stats["similar_misses"]) == (1, 1)
+    assert cache.hit_rates()["similar"] == 0.5
+    assert len(result["data"]["rooms"]) == 12
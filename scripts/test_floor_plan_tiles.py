@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Floor Plan Tiles tests - Tile iteration, streamed PNG output and tiled rendering
+Run with: python -m pytest -q scripts
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import floor_plan_generator as fpg
+from floor_plan_tiles import MIN_TILE_SIZE, inner_slices, iter_tiles, tile_size_for_budget, write_png
+from benchmark_floor_plans import generate_synthetic_plan
+
+
+def test_tiles_cover_the_image_once_with_clipped_halos():
+    covered = np.zeros((150, 230), dtype=np.int32)
+    for rows, cols, halo_rows, halo_cols in iter_tiles(150, 230, 64, halo=2):
+        covered[rows, cols] += 1
+        inner_rows, inner_cols = inner_slices(rows, cols, halo_rows, halo_cols)
+        halo = np.arange(150 * 230).reshape(150, 230)[halo_rows, halo_cols]
+        assert np.array_equal(halo[inner_rows, inner_cols], np.arange(150 * 230).reshape(150, 230)[rows, cols])
+        assert halo_rows.start == max(rows.start - 2, 0) and halo_cols.stop == min(cols.stop + 2, 230)
+    assert (covered == 1).all()
+
+    assert tile_size_for_budget(1) == MIN_TILE_SIZE
+    assert tile_size_for_budget(4 * tile_size_for_budget(2 ** 20, halo=3) ** 2 * 32, halo=3) > \
+        tile_size_for_budget(2 ** 20, halo=3)
+
+
+def test_streamed_png_matches_the_array(tmp_path):
+    rgb = np.random.default_rng(0).integers(0, 256, (97, 61, 3), dtype=np.uint8)
+    released = []
+    write_png(str(tmp_path / "out.png"), rgb, dpi=(300, 300), rows_per_chunk=16, release=released.append)
+
+    with Image.open(tmp_path / "out.png") as image:
+        assert np.array_equal(np.asarray(image.convert("RGB")), rgb)
+        assert tuple(round(value) for value in image.info["dpi"]) == (300, 300)
+    assert sum(rows.stop - rows.start for rows in released) == 97
+
+
+@pytest.mark.parametrize("detection_scale", [1, 2])
+def test_tiled_output_matches_the_untiled_render(tmp_path, detection_scale):
+    path = tmp_path / "plan.png"
+    generate_synthetic_plan(900, 700, 12).save(path)
+    generator = fpg.FloorPlanGenerator()
+
+    expected = generator.enhance_floor_plan(fpg.FloorPlanAnalysis(str(path), detection_scale=detection_scale))
+    # A budget small enough for tiles of a couple of hundred pixels
+    generator.enhance_floor_plan_tiled(fpg.FloorPlanAnalysis(str(path), detection_scale=detection_scale),
+                                       str(tmp_path / "tiled.png"), memory_budget=2 * 1024 * 1024,
+                                       scratch_dir=str(tmp_path))
+    with Image.open(tmp_path / "tiled.png") as tiled:
+        assert np.array_equal(np.asarray(tiled.convert("RGB")), np.asarray(expected))